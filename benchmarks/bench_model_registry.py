@@ -0,0 +1,92 @@
+"""
+Micro-benchmark: per-call overhead of building Vertex AI model objects.
+
+Compares the old ``generate`` path, which built a ``GenerativeModel``, a
+``GenerationConfig`` and four ``SafetySetting`` objects on every call, with
+the ``ModelRegistry`` path. The Vertex client is stubbed: the SDK objects are
+real, but ``generate_content`` returns a canned response without any network
+traffic, so the numbers isolate the construction overhead.
+
+Usage:
+    PYTHONPATH=functions python benchmarks/bench_model_registry.py [iterations]
+"""
+
+import sys
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import vertexai
+from google.auth.credentials import AnonymousCredentials
+from vertexai.generative_models import GenerativeModel
+
+from my_function.audiences_app.audiences_agent import base_functions
+from my_function.audiences_app.audiences_agent.model_registry import (
+    build_generation_config,
+    build_safety_settings,
+)
+
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "filter_clause": {"type": "string"},
+        "columns_used": {"type": "array", "items": {"type": "string"}},
+    },
+}
+CONFIG = SimpleNamespace(gcp=SimpleNamespace(ai_model="gemini-2.5-pro"))
+CANNED = SimpleNamespace(
+    candidates=[
+        SimpleNamespace(
+            content=SimpleNamespace(
+                parts=[SimpleNamespace(text='{"filter_clause": ""}')]
+            )
+        )
+    ]
+)
+
+
+def stub_generate_content(self, *args, **kwargs):
+    return CANNED
+
+
+def legacy_generate(prompt, response_schema=None):
+    model = GenerativeModel(CONFIG.gcp.ai_model)
+    model_config = build_generation_config(response_schema)
+    safety_config = build_safety_settings()
+    responses = model.generate_content(
+        prompt,
+        generation_config=model_config,
+        safety_settings=safety_config,
+        stream=False,
+    )
+    return str(responses.candidates[0].content.parts[0].text)
+
+
+def time_calls(fn, iterations):
+    fn("warm up", RESPONSE_SCHEMA)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn("prompt", RESPONSE_SCHEMA)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main(iterations: int = 2000) -> None:
+    vertexai.init(
+        project="bench", location="us-central1", credentials=AnonymousCredentials()
+    )
+    with patch.object(
+        GenerativeModel, "generate_content", stub_generate_content
+    ), patch.object(base_functions, "get_config", return_value=CONFIG), patch.object(
+        base_functions, "init_vertex"
+    ):
+        legacy_us = time_calls(legacy_generate, iterations)
+        registry_us = time_calls(base_functions.generate, iterations)
+
+    print(f"iterations:            {iterations}")
+    print(f"per-call construction: {legacy_us:8.1f} us/call")
+    print(f"model registry:        {registry_us:8.1f} us/call")
+    print(f"overhead removed:      {legacy_us - registry_us:8.1f} us/call")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
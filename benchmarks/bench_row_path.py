@@ -0,0 +1,118 @@
+"""
+Micro-benchmark: sample-row stringification with and without pandas.
+
+Compares the old ``fetch_data_as_strings`` body (rows -> list of dicts ->
+``DataFrame`` -> ``astype(str)`` -> ``to_dict``) with ``rows_as_strings``,
+which stringifies the row mappings directly. The BigQuery result is a canned
+list of rows, so the numbers isolate the per-request conversion cost.
+
+Each variant also runs in a fresh interpreter to report peak RSS. Note that
+``google-cloud-bigquery`` imports pandas itself when it is installed, so in
+the server process the saving is per request, not the pandas import.
+
+Usage:
+    PYTHONPATH=functions python benchmarks/bench_row_path.py [iterations]
+"""
+
+import datetime
+import subprocess
+import sys
+import time
+import tracemalloc
+
+COLUMNS = 8
+ROWS = 5
+
+# ru_maxrss is inherited across fork on Linux, so read the child's own
+# high-water mark from /proc where available
+RSS_SCRIPT = """
+import resource, sys
+sys.path.insert(0, "benchmarks")
+import bench_row_path as bench
+fn = bench.legacy_rows_as_strings if sys.argv[1] == "legacy" else bench.rows_as_strings
+for _ in range(int(sys.argv[2])):
+    fn(bench.ROW_DATA)
+try:
+    with open("/proc/self/status") as f:
+        print(next(l.split()[1] for l in f if l.startswith("VmHWM:")))
+except OSError:
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def make_rows():
+    stamp = datetime.datetime(2024, 5, 1, 12, 30)
+    return [
+        {f"col_{c}": (r * c, f"value {r}", stamp, None)[c % 4] for c in range(COLUMNS)}
+        for r in range(ROWS)
+    ]
+
+
+ROW_DATA = make_rows()
+
+
+def legacy_rows_as_strings(rows):
+    import pandas as pd
+
+    records = [dict(row.items()) for row in rows]
+    return pd.DataFrame(records).astype(str).to_dict(orient="records")
+
+
+def rows_as_strings(rows):
+    # Same body as agent.rows_as_strings, inlined so the RSS subprocess does
+    # not import the agent (and with it the Google SDKs)
+    return [{key: str(value) for key, value in row.items()} for row in rows]
+
+
+def time_calls(fn, iterations):
+    fn(ROW_DATA)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(ROW_DATA)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def peak_alloc(fn):
+    tracemalloc.start()
+    fn(ROW_DATA)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def peak_rss_kb(variant, iterations):
+    out = subprocess.run(
+        [sys.executable, "-c", RSS_SCRIPT, variant, str(iterations)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return int(out.stdout.strip())
+
+
+def main(iterations: int = 2000) -> None:
+    from my_function.audiences_app.audiences_agent.agent import (
+        rows_as_strings as agent_rows_as_strings,
+    )
+
+    assert agent_rows_as_strings(ROW_DATA) == rows_as_strings(ROW_DATA)
+
+    legacy_us = time_calls(legacy_rows_as_strings, iterations)
+    rows_us = time_calls(rows_as_strings, iterations)
+    legacy_rss = peak_rss_kb("legacy", iterations)
+    rows_rss = peak_rss_kb("rows", iterations)
+
+    print(f"iterations:        {iterations} ({ROWS} rows x {COLUMNS} columns)")
+    print(f"DataFrame path:    {legacy_us:8.1f} us/call")
+    print(f"row path:          {rows_us:8.1f} us/call")
+    print(
+        f"peak alloc/call:   {peak_alloc(legacy_rows_as_strings):8.1f} KiB -> "
+        f"{peak_alloc(rows_as_strings):.1f} KiB"
+    )
+    print(
+        f"peak RSS:          {legacy_rss / 1024:8.1f} MiB -> {rows_rss / 1024:.1f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,142 @@
+"""
+Import-time profile of the Django views module (Cloud Run cold start).
+
+Runs ``python -X importtime`` in a fresh interpreter that sets up Django and
+imports ``ui.views``, then reports the cumulative import time and the slowest
+top-level modules. ``--check`` compares the run with the checked-in baseline
+and fails if the import got much slower or if one of the heavy SDKs, which
+must only load on first use or in the warm-up thread, is imported.
+
+Usage:
+    python benchmarks/importtime.py                 # print the profile
+    python benchmarks/importtime.py --check         # regression check
+    python benchmarks/importtime.py --update        # rewrite the baseline
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "importtime_baseline.json")
+TARGET = "ui.views"
+# Modules that must not be imported by the views module itself
+DEFERRED_MODULES = (
+    "vertexai",
+    "google.cloud.aiplatform",
+    "google.cloud.bigquery",
+    "google.cloud.storage",
+    "pandas",
+)
+# Import times vary between machines; only flag clear regressions (the
+# eager-import version of the module took over 3 s)
+TOLERANCE = 0.5
+SLACK_US = 50_000
+
+SCRIPT = f"""
+import django
+django.setup()
+import {TARGET}
+"""
+
+
+def run_importtime(runs: int = 3) -> Tuple[int, Dict[str, int]]:
+    """Best-of-``runs`` cumulative microseconds for TARGET, plus top-level modules."""
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(
+            [
+                os.path.join(ROOT, "functions"),
+                os.path.join(ROOT, "functions", "my_function", "audiences_app"),
+            ]
+        ),
+        DJANGO_SETTINGS_MODULE="config.settings",
+    )
+    best: Tuple[int, Dict[str, int]] = (sys.maxsize, {})
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", SCRIPT],
+            cwd=ROOT,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        modules = parse_importtime(out.stderr)
+        if modules.get(TARGET, sys.maxsize) < best[0]:
+            best = (modules[TARGET], modules)
+    return best
+
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """Cumulative microseconds per module, keeping the first import of each."""
+    modules: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules.setdefault(name.strip(), int(cumulative))
+    return modules
+
+
+def top_level(modules: Dict[str, int], count: int = 15) -> List[Tuple[str, int]]:
+    roots: Dict[str, int] = {}
+    for name, us in modules.items():
+        root = name.split(".")[0]
+        roots[root] = max(roots.get(root, 0), us)
+    return sorted(roots.items(), key=lambda item: -item[1])[:count]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--update", action="store_true")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    total_us, modules = run_importtime(args.runs)
+    print(f"{TARGET}: {total_us / 1000:.1f} ms cumulative")
+    for name, us in top_level(modules):
+        print(f"  {name:<30} {us / 1000:8.1f} ms")
+
+    loaded = [m for m in DEFERRED_MODULES if m in modules]
+    if args.update:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "target": TARGET,
+                    "python": platform.python_version(),
+                    "cumulative_us": total_us,
+                    "top_level_us": dict(top_level(modules)),
+                },
+                f,
+                indent=2,
+            )
+            f.write("\n")
+        print(f"baseline written to {os.path.relpath(BASELINE_PATH, ROOT)}")
+
+    if not args.check:
+        return 0
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        baseline = json.load(f)
+    limit_us = baseline["cumulative_us"] * (1 + TOLERANCE) + SLACK_US
+    failures = []
+    if loaded:
+        failures.append(f"{TARGET} imports deferred modules: {', '.join(loaded)}")
+    if total_us > limit_us:
+        failures.append(
+            f"{TARGET} import took {total_us / 1000:.1f} ms, "
+            f"baseline {baseline['cumulative_us'] / 1000:.1f} ms "
+            f"(+{TOLERANCE:.0%} + {SLACK_US / 1000:.0f} ms allowed)"
+        )
+    for failure in failures:
+        print("FAIL:", failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Load test: WSGI thread pool vs. a single ASGI event loop.
+
+Both paths run the real audience pipeline against stubbed backends: context
+blobs come from memory, the Gemini call sleeps for ``--llm-latency`` and the
+BigQuery count job finishes ``--query-latency`` seconds after submission.
+
+The WSGI path pushes every request through ``run_audience_agent`` on a pool
+of ``--workers`` threads, the same bound a gunicorn deployment has. The ASGI
+path runs all requests concurrently through ``arun_audience_agent`` on one
+event loop.
+
+Usage:
+    PYTHONPATH=functions python benchmarks/load_test_async.py --requests 64
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from my_function.audiences_app.audiences_agent import agent, async_agent
+
+CONFIG = SimpleNamespace(
+    gcp=SimpleNamespace(
+        project_id="bench",
+        dataset_id="ccdp_demo",
+        table_name="web_tb_event",
+        bucket_name="bench",
+        schema_blob_name="schema.json",
+        col_values_blob_name="values.json",
+        ai_model="gemini-stub",
+    )
+)
+BLOBS = {
+    "schema.json": {
+        "columns": [
+            {"name": "cart_add", "data_type": "INTEGER", "description": "Cart adds"}
+        ]
+    },
+    "values.json": {"cart_add": [0, 1]},
+}
+RESPONSE = (
+    '{"filter_clause": "cart_add = 1", "columns_used": ["cart_add"], '
+    '"attribute_name": "users who added to cart", "attribute_description": "d"}'
+)
+
+
+class StubQueryJob:
+    job_id = "stub"
+
+    def __init__(self, latency):
+        self._ready_at = time.monotonic() + latency
+
+    def done(self):
+        return time.monotonic() >= self._ready_at
+
+    def result(self):
+        remaining = self._ready_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        return [{"matching_users": 42}]
+
+
+class StubBigQueryClient:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def query(self, sql, job_config=None):
+        return StubQueryJob(self.latency)
+
+
+def summarize(name, latencies, elapsed):
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(
+        f"{name:<5} requests={len(latencies):<4} wall={elapsed:6.2f}s "
+        f"throughput={len(latencies) / elapsed:7.2f} req/s "
+        f"p50={statistics.median(latencies):5.2f}s p95={p95:5.2f}s"
+    )
+
+
+def run_wsgi(n_requests, workers, client):
+    def one(i):
+        start = time.perf_counter()
+        agent.run_audience_agent(
+            f"goal {i}", config=CONFIG, client=client, use_cache=False
+        )
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = list(pool.map(one, range(n_requests)))
+    summarize("WSGI", latencies, time.perf_counter() - start)
+
+
+async def run_asgi(n_requests, client):
+    async def one(i):
+        start = time.perf_counter()
+        await async_agent.arun_audience_agent(
+            f"goal {i}", config=CONFIG, client=client, use_cache=False
+        )
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one(i) for i in range(n_requests)))
+    summarize("ASGI", latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--query-latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    def stub_generate(prompt, response_schema=None):
+        time.sleep(args.llm_latency)
+        return RESPONSE
+
+    async def stub_generate_async(prompt, response_schema=None):
+        await asyncio.sleep(args.llm_latency)
+        return RESPONSE
+
+    client = StubBigQueryClient(args.query_latency)
+    with patch.object(
+        agent, "load_context_from_gcs", lambda bucket_name, blob_name: BLOBS[blob_name]
+    ), patch.object(agent, "generate", stub_generate), patch.object(
+        async_agent, "generate_async", stub_generate_async
+    ):
+        run_wsgi(args.requests, args.workers, client)
+        asyncio.run(run_asgi(args.requests, client))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Throughput of the full audience pipeline on offline backends.
+
+Runs ``agent.run_audience_agent`` (context load, prompt build, Gemini call,
+parse, clause validation, dry run and count) concurrently with no network
+access, so the numbers show what the agent itself sustains:
+
+- ``--root`` replays a recording made with ``agent.backend: record`` (see
+  ``audiences_agent.backends``); goals must be ones that were recorded
+- ``--parquet`` counts on a local Parquet extract of the event table with
+  DuckDB instead of the recorded BigQuery results
+- ``--demo`` builds a synthetic event table, context files and a canned LLM
+  in a temporary directory, for runs without any recording
+
+The response cache is bypassed so every request runs every stage.
+
+Usage:
+    PYTHONPATH=functions python benchmarks/offline_throughput.py --demo \\
+        --requests 2000 --concurrency 16
+    PYTHONPATH=functions python benchmarks/offline_throughput.py \\
+        --root offline --parquet events.parquet --goals goals.txt
+"""
+
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+DEMO_GOALS = {
+    "users who added to cart": "cart_add = 1",
+    "users who bought something": "purchase = 1",
+    "mobile visitors": "device_type = 'mobile'",
+    "mobile visitors who added to cart": "device_type = 'mobile' AND cart_add = 1",
+}
+
+
+class CannedLLM:
+    """Answers the demo goals with fixed audience definitions."""
+
+    def generate(self, prompt: str, response_schema=None) -> str:
+        goal = next(g for g in sorted(DEMO_GOALS, key=len, reverse=True) if g in prompt)
+        clause = DEMO_GOALS[goal]
+        columns = [c for c in ("cart_add", "purchase", "device_type") if c in clause]
+        return json.dumps(
+            {
+                "filter_clause": clause,
+                "columns_used": columns,
+                "attribute_name": goal.title(),
+                "attribute_description": goal,
+            }
+        )
+
+
+def build_demo(directory: str, config, rows: int) -> Dict[str, str]:
+    """Synthetic event table and context files; returns the Parquet path."""
+    import duckdb
+
+    gcp = config.gcp
+    context = {
+        "columns": [
+            {"name": "mcvisid", "data_type": "STRING"},
+            {"name": "cart_add", "data_type": "INTEGER"},
+            {"name": "purchase", "data_type": "INTEGER"},
+            {"name": "device_type", "data_type": "STRING"},
+        ]
+    }
+    values = {
+        "cart_add": [0, 1],
+        "purchase": [0, 1],
+        "device_type": ["mobile", "desktop"],
+    }
+    for blob, content in (
+        (gcp.schema_blob_name, context),
+        (gcp.col_values_blob_name, values),
+    ):
+        path = os.path.join(directory, "objects", gcp.bucket_name, blob)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(content, f)
+
+    parquet = os.path.join(directory, "events.parquet")
+    duckdb.connect().execute(
+        f"""
+        COPY (
+            SELECT 'v' || (i % {max(rows // 4, 1)}) AS mcvisid,
+                   CAST(i % 3 = 0 AS INTEGER) AS cart_add,
+                   CAST(i % 11 = 0 AS INTEGER) AS purchase,
+                   CASE WHEN i % 2 = 0 THEN 'mobile' ELSE 'desktop' END AS device_type
+            FROM range({rows}) t(i)
+        ) TO '{parquet}' (FORMAT parquet)
+        """
+    )
+    return {"parquet": parquet}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--root", help="Recording directory to replay")
+    parser.add_argument("--parquet", help="Event table extract to count on")
+    parser.add_argument("--goals", help="File with one attribute goal per line")
+    parser.add_argument("--demo", action="store_true")
+    parser.add_argument("--demo-rows", type=int, default=200_000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args(argv)
+    if not args.demo and not args.root:
+        parser.error("pass --root (a recording) or --demo")
+
+    from my_function.audiences_app.audiences_agent import agent, backends
+    from my_function.audiences_app.audiences_agent.base_functions import get_config
+    from my_function.audiences_app.audiences_agent.llm_policy import percentile
+
+    config = get_config()
+    table_id = (
+        f"{config.gcp.project_id}.{config.gcp.dataset_id}.{config.gcp.table_name}"
+    )
+    tmp = tempfile.TemporaryDirectory() if args.demo else None
+    if tmp is not None:
+        demo = build_demo(tmp.name, config, args.demo_rows)
+        backends.install(
+            llm=CannedLLM(),
+            object_store=backends.replay_object_store(tmp.name),
+            warehouse=backends.DuckDBWarehouse({table_id: demo["parquet"]}),
+        )
+        goals = list(DEMO_GOALS)
+    else:
+        parquet = {table_id: args.parquet} if args.parquet else None
+        backends.install(**backends.build_backends("replay", args.root, parquet))
+        if args.goals:
+            with open(args.goals, encoding="utf-8") as f:
+                goals = [line.strip() for line in f if line.strip()]
+        else:
+            goals = [
+                json.loads(r["response"])["attribute_description"]
+                for r in backends.iter_recorded(args.root, "llm")
+            ]
+
+    def one(goal: str):
+        start = time.perf_counter()
+        try:
+            result = agent.run_audience_agent(goal, config, use_cache=False)
+            error = result.get("count_error")
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        return time.perf_counter() - start, error
+
+    # First request loads the context and renders the prompt prefix
+    one(goals[0])
+    work = list(itertools.islice(itertools.cycle(goals), args.requests))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(one, work))
+    elapsed = time.perf_counter() - start
+    latencies = [seconds for seconds, _ in outcomes]
+    errors = [error for _, error in outcomes if error]
+
+    print(
+        f"requests:     {len(work)} ({len(goals)} goals, concurrency {args.concurrency})"
+    )
+    print(f"throughput:   {len(work) / elapsed:8.1f} req/s")
+    print(f"p50 latency:  {percentile(latencies, 50) * 1000:8.2f} ms")
+    print(f"p95 latency:  {percentile(latencies, 95) * 1000:8.2f} ms")
+    print(f"errors:       {len(errors)}")
+    if errors:
+        print(f"first error:  {errors[0]}")
+    if tmp is not None:
+        tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
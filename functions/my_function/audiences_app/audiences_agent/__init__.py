@@ -1 +1,8 @@
-from . import agent
+import importlib
+
+
+def __getattr__(name):
+    # Submodules load on first use so importing the package stays cheap
+    if name in ("agent", "async_agent", "batch"):
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,41 +1,122 @@
+import contextvars
 import json
-import pandas as pd
 import re
-from google.cloud import storage  # type: ignore[attr-defined]
+import threading
+import time
 import yaml
 import os
 import sys
-from .base_functions import generate, get_bq_client, get_config
-from typing import Any, Dict
+from .base_functions import (
+    generate,
+    generate_stream,
+    get_agent_config,
+    get_bq_client,
+    get_config,
+    get_llm_backend,
+    get_model_registry,
+    init_vertex,
+)
+from .clause_validator import ColumnIndex, validate_clause
+from .context_cache import ContextCache
+from .context_selection import ContextSelector
+from .count_jobs import CountJobs, build_count_jobs
+from .incremental_json import IncrementalJSONParser
+from .counting import (
+    DEFAULT_SAMPLE_PERCENT,
+    ID_COLUMN,
+    AudienceSize,
+    build_size_query,
+    check_sizing_mode,
+    client_dialect,
+    size_from_count,
+    table_ref,
+)
+from . import metrics
+from .metrics import span
+from .prompt_builder import PromptBuilder, combine_versions, estimate_tokens, hash_json
+from .query_executor import (
+    QueryBudgetError,
+    QueryExecutor,
+    build_query_executor,
+    normalize_sql,
+)
+from .response_cache import ResponseCache, build_response_cache
+from .rollup import RollupRewriter, binary_columns, rollup_table_ref
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 from typing import Optional
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(script_dir)
 
 
-# Load prompts
+# Prompts are read on first use (see get_prompts)
 prompts_path = os.path.join(
     os.path.dirname(__file__), "prompts", "generate_audiences.yaml"
 )
-with open(prompts_path, "r", encoding="utf-8") as f:
-    prompts = yaml.safe_load(f)
-attribute_prompt_template = prompts["prompt"]
 
 base_path = os.path.dirname(__file__)
 
+_prompts: Optional[Dict[str, Any]] = None
+
+_context_cache = None
+_prompt_builder = None
+_response_cache: Optional[ResponseCache] = None
+_response_cache_ready = False
+_rollup_rewriter: Optional[tuple] = None
+_query_executor: Optional[QueryExecutor] = None
+_column_index: Optional[tuple] = None
+_context_selector: Optional[tuple] = None
+_column_retriever: Optional[tuple] = None
+# Building the index embeds every column; concurrent first requests wait for
+# one build instead of each running their own
+_column_retriever_lock = threading.Lock()
+_count_jobs: Optional[CountJobs] = None
+_validation_prompt: Optional[Dict[str, Any]] = None
+
 
 # ----------------- Helper Functions -----------------
+def get_prompts() -> Dict[str, Any]:
+    global _prompts
+    if _prompts is None:
+        with open(prompts_path, "r", encoding="utf-8") as f:
+            _prompts = yaml.safe_load(f)
+    return _prompts
+
+
+def __getattr__(name):
+    # Module attributes kept for callers that read agent.prompts directly
+    if name == "prompts":
+        return get_prompts()
+    if name == "attribute_prompt_template":
+        return get_prompts()["prompt"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_context_cache() -> ContextCache:
+    global _context_cache
+    if _context_cache is None:
+        _context_cache = ContextCache()
+    return _context_cache
+
+
+def set_object_store(store) -> None:
+    """Load context files from ``store`` (see ``context_cache.ObjectStore``)."""
+    global _context_cache
+    _context_cache = ContextCache(store=store)
+
+
 def load_context_from_gcs(bucket_name: str, blob_name: str) -> Dict[str, Any]:
-    client = storage.Client()
-    blob = client.bucket(bucket_name).blob(blob_name)
-    content = blob.download_as_text()
-    return json.loads(content)
+    return get_context_cache().get(bucket_name, blob_name)
 
 
-def format_schema_from_column_list(context_json):
+def format_schema_from_column_list(context_json, columns=None):
     formatted = []
+    wanted = None if columns is None else set(columns)
     for col in context_json.get("columns", []):
         name = col.get("name", "")
+        if wanted is not None and name not in wanted:
+            continue
         dtype = col.get("data_type", "").upper()
         desc = col.get("description", "").strip()
         if desc:
@@ -45,15 +126,202 @@ def format_schema_from_column_list(context_json):
     return "\n".join(formatted)
 
 
+def render_static_prompt_fields(context_json, col_values_json):
+    return {
+        "schema_str": format_schema_from_column_list(context_json),
+        "sample_json_str": json.dumps(col_values_json, indent=2, ensure_ascii=False),
+    }
+
+
+def get_prompt_builder() -> PromptBuilder:
+    global _prompt_builder
+    if _prompt_builder is None:
+        _prompt_builder = PromptBuilder(
+            get_prompts()["prompt"],
+            render_static_prompt_fields,
+            dynamic_fields=("schema_str", "sample_json_str"),
+        )
+    return _prompt_builder
+
+
+def get_response_cache(config=None) -> Optional[ResponseCache]:
+    global _response_cache, _response_cache_ready
+    if not _response_cache_ready:
+        _response_cache = build_response_cache(get_agent_config(config))
+        _response_cache_ready = True
+    return _response_cache
+
+
+def get_query_executor(config=None) -> QueryExecutor:
+    global _query_executor
+    if _query_executor is None:
+        _query_executor = build_query_executor(get_agent_config(config))
+    return _query_executor
+
+
+def get_count_jobs(config=None) -> CountJobs:
+    global _count_jobs
+    if _count_jobs is None:
+        _count_jobs = build_count_jobs(get_agent_config(config))
+    return _count_jobs
+
+
+def get_context_version(context_json, col_values_json) -> str:
+    # Blobs served by the context cache already carry a hash of their raw text
+    cache = get_context_cache()
+    return combine_versions(
+        *(
+            cache.content_hash(data) or hash_json(data)
+            for data in (context_json, col_values_json)
+        )
+    )
+
+
+def get_rollup_rewriter(
+    config, context_json, col_values_json, context_version=None
+) -> Optional[RollupRewriter]:
+    global _rollup_rewriter
+    rollup_table = get_agent_config(config).rollup_table
+    if not rollup_table:
+        return None
+    table = rollup_table_ref(config, rollup_table)
+    version = context_version or get_context_version(context_json, col_values_json)
+    if _rollup_rewriter is None or _rollup_rewriter[0] != (table, version):
+        rewriter = RollupRewriter(table, binary_columns(context_json, col_values_json))
+        _rollup_rewriter = ((table, version), rewriter)
+    return _rollup_rewriter[1]
+
+
+def get_column_index(
+    context_json, col_values_json, context_version=None
+) -> ColumnIndex:
+    global _column_index
+    version = context_version or get_context_version(context_json, col_values_json)
+    if _column_index is None or _column_index[0] != version:
+        index = ColumnIndex.from_context(
+            context_json, binary_columns(context_json, col_values_json)
+        )
+        _column_index = (version, index)
+    return _column_index[1]
+
+
+def get_context_selector(
+    context_json, col_values_json, context_version=None
+) -> ContextSelector:
+    global _context_selector
+    version = context_version or get_context_version(context_json, col_values_json)
+    if _context_selector is None or _context_selector[0] != version:
+        _context_selector = (version, ContextSelector(context_json, col_values_json))
+    return _context_selector[1]
+
+
+def get_column_retriever(
+    context_json, col_values_json, context_version=None, config=None
+):
+    """The embedding index of the schema columns (``column_retrieval``)."""
+    global _column_retriever
+    from .column_retrieval import build_column_retriever
+
+    agent_config = get_agent_config(config)
+    version = context_version or get_context_version(context_json, col_values_json)
+    key = (
+        version,
+        agent_config.column_index_dir,
+        agent_config.column_embedding,
+        agent_config.column_embedding_model,
+    )
+    cached = _column_retriever
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with _column_retriever_lock:
+        if _column_retriever is None or _column_retriever[0] != key:
+            retriever = build_column_retriever(
+                agent_config, version, context_json, col_values_json
+            )
+            _column_retriever = (key, retriever)
+        return _column_retriever[1]
+
+
+def select_columns(
+    attribute_goal, context_json, col_values_json, context_version=None, config=None
+) -> Optional[List[str]]:
+    """The ``agent.column_top_k`` columns closest to the goal; None sends all."""
+    top_k = get_agent_config(config).column_top_k
+    if top_k <= 0 or len(context_json.get("columns", [])) <= top_k:
+        return None
+    try:
+        return get_column_retriever(
+            context_json, col_values_json, context_version, config
+        ).top_k(attribute_goal, top_k)
+    except Exception as e:
+        print("Error retrieving columns, sending all of them:", e)
+        return None
+
+
+def build_audience_prompt(
+    attribute_goal, context_json, col_values_json, context_version=None, config=None
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Build the audience prompt in a ``prompt_build`` span; returns the prompt
+    and the span's attributes. With ``agent.column_top_k`` set, only the
+    columns closest to the goal are listed; with ``agent.context_token_budget``
+    set, their values are cut to the budget.
+    """
+    agent_config = get_agent_config(config)
+    with span("prompt_build") as stage:
+        # The schema and column values are rendered once per version
+        prefix = get_prompt_builder().prefix(
+            context_json, col_values_json, context_version
+        )
+        fields: Dict[str, str] = {}
+        columns = select_columns(
+            attribute_goal, context_json, col_values_json, context_version, config
+        )
+        if columns is not None:
+            fields["schema_str"] = format_schema_from_column_list(context_json, columns)
+            stage["columns_sent"] = len(columns)
+        if agent_config.context_token_budget > 0:
+            selection = get_context_selector(
+                context_json, col_values_json, context_version
+            ).select(
+                attribute_goal,
+                agent_config.context_token_budget,
+                full_columns=agent_config.context_full_columns,
+                truncated_values=agent_config.context_truncated_values,
+                columns=columns,
+            )
+            fields["sample_json_str"] = selection.text
+            stage["context_tokens"] = selection.tokens
+        elif columns is not None:
+            wanted = set(columns)
+            fields["sample_json_str"] = json.dumps(
+                {name: v for name, v in col_values_json.items() if name in wanted},
+                indent=2,
+                ensure_ascii=False,
+            )
+        if fields:
+            saved = sum(
+                max(0, estimate_tokens(prefix.defaults[name]) - estimate_tokens(text))
+                for name, text in fields.items()
+            )
+            stage["tokens_saved"] = saved
+            metrics.REGISTRY.prompt_tokens_saved.inc(saved)
+        prompt = prefix.render(attribute_goal, **fields)
+        stage["prompt_bytes"] = len(prompt.encode("utf-8"))
+    return prompt, stage
+
+
+def rows_as_strings(rows) -> List[Dict[str, str]]:
+    """Stringify BigQuery rows (or plain mappings) without building a DataFrame."""
+    return [{key: str(value) for key, value in row.items()} for row in rows]
+
+
 def fetch_data_as_strings(client, project_id, dataset_id, table_name, columns, limit=5):
     cols_sql = ", ".join(f"`{c}`" for c in columns)
     query = (
         f"SELECT {cols_sql} FROM `{project_id}.{dataset_id}.{table_name}` LIMIT {limit}"
     )
-    rows = client.query(query).result()
-    records = [dict(row.items()) for row in rows]
-    df = pd.DataFrame(records)
-    return df.astype(str)
+    return rows_as_strings(client.query(query).result())
 
 
 def clean_gemini_json_response(response_text):
@@ -64,107 +332,526 @@ def clean_gemini_json_response(response_text):
     return response_text.strip()
 
 
-# ----------------- Main Agent Function -----------------
-def run_audience_agent(attribute_goal: str, config=None, client=None):
-    config = get_config(config)
-    client = client or get_bq_client()
+AUDIENCE_FIELDS = (
+    "filter_clause",
+    "columns_used",
+    "attribute_name",
+    "attribute_description",
+)
+
+
+def parse_audience_response(response: str) -> Dict[str, Any]:
+    try:
+        parsed = json.loads(response)
+        return {
+            "filter_clause": parsed["filter_clause"],
+            "columns_used": parsed["columns_used"],
+            "attribute_name": parsed["attribute_name"],
+            "attribute_description": parsed["attribute_description"],
+        }
+    except Exception as e:
+        print("Error parsing Gemini response:", e)
+        return {
+            "filter_clause": "",
+            "columns_used": [],
+            "attribute_name": "",
+            "attribute_description": "",
+        }
 
+
+def check_audience_definition(
+    config, result, context_json, col_values_json, context_version=None
+) -> Dict[str, Any]:
     """
-    Input: attribute goal string
-    Output: dict with keys: filter_clause, columns_used, matching_users
+    Check the generated clause against the schema before it reaches BigQuery.
+
+    Per ``agent.clause_validation`` fixable problems are repaired in place
+    (``repair``, listed in ``clause_repairs``) or rejected (``reject``); a
+    rejected clause gets ``validation_errors`` and is not counted.
     """
-    # Load context (schema) from GCS
-    context_json = load_context_from_gcs(
-        bucket_name=config.gcp.bucket_name, blob_name=config.gcp.schema_blob_name
+    mode = get_agent_config(config).clause_validation
+    if mode == "off" or not result["filter_clause"]:
+        return result
+    with span("clause_validation"):
+        checked = validate_clause(
+            result["filter_clause"],
+            result["columns_used"],
+            get_column_index(context_json, col_values_json, context_version),
+            repair=mode != "reject",
+        )
+    result["filter_clause"] = checked.filter_clause
+    result["columns_used"] = checked.columns_used
+    if checked.repairs:
+        result["clause_repairs"] = checked.repairs
+    if not checked.valid:
+        print("Filter clause rejected:", "; ".join(checked.errors))
+        result["validation_errors"] = checked.errors
+    return result
+
+
+def countable_clause(result: Dict[str, Any]) -> str:
+    """The clause to count, or "" if validation rejected it."""
+    return "" if result.get("validation_errors") else result["filter_clause"]
+
+
+def build_count_query(
+    config,
+    filter_clause: str,
+    id_col: str = ID_COLUMN,
+    sizing_mode: str = "exact",
+    sample_percent: float = DEFAULT_SAMPLE_PERCENT,
+    dialect: str = "bigquery",
+) -> str:
+    return build_size_query(
+        table_ref(config), filter_clause, sizing_mode, sample_percent, id_col, dialect
     )
 
-    schema_str = format_schema_from_column_list(context_json)
+
+def count_queries(
+    config,
+    filter_clause: str,
+    sizing_mode: str = "exact",
+    sample_percent: float = DEFAULT_SAMPLE_PERCENT,
+    rollup: Optional[RollupRewriter] = None,
+    dialect: str = "bigquery",
+) -> List[str]:
+    """Count queries to try in order: the rollup if eligible, then raw events."""
+    queries = []
+    rewritten = rollup.rewrite(filter_clause) if rollup is not None else None
+    if rollup is not None and rewritten:
+        queries.append(
+            build_size_query(
+                rollup.table,
+                rewritten,
+                sizing_mode,
+                sample_percent,
+                dialect=dialect,
+            )
+        )
+    queries.append(
+        build_count_query(
+            config,
+            filter_clause,
+            sizing_mode=sizing_mode,
+            sample_percent=sample_percent,
+            dialect=dialect,
+        )
+    )
+    return queries
+
+
+def read_matching_users(rows) -> int:
+    return int(next(iter(rows))["matching_users"])
+
+
+def count_matching_users(
+    client,
+    config,
+    filter_clause: str,
+    sizing_mode: str = "exact",
+    sample_percent: float = DEFAULT_SAMPLE_PERCENT,
+    rollup: Optional[RollupRewriter] = None,
+    user: Optional[str] = None,
+) -> AudienceSize:
+    if not filter_clause:
+        return AudienceSize(None, sizing_mode)
+    try:
+        queries = count_queries(
+            config,
+            filter_clause,
+            sizing_mode,
+            sample_percent,
+            rollup,
+            client_dialect(client),
+        )
+    except Exception as e:
+        print("Error building count query:", e)
+        return AudienceSize(None, sizing_mode)
+    executor = get_query_executor(config).bind(client, user)
+    error = None
+    with span("bq_count", sizing_mode=sizing_mode) as stage:
+        for query in queries:
+            try:
+                job = executor.query(query)
+                count = read_matching_users(job.result())
+            except QueryBudgetError as e:
+                print("Count query refused:", e)
+                error = str(e)
+                break
+            except Exception as e:
+                print("Error executing count query:", e)
+                continue
+            finally:
+                stage["bytes_processed"] = executor.estimated_bytes
+            processed = getattr(job, "total_bytes_processed", None)
+            if isinstance(processed, int):
+                stage["bytes_processed"] = processed
+            size = size_from_count(count, sizing_mode, sample_percent)
+            size.estimated_bytes = executor.estimated_bytes
+            return size
+    return AudienceSize(
+        None, sizing_mode, estimated_bytes=executor.estimated_bytes, count_error=error
+    )
+
+
+def count_job_key(
+    config,
+    filter_clause: str,
+    sizing_mode: str = "exact",
+    sample_percent: float = DEFAULT_SAMPLE_PERCENT,
+) -> str:
+    """Identical keys give identical counts, so their jobs are shared."""
+    gcp = getattr(config, "gcp", None)
+    table = ".".join(
+        str(getattr(gcp, name, ""))
+        for name in ("project_id", "dataset_id", "table_name")
+    )
+    # Only whitespace outside literals is normalized: 'a  b' is not 'a b'
+    return "\n".join(
+        (table, sizing_mode, str(sample_percent), normalize_sql(filter_clause))
+    )
+
+
+def run_in_thread(fn: Callable[[], Any]) -> Future:
+    """Start ``fn`` on its own thread, in the caller's context."""
+    future: Future = Future()
+    context = contextvars.copy_context()
+
+    def run() -> None:
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(context.run(fn))
+            except BaseException as e:
+                future.set_exception(e)
+
+    threading.Thread(target=run, name="early-count", daemon=True).start()
+    return future
+
+
+def resolve_sizing_mode(config, sizing_mode: Optional[str] = None) -> str:
+    sizing_mode = sizing_mode or get_agent_config(config).sizing_mode
+    check_sizing_mode(sizing_mode)
+    return sizing_mode
+
+
+def load_audience_context(config):
+    # Load context (schema) from GCS
+    with span("schema_load"):
+        context_json = load_context_from_gcs(
+            bucket_name=config.gcp.bucket_name, blob_name=config.gcp.schema_blob_name
+        )
 
     # Load column values
-    col_values_json = load_context_from_gcs(
-        bucket_name=config.gcp.bucket_name, blob_name=config.gcp.col_values_blob_name
+    with span("col_values_load"):
+        col_values_json = load_context_from_gcs(
+            bucket_name=config.gcp.bucket_name,
+            blob_name=config.gcp.col_values_blob_name,
+        )
+
+    return (
+        context_json,
+        col_values_json,
+        get_context_version(context_json, col_values_json),
     )
 
-    col_values_str = json.dumps(col_values_json, indent=2, ensure_ascii=False)
 
-    # Build prompt
-    prompt = attribute_prompt_template.format(
-        attribute_goal=attribute_goal,
-        schema_str=schema_str,
-        sample_json_str=col_values_str,
+def generate_audience_definition(
+    attribute_goal, context_json, col_values_json, context_version=None, config=None
+) -> Dict[str, Any]:
+    prompt, stage = build_audience_prompt(
+        attribute_goal, context_json, col_values_json, context_version, config
     )
 
-    response_schema = prompts["response_schema"]
+    response_schema = get_prompts()["response_schema"]
 
     # Generate Gemini response
-    response = generate(prompt, response_schema)
+    with span("gemini_call", prompt_bytes=stage["prompt_bytes"]) as call:
+        response = generate(prompt, response_schema)
+        call["response_bytes"] = len((response or "").encode("utf-8"))
 
-    try:
-        response = json.loads(response)
-        filter_clause = response["filter_clause"]
-        columns_used = response["columns_used"]
-        attribute_name = response["attribute_name"]
-        description = response["attribute_description"]
-    except Exception as e:
-        print("Error parsing Gemini response:", e)
-        filter_clause = ""
-        columns_used = []
-        attribute_name = ""
-        description = ""
+    with span("json_parse", response_bytes=call["response_bytes"]):
+        return parse_audience_response(response)
+
+
+def stream_audience_fields(
+    attribute_goal, context_json, col_values_json, context_version=None, config=None
+) -> Iterator[Tuple[str, Any]]:
+    """
+    ``generate_audience_definition`` on a streamed Gemini response: yields
+    each ``(field, value)`` of the definition as soon as Gemini has finished
+    writing it, then any field it left out with an empty value.
+    """
+    prompt, stage = build_audience_prompt(
+        attribute_goal, context_json, col_values_json, context_version, config
+    )
+
+    parser = IncrementalJSONParser()
+    response_schema = get_prompts()["response_schema"]
+    # Includes the brief work the caller does between fields (checking the
+    # clause and starting its count)
+    with span("gemini_call", prompt_bytes=stage["prompt_bytes"]) as call:
+        call["response_bytes"] = 0
+        for chunk in generate_stream(prompt, response_schema):
+            call["response_bytes"] += len(chunk.encode("utf-8"))
+            for name, value in parser.feed(chunk):
+                if name in AUDIENCE_FIELDS:
+                    yield name, value
+
+    if not parser.complete:
+        print("Error parsing Gemini response: incomplete JSON")
+    for name in AUDIENCE_FIELDS:
+        if name not in parser.fields:
+            yield name, [] if name == "columns_used" else ""
+
+
+# ----------------- Main Agent Function -----------------
+def stream_audience_agent(
+    attribute_goal: str,
+    config=None,
+    client=None,
+    use_cache: bool = True,
+    sizing_mode: Optional[str] = None,
+    user: Optional[str] = None,
+    background_count: bool = False,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Run the agent one stage at a time, yielding an event dict per stage:
+
+    - ``context``: schema and column values loaded (``context_version``)
+    - ``clause`` (``agent.llm_streaming`` only): the checked filter_clause and
+      columns_used, as soon as Gemini has written them; the count starts then
+    - ``generated``: Gemini's filter_clause, columns_used, attribute_name and
+      attribute_description
+    - ``validated``: the same fields after the local clause check, plus
+      clause_repairs / validation_errors
+    - ``result``: the complete answer, as returned by ``run_audience_agent``
+
+    A cached answer is yielded as the ``result`` straight after ``context``.
+    The filter clause is available seconds before the count query finishes.
+    With ``background_count`` the count runs as a shared job and the result
+    carries ``count_job`` (``job_id`` and ``status``) instead of waiting.
+    """
+    config = get_config(config)
+    client = client or get_bq_client()
+    sizing_mode = resolve_sizing_mode(config, sizing_mode)
+    agent_config = get_agent_config(config)
+    sample_percent = agent_config.sample_percent
+
+    context_json, col_values_json, context_version = load_audience_context(config)
+    yield {"stage": "context", "context_version": context_version}
+
+    # Same goal against the same context and model: reuse the finished answer
+    model_name = str(getattr(config.gcp, "ai_model", ""))
+    response_cache = get_response_cache(config) if use_cache else None
+    if response_cache is not None:
+        cached = response_cache.lookup(
+            attribute_goal, context_version, model_name, variant=sizing_mode
+        )
+        if cached is not None:
+            yield {"stage": "result", **cached}
+            return
+
+    rollup = get_rollup_rewriter(config, context_json, col_values_json, context_version)
+
+    def count(clause: str) -> Callable[[], AudienceSize]:
+        return lambda: count_matching_users(
+            client, config, clause, sizing_mode, sample_percent, rollup, user
+        )
+
+    def start_count(clause: str) -> Any:
+        # Background: a shared job; otherwise a thread this request joins
+        if background_count:
+            key = count_job_key(config, clause, sizing_mode, sample_percent)
+            return get_count_jobs(config).submit(key, count(clause))
+        return run_in_thread(count(clause))
+
+    # Streaming: check the clause and start counting it while Gemini is still
+    # writing the name and description
+    early: Optional[Dict[str, Any]] = None
+    early_clause = ""
+    early_count = None
+    if agent_config.llm_streaming:
+        result: Dict[str, Any] = {}
+        for name, value in stream_audience_fields(
+            attribute_goal, context_json, col_values_json, context_version, config
+        ):
+            result[name] = value
+            if early is None and "columns_used" in result and "filter_clause" in result:
+                early = check_audience_definition(
+                    config,
+                    {
+                        "filter_clause": result["filter_clause"],
+                        "columns_used": result["columns_used"],
+                    },
+                    context_json,
+                    col_values_json,
+                    context_version,
+                )
+                yield {"stage": "clause", **early}
+                early_clause = countable_clause(early)
+                if early_clause:
+                    early_count = start_count(early_clause)
+        result = {name: result[name] for name in AUDIENCE_FIELDS}
+    else:
+        result = generate_audience_definition(
+            attribute_goal, context_json, col_values_json, context_version, config
+        )
+    yield {"stage": "generated", **result}
+    if early is not None:
+        result.update(early)
+    else:
+        check_audience_definition(
+            config, result, context_json, col_values_json, context_version
+        )
+    yield {"stage": "validated", **result}
+
+    # Count matching users, on the visitor rollup when the clause allows it
+    clause = countable_clause(result)
+    answer = dict(result)
+
+    def store(size: AudienceSize) -> None:
+        # Only complete answers are cached; failures are retried next time
+        if response_cache is not None and size.matching_users is not None:
+            response_cache.store(
+                attribute_goal,
+                context_version,
+                model_name,
+                {**answer, **size.as_dict()},
+                variant=sizing_mode,
+            )
+
+    if background_count and clause:
+        # Return the clause now; identical clauses share one running count
+        # (including the one started early, which this attaches ``store`` to)
+        job = get_count_jobs(config).submit(
+            count_job_key(config, clause, sizing_mode, sample_percent),
+            count(clause),
+            store,
+        )
+        job_id, status = job.pop("job_id"), job.pop("status")
+        result.update(job or AudienceSize(None, sizing_mode).as_dict())
+        result["count_job"] = {"job_id": job_id, "status": status}
+    else:
+        if early_count is not None and clause == early_clause:
+            size = early_count.result()
+        else:
+            size = count(clause)()
+        store(size)
+        result.update(size.as_dict())
+
+    yield {"stage": "result", **result}
+
+
+def run_audience_agent(
+    attribute_goal: str,
+    config=None,
+    client=None,
+    use_cache: bool = True,
+    sizing_mode: Optional[str] = None,
+    user: Optional[str] = None,
+    background_count: bool = False,
+):
+    """
+    Input: attribute goal string
+    Output: dict with keys: filter_clause, columns_used, matching_users,
+    sizing_mode (exact | approx | sample; sample adds a confidence interval),
+    estimated_bytes (dry-run estimate of the count query); clause_repairs
+    and validation_errors when the local clause check changed or rejected it;
+    count_job (poll get_count_jobs().status) when background_count is set
+    """
+    *_, final = stream_audience_agent(
+        attribute_goal, config, client, use_cache, sizing_mode, user, background_count
+    )
+    final.pop("stage")
+    return final
 
-    # Ensure id column exists
-    id_col = "mcvisid"
 
-    # Count matching users
-    matching_users: Optional[int] = None
+def warm_up(config=None) -> Dict[str, float]:
+    """
+    Do the one-off work a first request would otherwise pay for: import the
+    SDKs, build the BigQuery client and Gemini model, load and render the
+    context, build the column index (with ``agent.column_top_k`` set), and
+    start the feedback flusher. Failures are printed and left for the request
+    path to surface.
 
-    if filter_clause:
+    Returns the seconds spent per step.
+    """
+    timings: Dict[str, float] = {}
+
+    def feedback():
+        # Starts the flusher, which sends rows buffered before a restart
+        from .feedback_sink import get_feedback_sink
+
+        get_feedback_sink(config)
+
+    def context():
+        config_ = get_config(config)
+        context_json, col_values_json, version = load_audience_context(config_)
+        get_prompt_builder().prefix(context_json, col_values_json, version)
+
+    def columns():
+        # The context is cached by now, so this only builds the index
+        context_json, col_values_json, version = load_audience_context(
+            get_config(config)
+        )
+        get_column_retriever(context_json, col_values_json, version, config)
+
+    steps = [
+        ("bigquery", get_bq_client),
+        ("vertexai", init_vertex),
+        (
+            "model",
+            lambda: get_model_registry().get(
+                get_config(config).gcp.ai_model, get_prompts()["response_schema"]
+            ),
+        ),
+        ("context", context),
+        ("columns", columns),
+        ("feedback", feedback),
+    ]
+    if get_agent_config(config).column_top_k <= 0:
+        steps = [step for step in steps if step[0] != "columns"]
+    if get_llm_backend() is not None:
+        # Offline backends never touch Vertex AI
+        steps = [step for step in steps if step[0] not in ("vertexai", "model")]
+    for name, step in steps:
+        start = time.perf_counter()
         try:
-            query = f"SELECT COUNT(DISTINCT {id_col}) as matching_users FROM `{config.gcp.project_id}.{config.gcp.dataset_id}.{config.gcp.table_name}` WHERE {filter_clause}"
-            rows = client.query(query).result()
-            matching_users = int(next(iter(rows))["matching_users"])
+            step()
         except Exception as e:
-            print("Error executing count query:", e)
-            matching_users = None
+            print(f"Warm-up step {name} failed:", e)
+        timings[name] = time.perf_counter() - start
+    return timings
 
-    return {
-        "filter_clause": filter_clause,
-        "columns_used": columns_used,
-        "attribute_name": attribute_name,
-        "attribute_description": description,
-        "matching_users": matching_users,
-    }
 
+def get_validation_prompt() -> Dict[str, Any]:
+    global _validation_prompt
+    if _validation_prompt is None:
+        prompt_path = os.path.join(base_path, "prompts", "ground_truth_validation.yaml")
+        with open(prompt_path, "r") as f:
+            _validation_prompt = yaml.safe_load(f)
+    return _validation_prompt
 
-# validate model's query against ground truth for benchmark testing
-def validate_query(nl_query, filter_clause, ground_truth_clause, config=None):
-    config = get_config(config)
-    client = get_bq_client()
-    context_json = load_context_from_gcs(
-        bucket_name=config.gcp.bucket_name, blob_name=config.gcp.schema_blob_name
-    )
 
-    schema_str = format_schema_from_column_list(context_json)
+def fetch_sample_json(config, client, context_json, limit: int = 5) -> str:
+    """Sample rows of the first schema columns, as JSON for the judge prompt."""
     allowed_columns = [c["name"] for c in context_json.get("columns", [])]
-
-    # Sample data for Gemini prompt
     preview_columns = allowed_columns[: min(8, len(allowed_columns))]
-    sample_df = fetch_data_as_strings(
-        client,
+    sample_rows = fetch_data_as_strings(
+        get_query_executor(config).bind(client),
         config.gcp.project_id,
         config.gcp.dataset_id,
         config.gcp.table_name,
         preview_columns,
-        limit=5,
+        limit=limit,
     )
-    sample_json_str = json.dumps(
-        sample_df.to_dict(orient="records"), indent=2, ensure_ascii=False
-    )
-    prompt_path = os.path.join(base_path, "prompts", "ground_truth_validation.yaml")
-    with open(prompt_path, "r") as f:
-        query_template = yaml.safe_load(f)
+    return json.dumps(sample_rows, indent=2, ensure_ascii=False)
+
 
-    prompt = query_template["prompt"].format(
+def build_judge_prompt(
+    nl_query, filter_clause, ground_truth_clause, schema_str, sample_json_str
+) -> str:
+    return get_validation_prompt()["prompt"].format(
         nl_query=nl_query,
         filter_clause=filter_clause,
         ground_truth_clause=ground_truth_clause,
@@ -172,6 +859,23 @@ def validate_query(nl_query, filter_clause, ground_truth_clause, config=None):
         sample_json_str=sample_json_str,
     )
 
-    response_schema = query_template["response_schema"]
+
+# validate model's query against ground truth for benchmark testing
+def validate_query(nl_query, filter_clause, ground_truth_clause, config=None):
+    config = get_config(config)
+    context_json = load_context_from_gcs(
+        bucket_name=config.gcp.bucket_name, blob_name=config.gcp.schema_blob_name
+    )
+
+    # Sample data for Gemini prompt
+    prompt = build_judge_prompt(
+        nl_query,
+        filter_clause,
+        ground_truth_clause,
+        format_schema_from_column_list(context_json),
+        fetch_sample_json(config, get_bq_client(), context_json),
+    )
+
+    response_schema = get_validation_prompt()["response_schema"]
     result = generate(prompt, response_schema)
     return json.loads(result)
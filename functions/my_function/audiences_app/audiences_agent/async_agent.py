@@ -0,0 +1,193 @@
+"""
+Async audience pipeline for the ASGI request path.
+
+``arun_audience_agent`` mirrors ``agent.run_audience_agent`` but never blocks
+the event loop: the Gemini call is awaited through the SDK's async client,
+GCS reads run in worker threads, and the BigQuery count query is submitted
+and then polled with ``asyncio.sleep`` between status checks, so a single
+ASGI worker can keep many audience requests in flight.
+"""
+
+import asyncio
+from typing import Any, Dict, Optional
+
+from . import agent
+from .base_functions import generate_async, get_agent_config, get_bq_client, get_config
+from .counting import (
+    DEFAULT_SAMPLE_PERCENT,
+    AudienceSize,
+    client_dialect,
+    size_from_count,
+)
+from .metrics import span
+from .query_executor import QueryBudgetError
+from .rollup import RollupRewriter
+
+QUERY_POLL_INITIAL_SECONDS = 0.1
+QUERY_POLL_MAX_SECONDS = 1.0
+
+
+async def await_query_job(query_job, timeout: Optional[float] = None):
+    """
+    Wait for a BigQuery job without holding a thread while it runs.
+
+    Each ``done()`` check is a short HTTP call made from a worker thread; the
+    wait between checks backs off up to ``QUERY_POLL_MAX_SECONDS``.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    delay = QUERY_POLL_INITIAL_SECONDS
+    while not await asyncio.to_thread(query_job.done):
+        if deadline is not None and loop.time() >= deadline:
+            raise TimeoutError(f"Query job {query_job.job_id} did not finish in time")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, QUERY_POLL_MAX_SECONDS)
+    return await asyncio.to_thread(query_job.result)
+
+
+async def acount_matching_users(
+    client,
+    config,
+    filter_clause: str,
+    sizing_mode: str = "exact",
+    sample_percent: float = DEFAULT_SAMPLE_PERCENT,
+    rollup: Optional[RollupRewriter] = None,
+    user: Optional[str] = None,
+) -> AudienceSize:
+    if not filter_clause:
+        return AudienceSize(None, sizing_mode)
+    try:
+        queries = agent.count_queries(
+            config,
+            filter_clause,
+            sizing_mode,
+            sample_percent,
+            rollup,
+            client_dialect(client),
+        )
+    except Exception as e:
+        print("Error building count query:", e)
+        return AudienceSize(None, sizing_mode)
+    # The dry run is a short blocking call; it shares the worker thread
+    executor = agent.get_query_executor(config).bind(client, user)
+    error = None
+    with span("bq_count", sizing_mode=sizing_mode) as stage:
+        for query in queries:
+            try:
+                query_job = await asyncio.to_thread(executor.query, query)
+                count = agent.read_matching_users(await await_query_job(query_job))
+            except QueryBudgetError as e:
+                print("Count query refused:", e)
+                error = str(e)
+                break
+            except Exception as e:
+                print("Error executing count query:", e)
+                continue
+            finally:
+                stage["bytes_processed"] = executor.estimated_bytes
+            processed = getattr(query_job, "total_bytes_processed", None)
+            if isinstance(processed, int):
+                stage["bytes_processed"] = processed
+            size = size_from_count(count, sizing_mode, sample_percent)
+            size.estimated_bytes = executor.estimated_bytes
+            return size
+    return AudienceSize(
+        None, sizing_mode, estimated_bytes=executor.estimated_bytes, count_error=error
+    )
+
+
+async def arun_audience_agent(
+    attribute_goal: str,
+    config=None,
+    client=None,
+    use_cache: bool = True,
+    sizing_mode: Optional[str] = None,
+    user: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Input: attribute goal string
+    Output: dict with keys: filter_clause, columns_used, matching_users,
+    sizing_mode
+    """
+    config = get_config(config)
+    # Building the client, the response cache and its lookups all do I/O
+    # (credentials, SQLite); none of it runs on the event loop
+    client = client or await asyncio.to_thread(get_bq_client)
+    sizing_mode = agent.resolve_sizing_mode(config, sizing_mode)
+    sample_percent = get_agent_config(config).sample_percent
+
+    # Both blobs are usually served from the context cache; on a miss the
+    # downloads run concurrently
+    context_json, col_values_json = await asyncio.gather(
+        asyncio.to_thread(
+            agent.load_context_from_gcs,
+            config.gcp.bucket_name,
+            config.gcp.schema_blob_name,
+        ),
+        asyncio.to_thread(
+            agent.load_context_from_gcs,
+            config.gcp.bucket_name,
+            config.gcp.col_values_blob_name,
+        ),
+    )
+
+    context_version = agent.get_context_version(context_json, col_values_json)
+    model_name = str(getattr(config.gcp, "ai_model", ""))
+    response_cache = (
+        await asyncio.to_thread(agent.get_response_cache, config) if use_cache else None
+    )
+    if response_cache is not None:
+        cached = await asyncio.to_thread(
+            response_cache.lookup,
+            attribute_goal,
+            context_version,
+            model_name,
+            variant=sizing_mode,
+        )
+        if cached is not None:
+            return cached
+
+    # Off the event loop: the first prompt of a context version renders it,
+    # and column retrieval may build the index or call the embedding API
+    prompt, stage = await asyncio.to_thread(
+        agent.build_audience_prompt,
+        attribute_goal,
+        context_json,
+        col_values_json,
+        context_version,
+        config,
+    )
+    with span("gemini_call", prompt_bytes=stage["prompt_bytes"]) as call:
+        response = await generate_async(prompt, agent.get_prompts()["response_schema"])
+        call["response_bytes"] = len((response or "").encode("utf-8"))
+    with span("json_parse", response_bytes=call["response_bytes"]):
+        result = agent.parse_audience_response(response)
+    agent.check_audience_definition(
+        config, result, context_json, col_values_json, context_version
+    )
+
+    rollup = agent.get_rollup_rewriter(
+        config, context_json, col_values_json, context_version
+    )
+    size = await acount_matching_users(
+        client,
+        config,
+        agent.countable_clause(result),
+        sizing_mode,
+        sample_percent,
+        rollup,
+        user,
+    )
+    result.update(size.as_dict())
+
+    if response_cache is not None and result["matching_users"] is not None:
+        await asyncio.to_thread(
+            response_cache.store,
+            attribute_goal,
+            context_version,
+            model_name,
+            result,
+            variant=sizing_mode,
+        )
+
+    return result
@@ -0,0 +1,366 @@
+"""
+Pluggable LLM, object store and warehouse backends for offline runs.
+
+The agent talks to three remote services, each behind a small interface:
+
+- LLM: ``generate(prompt, response_schema) -> str`` (``VertexLLM`` is Gemini)
+- object store: ``context_cache.ObjectStore`` (``GcsObjectStore``)
+- warehouse: a BigQuery-client-shaped ``query(sql, job_config=None)`` whose
+  job has ``result()``, ``done()``, ``job_id`` and ``total_bytes_processed``
+
+``RecordingLLM`` / ``RecordingObjectStore`` / ``RecordingWarehouse`` wrap the
+live backends and write every interaction under a local directory;
+``ReplayLLM`` / ``LocalObjectStore`` / ``ReplayWarehouse`` serve them back
+without network access, keyed by the request (model, prompt and schema for
+the LLM; normalized SQL and dry-run flag for the warehouse), so a replayed
+run is deterministic. ``DuckDBWarehouse`` instead executes the generated SQL
+on a local Parquet extract of the event table (``duckdb`` is an optional
+dependency; BigQuery-only functions such as ``DATETIME_SUB`` will not run).
+
+``install`` routes the agent through a set of backends; ``install_from_config``
+does so from the ``agent.backend*`` settings.
+
+Layout of a recording directory::
+
+    root/llm/<key>.json          prompt, response schema and response
+    root/objects/<bucket>/<blob> raw blob content (a LocalObjectStore root)
+    root/warehouse/<key>.json    SQL, rows and total_bytes_processed
+"""
+
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Protocol, Tuple
+
+from .base_functions import get_config
+from .context_cache import GcsObjectStore, LocalObjectStore, ObjectStore
+from .counting import client_dialect
+from .query_executor import normalize_sql
+
+BACKEND_MODES = ("gcp", "record", "replay")
+
+
+class ReplayMissError(LookupError):
+    """A replayed run made a request that was never recorded."""
+
+
+class LLMBackend(Protocol):
+    def generate(
+        self, prompt: str, response_schema: Optional[Dict[str, Any]] = None
+    ) -> str: ...
+
+
+class Warehouse(Protocol):
+    def query(self, sql: str, job_config=None) -> Any: ...
+
+
+def _key(payload: Any) -> str:
+    data = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class InteractionLog:
+    """One JSON file per recorded interaction, under ``root/kind/<key>.json``."""
+
+    def __init__(self, root: str, kind: str):
+        self.directory = os.path.join(root, kind)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, record: Dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        # Write then rename, so concurrent readers never see half a record
+        tmp = f"{self._path(key)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2, sort_keys=True, default=str)
+        os.replace(tmp, self._path(key))
+
+
+# ----------------- LLM -----------------
+class VertexLLM:
+    """Gemini through Vertex AI (the default backend)."""
+
+    def generate(self, prompt: str, response_schema=None) -> str:
+        from .base_functions import vertex_generate
+
+        return vertex_generate(prompt, response_schema)
+
+
+def llm_key(prompt: str, response_schema=None) -> str:
+    model = str(getattr(get_config().gcp, "ai_model", ""))
+    return _key([model, prompt, response_schema])
+
+
+class RecordingLLM:
+    def __init__(self, root: str, inner: Optional[LLMBackend] = None):
+        self.inner = inner or VertexLLM()
+        self.log = InteractionLog(root, "llm")
+
+    def generate(self, prompt: str, response_schema=None) -> str:
+        response = self.inner.generate(prompt, response_schema)
+        self.log.put(
+            llm_key(prompt, response_schema),
+            {
+                "prompt": prompt,
+                "response_schema": response_schema,
+                "response": response,
+            },
+        )
+        return response
+
+
+class ReplayLLM:
+    def __init__(self, root: str):
+        self.log = InteractionLog(root, "llm")
+
+    def generate(self, prompt: str, response_schema=None) -> str:
+        record = self.log.get(llm_key(prompt, response_schema))
+        if record is None:
+            raise ReplayMissError(f"No recorded response for prompt {prompt[:80]!r}")
+        return record["response"]
+
+
+# ----------------- Object store -----------------
+class RecordingObjectStore:
+    """Reads through ``inner`` and keeps a copy that ``LocalObjectStore`` serves."""
+
+    def __init__(self, root: str, inner: Optional[ObjectStore] = None):
+        self.inner = inner or GcsObjectStore()
+        self.root = os.path.join(root, "objects")
+
+    def get_generation(self, bucket_name: str, blob_name: str) -> Optional[str]:
+        return self.inner.get_generation(bucket_name, blob_name)
+
+    def download_text(
+        self, bucket_name: str, blob_name: str
+    ) -> Tuple[str, Optional[str]]:
+        content, generation = self.inner.download_text(bucket_name, blob_name)
+        path = os.path.join(self.root, bucket_name, blob_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return content, generation
+
+
+def replay_object_store(root: str) -> LocalObjectStore:
+    return LocalObjectStore(os.path.join(root, "objects"))
+
+
+# ----------------- Warehouse -----------------
+class StaticQueryJob:
+    """A finished query job over rows already in memory."""
+
+    def __init__(
+        self,
+        rows: List[Dict[str, Any]],
+        total_bytes_processed: Optional[int] = None,
+        job_id: Optional[str] = None,
+    ):
+        self.rows = rows
+        self.total_bytes_processed = total_bytes_processed
+        self.job_id = job_id or uuid.uuid4().hex
+
+    def result(self, *args, **kwargs) -> List[Dict[str, Any]]:
+        return self.rows
+
+    def done(self, *args, **kwargs) -> bool:
+        return True
+
+    def to_dataframe(self):
+        import pandas as pd
+
+        return pd.DataFrame(self.rows)
+
+
+def _is_dry_run(job_config) -> bool:
+    return bool(getattr(job_config, "dry_run", False))
+
+
+def warehouse_key(sql: str, job_config=None) -> str:
+    return _key([normalize_sql(sql), _is_dry_run(job_config)])
+
+
+class RecordingWarehouse:
+    def __init__(self, root: str, inner: Warehouse):
+        self.inner = inner
+        self.dialect = client_dialect(inner)
+        self.log = InteractionLog(root, "warehouse")
+
+    def query(self, sql: str, job_config=None) -> StaticQueryJob:
+        job = self.inner.query(sql, job_config=job_config)
+        rows = (
+            [] if _is_dry_run(job_config) else [dict(r.items()) for r in job.result()]
+        )
+        processed = job.total_bytes_processed
+        if not isinstance(processed, int):
+            processed = None
+        self.log.put(
+            warehouse_key(sql, job_config),
+            {
+                "sql": sql,
+                "dry_run": _is_dry_run(job_config),
+                "rows": rows,
+                "total_bytes_processed": processed,
+            },
+        )
+        return StaticQueryJob(rows, processed, getattr(job, "job_id", None))
+
+
+class ReplayWarehouse:
+    def __init__(self, root: str):
+        self.log = InteractionLog(root, "warehouse")
+
+    def query(self, sql: str, job_config=None) -> StaticQueryJob:
+        record = self.log.get(warehouse_key(sql, job_config))
+        if record is None:
+            raise ReplayMissError(f"No recorded result for query {sql[:120]!r}")
+        return StaticQueryJob(record["rows"], record["total_bytes_processed"])
+
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_BACKTICKED = re.compile(r"`([^`]+)`")
+
+
+class DuckDBWarehouse:
+    """
+    Runs BigQuery-style SQL on local Parquet files with DuckDB.
+
+    Args:
+        tables: BigQuery table id (``project.dataset.table``) -> Parquet path
+            or glob. References to other tables fail like a missing table.
+        database: DuckDB database file (default in memory).
+    """
+
+    # The agent builds its count queries in this dialect (see counting)
+    dialect = "duckdb"
+
+    def __init__(self, tables: Dict[str, str], database: str = ":memory:"):
+        import duckdb
+
+        self.tables = dict(tables)
+        self._views = {table_id: f"t_{_key(table_id)[:12]}" for table_id in self.tables}
+        self._lock = threading.Lock()
+        self._conn = duckdb.connect(database)
+        for table_id, path in self.tables.items():
+            escaped = path.replace("'", "''")
+            self._conn.execute(
+                f"CREATE OR REPLACE VIEW {self._views[table_id]} AS "
+                f"SELECT * FROM read_parquet('{escaped}')"
+            )
+
+    def translate(self, sql: str) -> str:
+        """Map table ids to the Parquet views and `quoted` names to "quoted"."""
+
+        def identifier(match: "re.Match[str]") -> str:
+            name = match.group(1)
+            view = self._views.get(name)
+            return view if view is not None else f'"{name}"'
+
+        parts = []
+        pos = 0
+        for string in _STRING.finditer(sql):
+            parts.append(_BACKTICKED.sub(identifier, sql[pos : string.start()]))
+            parts.append(string.group())
+            pos = string.end()
+        parts.append(_BACKTICKED.sub(identifier, sql[pos:]))
+        return "".join(parts)
+
+    def scanned_bytes(self, sql: str) -> int:
+        """Size of the Parquet files behind the tables ``sql`` references."""
+        return sum(
+            os.path.getsize(path)
+            for table_id, pattern in self.tables.items()
+            if table_id in sql
+            for path in glob.glob(pattern)
+        )
+
+    def query(self, sql: str, job_config=None) -> StaticQueryJob:
+        translated = self.translate(sql)
+        scanned = self.scanned_bytes(sql)
+        if _is_dry_run(job_config):
+            with self._lock:
+                self._conn.execute(f"EXPLAIN {translated}")
+            return StaticQueryJob([], scanned)
+        # One connection per process; DuckDB cursors are not shared safely
+        with self._lock:
+            cursor = self._conn.execute(translated)
+            columns = [d[0] for d in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return StaticQueryJob(rows, scanned)
+
+
+# ----------------- Wiring -----------------
+def install(
+    llm: Optional[LLMBackend] = None,
+    object_store: Optional[ObjectStore] = None,
+    warehouse: Optional[Warehouse] = None,
+) -> None:
+    """Route the agent's Gemini, GCS and BigQuery calls through these backends."""
+    from . import agent, base_functions
+
+    if llm is not None:
+        base_functions.set_llm_backend(llm)
+    if object_store is not None:
+        agent.set_object_store(object_store)
+    if warehouse is not None:
+        base_functions.set_bq_client(warehouse)
+
+
+def build_backends(
+    mode: str, root: str, parquet_tables: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    """
+    Backends for ``mode`` (``gcp``, ``record`` or ``replay``), as keyword
+    arguments for ``install``. ``parquet_tables`` replaces the warehouse with
+    DuckDB in any mode.
+    """
+    if mode not in BACKEND_MODES:
+        raise ValueError(f"backend must be one of {', '.join(BACKEND_MODES)}")
+    backends: Dict[str, Any] = {}
+    if mode == "record":
+        from .base_functions import get_bq_client
+
+        backends["llm"] = RecordingLLM(root)
+        backends["object_store"] = RecordingObjectStore(root)
+        backends["warehouse"] = RecordingWarehouse(root, get_bq_client())
+    elif mode == "replay":
+        backends["llm"] = ReplayLLM(root)
+        backends["object_store"] = replay_object_store(root)
+        backends["warehouse"] = ReplayWarehouse(root)
+    if parquet_tables:
+        backends["warehouse"] = DuckDBWarehouse(parquet_tables)
+    return backends
+
+
+def install_from_config(agent_config, config=None) -> bool:
+    """Install the backends the ``agent`` section asks for; False if none."""
+    parquet_tables: Dict[str, str] = {}
+    if agent_config.duckdb_parquet:
+        gcp = get_config(config).gcp
+        table_id = f"{gcp.project_id}.{gcp.dataset_id}.{gcp.table_name}"
+        parquet_tables[table_id] = agent_config.duckdb_parquet
+    if agent_config.backend == "gcp" and not parquet_tables:
+        return False
+    install(
+        **build_backends(agent_config.backend, agent_config.backend_dir, parquet_tables)
+    )
+    return True
+
+
+def iter_recorded(root: str, kind: str) -> Iterable[Dict[str, Any]]:
+    """Recorded interactions of one kind (``llm`` or ``warehouse``)."""
+    for path in sorted(glob.glob(os.path.join(root, kind, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            yield json.load(f)
@@ -1,106 +1,349 @@
+import asyncio
+import threading
 import time
-import vertexai
-from vertexai.generative_models import (
-    GenerationConfig,
-    GenerativeModel,
-    HarmCategory,
-    HarmBlockThreshold,
-    SafetySetting,
-)
-from google.cloud import bigquery
-from google.auth import default
-from google.auth.transport.requests import Request
-from my_function.config import FunctionConfig
-from typing import Any, Dict, Optional
+from my_function.config import AgentConfig, ConfigProvider, FunctionConfig
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
 from typing import cast
+from .prompt_builder import estimate_tokens, tokens_for_chars
 
+# The Vertex AI and BigQuery SDKs take seconds to import, so they are only
+# imported when the first client or model is built (see ``warm_up`` for
+# doing that in the background at startup)
 
 _bq_client = None
 _vertex_initialized = False
+_model_registry = None
+# Set by backends.install to run offline (record/replay); None calls Gemini
+_llm_backend = None
+_llm_policy = None
+_rate_limits = None
+_config_provider = ConfigProvider("config.yaml")
+_init_lock = threading.Lock()
+
+
+def get_config_provider():
+    return _config_provider
 
 
 def get_config(config=None):
     if config is not None:
         return config
-    if config is None:
-        config = FunctionConfig.from_yaml("config.yaml")
-    return config
+    # Parsed once per process; re-read only when config.yaml changes
+    return _config_provider.get()
+
+
+def get_agent_config(config=None) -> AgentConfig:
+    # Test doubles and hand-built configs may not carry an agent section
+    agent_config = getattr(get_config(config), "agent", None)
+    if isinstance(agent_config, AgentConfig):
+        return agent_config
+    return AgentConfig()
 
 
 def init_vertex():
     global _vertex_initialized
     if not _vertex_initialized:
-        config = get_config()
-        vertexai.init(
-            project=config.gcp.project_id,
-            location="global",
-        )
-        _vertex_initialized = True
+        with _init_lock:
+            if not _vertex_initialized:
+                import vertexai
+
+                config = get_config()
+                vertexai.init(
+                    project=config.gcp.project_id,
+                    location="global",
+                )
+                _vertex_initialized = True
 
 
 def get_bq_client():
     global _bq_client
     if _bq_client is None:
-        config = get_config()
-        _bq_client = bigquery.Client(project=config.gcp.project_id)
+        with _init_lock:
+            if _bq_client is None:
+                from google.cloud import bigquery
+
+                config = get_config()
+                _bq_client = bigquery.Client(project=config.gcp.project_id)
     return _bq_client
 
 
-# Base function to generate response from Gemini
+def set_bq_client(client) -> None:
+    """Use ``client`` (anything with a BigQuery-style ``query``) for queries."""
+    global _bq_client
+    _bq_client = client
+
+
+def set_llm_backend(backend) -> None:
+    """Route ``generate`` through ``backend``; None restores Gemini."""
+    global _llm_backend
+    _llm_backend = backend
+
+
+def get_llm_backend():
+    return _llm_backend
+
+
+def get_model_registry():
+    global _model_registry
+    if _model_registry is None:
+        with _init_lock:
+            if _model_registry is None:
+                from .model_registry import ModelRegistry
+
+                _model_registry = ModelRegistry()
+    return _model_registry
+
+
+def get_llm_policy(config=None):
+    """Retry/hedge/breaker policy for Gemini calls, rebuilt when its settings change."""
+    global _llm_policy
+    from .llm_policy import build_llm_policy
+
+    agent_config = get_agent_config(config)
+    deadline = getattr(get_config(config), "timeout_seconds", None)
+    if not isinstance(deadline, (int, float)):
+        deadline = None
+    key = (
+        agent_config.llm_max_attempts,
+        agent_config.llm_backoff_seconds,
+        agent_config.llm_attempt_timeout_seconds,
+        agent_config.llm_hedge_percentile,
+        agent_config.llm_breaker_failures,
+        agent_config.llm_breaker_reset_seconds,
+        deadline,
+    )
+    cached = _llm_policy
+    if cached is None or cached[0] != key:
+        cached = _llm_policy = (key, build_llm_policy(agent_config, deadline))
+    return cached[1]
+
+
+def get_rate_limits(config=None):
+    """Vertex AI rate limiter and concurrency governor (``rate_limiter``)."""
+    global _rate_limits
+    from .rate_limiter import ConcurrencyGovernor, build_rate_limiter
+
+    agent_config = get_agent_config(config)
+    key = (
+        agent_config.llm_requests_per_minute,
+        agent_config.llm_tokens_per_minute,
+        agent_config.llm_rate_limit_backend,
+        agent_config.llm_rate_limit_path,
+        agent_config.llm_rate_limit_max_wait_seconds,
+        agent_config.llm_max_concurrency,
+    )
+    cached = _rate_limits
+    if cached is None or cached[0] != key:
+        limits = (
+            build_rate_limiter(agent_config),
+            ConcurrencyGovernor(
+                agent_config.llm_max_concurrency,
+                agent_config.llm_rate_limit_max_wait_seconds,
+            ),
+        )
+        cached = _rate_limits = (key, limits)
+    return cached[1]
+
+
+# Base function to generate response from Gemini, with the retry, hedging
+# and circuit-breaker policy of ``llm_policy``
 def generate(
     prompt: str,
     response_schema: Optional[Dict[str, Any]] = None,
+) -> str:
+    call = _llm_backend.generate if _llm_backend is not None else vertex_generate
+    return cast(
+        str,
+        get_llm_policy().call(
+            call, prompt, response_schema, acquire=_rate_limit_acquirer(prompt)
+        ),
+    )
+
+
+def _rate_limit_acquirer(
+    prompt: str, governed: bool = True
+) -> Callable[[], Optional[Callable[[], None]]]:
+    # Called by the policy before each attempt starts its timeout; the policy
+    # gives the governor slot back once the attempt has finished
+    limiter, governor = get_rate_limits()
+    tokens = estimate_tokens(prompt)
+
+    def acquire():
+        limiter.acquire(tokens)
+        return governor.acquire() if governed else None
+
+    return acquire
+
+
+def _rate_limit_acquirer_async(
+    prompt: str,
+) -> Callable[[], Awaitable[Callable[[], None]]]:
+    limiter, governor = get_rate_limits()
+    tokens = estimate_tokens(prompt)
+
+    async def acquire():
+        await limiter.acquire_async(tokens)
+        return await governor.acquire_async()
+
+    return acquire
+
+
+def vertex_generate(
+    prompt: str,
+    response_schema: Optional[Dict[str, Any]] = None,
 ) -> str:
     config = get_config()
     init_vertex()
 
-    model = GenerativeModel(config.gcp.ai_model)
+    bundle = get_model_registry().get(config.gcp.ai_model, response_schema)
 
-    # Generation config
-    if response_schema:
-        model_config = GenerationConfig(
-            max_output_tokens=8192,
-            temperature=0.0,
-            top_p=1,
-            response_mime_type="application/json",
-            response_schema=response_schema,
-        )
+    # The policy has already waited for the limiter and governor (see generate)
+    limiter, _ = get_rate_limits()
+    responses = bundle.model.generate_content(
+        prompt,
+        generation_config=bundle.generation_config,
+        safety_settings=bundle.safety_settings,
+        stream=False,
+    )
+
+    text = response_text(responses)
+    limiter.charge(estimate_tokens(text))
+    return text
+
+
+def generate_stream(
+    prompt: str,
+    response_schema: Optional[Dict[str, Any]] = None,
+) -> Iterator[str]:
+    """
+    Like ``generate``, but yield the response text chunk by chunk as Gemini
+    writes it. The retry policy covers the call up to its first chunk; a
+    backend without ``generate_stream`` yields its whole response at once.
+    """
+    if _llm_backend is None:
+        opener: Any = vertex_generate_stream
+    elif hasattr(_llm_backend, "generate_stream"):
+        opener = _llm_backend.generate_stream
     else:
-        model_config = GenerationConfig(
-            max_output_tokens=8192, temperature=0.0, top_p=1
+        yield generate(prompt, response_schema)
+        return
+    # The stream outlives the policy's attempt, so its governor slot is held
+    # here, before the policy (a refusal is not a Gemini failure), until the
+    # last chunk
+    _, governor = get_rate_limits()
+    release = governor.acquire()
+    try:
+        first, chunks = get_llm_policy().call(
+            _open_stream,
+            opener,
+            prompt,
+            response_schema,
+            acquire=_rate_limit_acquirer(prompt, governed=False),
         )
+        if first is not None:
+            yield first
+            yield from chunks
+    finally:
+        release()
 
-    # Safety config
-    safety_config = [
-        SafetySetting(
-            category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-            threshold=HarmBlockThreshold.BLOCK_NONE,
-        ),
-        SafetySetting(
-            category=HarmCategory.HARM_CATEGORY_HARASSMENT,
-            threshold=HarmBlockThreshold.BLOCK_NONE,
-        ),
-        SafetySetting(
-            category=HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-            threshold=HarmBlockThreshold.BLOCK_NONE,
-        ),
-        SafetySetting(
-            category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-            threshold=HarmBlockThreshold.BLOCK_NONE,
+
+def _open_stream(opener, prompt, response_schema):
+    chunks = iter(opener(prompt, response_schema))
+    return next(chunks, None), chunks
+
+
+def vertex_generate_stream(
+    prompt: str,
+    response_schema: Optional[Dict[str, Any]] = None,
+) -> Iterator[str]:
+    config = get_config()
+    init_vertex()
+
+    bundle = get_model_registry().get(config.gcp.ai_model, response_schema)
+
+    # generate_stream has already waited for the limiter and governor
+    limiter, _ = get_rate_limits()
+    produced = 0
+    responses = bundle.model.generate_content(
+        prompt,
+        generation_config=bundle.generation_config,
+        safety_settings=bundle.safety_settings,
+        stream=True,
+    )
+    for response in responses:
+        text = chunk_text(response)
+        produced += len(text)
+        if text:
+            yield text
+    limiter.charge(tokens_for_chars(produced))
+
+
+# Async variant of generate for the ASGI request path
+async def generate_async(
+    prompt: str,
+    response_schema: Optional[Dict[str, Any]] = None,
+) -> str:
+    policy = get_llm_policy()
+    if _llm_backend is not None:
+        return cast(
+            str,
+            await policy.call_async(
+                asyncio.to_thread,
+                _llm_backend.generate,
+                prompt,
+                response_schema,
+                acquire=_rate_limit_acquirer_async(prompt),
+            ),
+        )
+    return cast(
+        str,
+        await policy.call_async(
+            vertex_generate_async,
+            prompt,
+            response_schema,
+            acquire=_rate_limit_acquirer_async(prompt),
         ),
-    ]
+    )
+
 
-    responses = model.generate_content(
+async def vertex_generate_async(
+    prompt: str,
+    response_schema: Optional[Dict[str, Any]] = None,
+) -> str:
+    config = get_config()
+    init_vertex()
+
+    bundle = get_model_registry().get(config.gcp.ai_model, response_schema)
+
+    # The policy has already waited for the limiter and governor (see generate)
+    limiter, _ = get_rate_limits()
+    responses = await bundle.model.generate_content_async(
         prompt,
-        generation_config=model_config,
-        safety_settings=safety_config,
+        generation_config=bundle.generation_config,
+        safety_settings=bundle.safety_settings,
         stream=False,
     )
 
+    text = response_text(responses)
+    limiter.charge(estimate_tokens(text))
+    return text
+
+
+def chunk_text(response) -> str:
+    """Text of one streamed chunk; the last chunk may carry none."""
+    try:
+        return str(response.candidates[0].content.parts[0].text)
+    except (AttributeError, IndexError):
+        return ""
+
+
+def response_text(responses) -> str:
     try:
         final_response = cast(str, responses.candidates[0].content.parts[0].text)
     except Exception as e:
         print("Error extracting Gemini response:", e)
         print("error", responses)
+        # No candidates or parts, e.g. a blocked prompt: not worth retrying
+        raise ValueError(f"Gemini returned no text: {e}") from e
 
     return str(final_response)
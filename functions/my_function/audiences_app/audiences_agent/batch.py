@@ -0,0 +1,166 @@
+"""
+Batch audience generation for many attribute goals at once.
+
+``run_audience_batch`` loads the context once, fans the Gemini calls out over
+a bounded thread pool and counts finished audiences in groups, one combined
+BigQuery job per group (see ``counting.count_many``). Results are yielded per
+goal as soon as their group has been counted, each with its own success flag
+and error message. An item only succeeds once it has a count: an unusable
+Gemini response, a clause rejected by validation or a failed count query
+makes it fail, with the audience fields it did get.
+"""
+
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from . import agent
+from .base_functions import get_agent_config, get_bq_client, get_config
+from .counting import AudienceSize, count_many
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_COUNT_BATCH_SIZE = 50
+DEFAULT_FLUSH_SECONDS = 2.0
+
+
+def run_audience_batch(
+    attribute_goals: Sequence[str],
+    config=None,
+    client=None,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    count_batch_size: int = DEFAULT_COUNT_BATCH_SIZE,
+    flush_seconds: float = DEFAULT_FLUSH_SECONDS,
+    use_cache: bool = True,
+    sizing_mode: Optional[str] = None,
+    user: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Generate audiences for many goals, yielding results as they complete.
+
+    Args:
+        attribute_goals: Goals to generate audiences for.
+        max_concurrency: Maximum number of Gemini calls in flight.
+        count_batch_size: Maximum number of clauses per combined count query.
+        flush_seconds: Longest time a finished clause waits for its group to
+            fill up before it is counted anyway.
+        sizing_mode: ``exact``, ``approx`` or ``sample`` (default from config).
+        user: Caller charged for the count queries' bytes budget.
+
+    Yields:
+        One dict per goal with ``index``, ``attribute_goal`` and ``success``,
+        plus the usual audience fields or an ``error`` message.
+    """
+    config = get_config(config)
+    # Count queries go through the cost gate like single requests do
+    client = agent.get_query_executor(config).bind(client or get_bq_client(), user)
+    sizing_mode = agent.resolve_sizing_mode(config, sizing_mode)
+    sample_percent = get_agent_config(config).sample_percent
+
+    context_json, col_values_json, context_version = agent.load_audience_context(config)
+    model_name = str(getattr(config.gcp, "ai_model", ""))
+    response_cache = agent.get_response_cache(config) if use_cache else None
+    rollup = agent.get_rollup_rewriter(
+        config, context_json, col_values_json, context_version
+    )
+
+    def generate_one(goal: str) -> Dict[str, Any]:
+        result = agent.generate_audience_definition(
+            goal, context_json, col_values_json, context_version, config
+        )
+        return agent.check_audience_definition(
+            config, result, context_json, col_values_json, context_version
+        )
+
+    pending: List[Tuple[int, str, Dict[str, Any]]] = []
+
+    def flush() -> Iterator[Dict[str, Any]]:
+        while pending:
+            group = pending[:count_batch_size]
+            del pending[:count_batch_size]
+            clauses = [
+                agent.countable_clause(r)
+                for _, _, r in group
+                if agent.countable_clause(r)
+            ]
+            sizes = iter(
+                count_many(client, config, clauses, sizing_mode, sample_percent, rollup)
+            )
+            for index, goal, result in group:
+                if agent.countable_clause(result):
+                    result.update(next(sizes).as_dict())
+                else:
+                    result.update(AudienceSize(None, sizing_mode).as_dict())
+                error = item_error(result)
+                if response_cache is not None and error is None:
+                    response_cache.store(
+                        goal, context_version, model_name, result, variant=sizing_mode
+                    )
+                item = {"index": index, "attribute_goal": goal, "success": not error}
+                if error is not None:
+                    item["error"] = error
+                yield {**item, **result}
+
+    pool = ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        futures: Dict[Future, Tuple[int, str]] = {}
+        for index, goal in enumerate(attribute_goals):
+            if response_cache is not None:
+                cached = response_cache.lookup(
+                    goal, context_version, model_name, variant=sizing_mode
+                )
+                if cached is not None:
+                    yield {
+                        "index": index,
+                        "attribute_goal": goal,
+                        "success": True,
+                        **cached,
+                    }
+                    continue
+            # Carry the request id over to the worker's spans
+            context = contextvars.copy_context()
+            futures[pool.submit(context.run, generate_one, goal)] = (index, goal)
+
+        oldest_pending = 0.0
+        while futures:
+            timeout = None
+            if pending:
+                timeout = max(0.0, oldest_pending + flush_seconds - time.monotonic())
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, goal = futures.pop(future)
+                try:
+                    definition = future.result()
+                except Exception as e:
+                    yield {
+                        "index": index,
+                        "attribute_goal": goal,
+                        "success": False,
+                        "error": str(e),
+                    }
+                    continue
+                if not pending:
+                    oldest_pending = time.monotonic()
+                pending.append((index, goal, definition))
+            # Count when a group is full, when the oldest finished clause has
+            # waited flush_seconds, or when the last Gemini call is done
+            if pending and (
+                len(pending) >= count_batch_size
+                or time.monotonic() - oldest_pending >= flush_seconds
+                or not futures
+            ):
+                yield from flush()
+    finally:
+        # The consumer may stop early (e.g. a closed HTTP stream)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def item_error(result: Dict[str, Any]) -> Optional[str]:
+    """Why a counted result is not a usable audience, or None if it is."""
+    if not result["filter_clause"]:
+        return "Gemini returned no usable filter clause"
+    if result.get("validation_errors"):
+        return "Filter clause rejected: " + "; ".join(result["validation_errors"])
+    if result["matching_users"] is None:
+        return result.get("count_error") or "Count query failed"
+    return None
@@ -0,0 +1,403 @@
+"""
+Local checks for generated filter clauses, run before any BigQuery call.
+
+``validate_clause`` tokenizes a ``filter_clause`` and checks it against a
+``ColumnIndex`` built from the schema in ``context_json``:
+
+- syntax: balanced parentheses, terminated strings and comments, a single
+  expression (comments are stripped from the clause, not validated)
+- every referenced identifier is a schema column (function names, keywords,
+  date parts and pseudo-columns such as ``_PARTITIONTIME`` are skipped)
+- ``columns_used`` lists exactly the referenced columns
+- comparisons between a column and a literal fit the column's ``data_type``
+- binary columns use only ``= 1`` / ``= 0``, as the prompt requires
+
+Problems with an unambiguous fix are repaired: a misspelled column with a
+single close match, a numeric literal compared to a STRING column (or the
+reverse), ``cart_add > 0`` style tests on binary columns, and a wrong
+``columns_used`` list. Everything else is reported as an error.
+
+The checks are deliberately conservative: anything the tokenizer does not
+understand (for example a subquery) is left to BigQuery rather than
+rejected.
+"""
+
+import difflib
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+NUMERIC_TYPES = {
+    "INT",
+    "INT64",
+    "INTEGER",
+    "SMALLINT",
+    "BIGINT",
+    "TINYINT",
+    "BYTEINT",
+    "FLOAT",
+    "FLOAT64",
+    "NUMERIC",
+    "BIGNUMERIC",
+    "DECIMAL",
+    "BIGDECIMAL",
+}
+STRING_TYPES = {"STRING"}
+BOOL_TYPES = {"BOOL", "BOOLEAN"}
+
+KEYWORDS = {
+    "AND", "OR", "NOT", "IS", "NULL", "TRUE", "FALSE", "IN", "LIKE", "BETWEEN",
+    "CASE", "WHEN", "THEN", "ELSE", "END", "AS", "CAST", "SAFE_CAST", "INTERVAL",
+    "FROM", "SELECT", "WHERE", "EXISTS", "UNNEST", "DISTINCT", "ANY", "SOME",
+    "ALL", "ESCAPE", "DATE", "DATETIME", "TIMESTAMP", "TIME", "NUMERIC",
+    "BIGNUMERIC", "JSON", "RANGE", "CURRENT_DATE", "CURRENT_DATETIME",
+    "CURRENT_TIMESTAMP", "CURRENT_TIME", "STRING", "INT64", "FLOAT64", "BOOL",
+    "BYTES", "ARRAY", "STRUCT",
+}  # fmt: skip
+DATE_PARTS = {
+    "MICROSECOND", "MILLISECOND", "SECOND", "MINUTE", "HOUR", "DAY", "DAYOFWEEK",
+    "DAYOFYEAR", "WEEK", "ISOWEEK", "MONTH", "QUARTER", "YEAR", "ISOYEAR",
+    "SUNDAY", "MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY",
+}  # fmt: skip
+PSEUDO_COLUMNS = {"_PARTITIONTIME", "_PARTITIONDATE", "_TABLE_SUFFIX"}
+COMPARISONS = {"=", "!=", "<>", "<", "<=", ">", ">="}
+BINARY_REPAIRS = {
+    (">", "0"): "1",
+    (">=", "1"): "1",
+    ("!=", "0"): "1",
+    ("<>", "0"): "1",
+    ("<", "1"): "0",
+    ("<=", "0"): "0",
+    ("!=", "1"): "0",
+    ("<>", "1"): "0",
+}
+CLOSE_MATCH_CUTOFF = 0.85
+
+_TOKEN = re.compile(
+    r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|\#[^\n]*|/\*(?s:.*?)\*/)
+  | (?P<string>[rRbB]?'(?:[^'\\]|\\.)*'|[rRbB]?"(?:[^"\\]|\\.)*")
+  | (?P<number>\d+\.\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?|\d+(?:[eE][+-]?\d+)?)
+  | (?P<ident>`[^`]+`|[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)
+  | (?P<op><=|>=|<>|!=|\|\||[=<>+\-*/%])
+  | (?P<punct>[(),\[\]])
+    """,
+    re.VERBOSE,
+)
+
+
+@dataclass
+class Token:
+    kind: str
+    text: str
+    start: int
+
+
+@dataclass
+class ColumnIndex:
+    """Schema columns by lower-cased name, with declared types."""
+
+    columns: Dict[str, Tuple[str, str]]  # lower name -> (name, data_type)
+    binary: Set[str] = field(default_factory=set)  # lower names
+
+    @classmethod
+    def from_context(
+        cls, context_json, binary_columns: Iterable[str] = ()
+    ) -> "ColumnIndex":
+        columns = {
+            col["name"].lower(): (col["name"], col.get("data_type", "").upper())
+            for col in (context_json or {}).get("columns", [])
+            if col.get("name")
+        }
+        return cls(columns, {name.lower() for name in binary_columns})
+
+    def lookup(self, name: str) -> Optional[Tuple[str, str]]:
+        return self.columns.get(name.lower())
+
+    def closest(self, name: str) -> Optional[str]:
+        matches = difflib.get_close_matches(
+            name.lower(), list(self.columns), n=2, cutoff=CLOSE_MATCH_CUTOFF
+        )
+        # Only repair when the match is unambiguous
+        if len(matches) == 1:
+            return self.columns[matches[0]][0]
+        return None
+
+
+@dataclass
+class ValidationResult:
+    filter_clause: str
+    columns_used: List[str]
+    errors: List[str] = field(default_factory=list)
+    repairs: List[str] = field(default_factory=list)
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors
+
+
+class ClauseSyntaxError(ValueError):
+    pass
+
+
+def tokenize(clause: str) -> List[Token]:
+    tokens = []
+    pos = 0
+    while pos < len(clause):
+        match = _TOKEN.match(clause, pos)
+        if match is None:
+            if clause[pos] in "'\"":
+                raise ClauseSyntaxError(f"Unterminated string at position {pos}")
+            raise ClauseSyntaxError(f"Unexpected character {clause[pos]!r}")
+        kind = match.lastgroup or ""
+        if kind == "op" and clause.startswith("/*", pos):
+            raise ClauseSyntaxError(f"Unterminated comment at position {pos}")
+        if kind not in ("space", "comment"):
+            tokens.append(Token(kind, match.group(), pos))
+        pos = match.end()
+    return tokens
+
+
+def strip_comments(clause: str) -> str:
+    """``clause`` without its ``--``, ``#`` and ``/* */`` comments."""
+    out = []
+    pos = 0
+    stripped = False
+    while pos < len(clause):
+        match = _TOKEN.match(clause, pos)
+        if match is None:
+            out.append(clause[pos:])  # tokenize reports the error
+            break
+        stripped |= match.lastgroup == "comment"
+        out.append(" " if match.lastgroup == "comment" else match.group())
+        pos = match.end()
+    return "".join(out).strip() if stripped else clause
+
+
+def _check_parens(tokens: List[Token]) -> None:
+    depth = 0
+    for token in tokens:
+        if token.text in "([":
+            depth += 1
+        elif token.text in ")]":
+            depth -= 1
+            if depth < 0:
+                raise ClauseSyntaxError("Unbalanced ')'")
+    if depth:
+        raise ClauseSyntaxError("Unbalanced '('")
+
+
+def _column_refs(tokens: List[Token], index: ColumnIndex) -> List[int]:
+    """Indexes of identifier tokens that should be columns."""
+    refs = []
+    for i, token in enumerate(tokens):
+        if token.kind != "ident":
+            continue
+        if i + 1 < len(tokens) and tokens[i + 1].text == "(":  # function call
+            continue
+        head = token.text.strip("`").split(".")[0]
+        if index.lookup(head) is None:
+            upper = head.upper()
+            if upper in KEYWORDS or upper in DATE_PARTS or upper in PSEUDO_COLUMNS:
+                continue
+            if i and tokens[i - 1].text.upper() == "AS":  # CAST(x AS type)
+                continue
+        refs.append(i)
+    return refs
+
+
+def _literal_kind(token: Token) -> Optional[str]:
+    if token.kind == "number":
+        return "number"
+    if token.kind == "string" and token.text[0] in "'\"":
+        return "string"
+    if token.kind == "ident" and token.text.upper() in ("TRUE", "FALSE"):
+        return "bool"
+    return None
+
+
+def _is_number(text: str) -> bool:
+    return re.fullmatch(r"-?\d+(\.\d+)?", text) is not None
+
+
+def validate_clause(
+    filter_clause: str,
+    columns_used: Optional[List[str]],
+    index: ColumnIndex,
+    repair: bool = True,
+) -> ValidationResult:
+    """
+    Check ``filter_clause`` against ``index``.
+
+    With ``repair`` the returned clause and ``columns_used`` carry the fixes
+    listed in ``repairs``; without it every problem is an error. Comments
+    are dropped either way: once the clause is inlined into a count query, a
+    ``--`` comment would swallow the rest of it.
+    """
+    filter_clause = strip_comments(filter_clause)
+    result = ValidationResult(filter_clause, list(columns_used or []))
+    try:
+        tokens = tokenize(filter_clause)
+        _check_parens(tokens)
+    except ClauseSyntaxError as e:
+        result.errors.append(f"Syntax error: {e}")
+        return result
+    if not tokens:
+        result.errors.append("Empty filter clause")
+        return result
+
+    texts = [t.text for t in tokens]
+    has_subquery = any(t.kind == "ident" and t.text.upper() == "SELECT" for t in tokens)
+
+    def problem(message: str, fixed: bool) -> None:
+        (result.repairs if fixed and repair else result.errors).append(message)
+
+    # Unknown columns
+    referenced: List[str] = []
+    for i in _column_refs(tokens, index):
+        name = tokens[i].text.strip("`")
+        head, _, rest = name.partition(".")
+        column = index.lookup(head)
+        if column is None:
+            if has_subquery:
+                continue  # may be an alias from the subquery
+            match = index.closest(head)
+            if match is None:
+                result.errors.append(f"Unknown column {head!r}")
+                continue
+            problem(f"Unknown column {head!r} replaced with {match!r}", True)
+            texts[i] = match + (f".{rest}" if rest else "")
+            column = index.lookup(match)
+        if column is not None and column[0] not in referenced:
+            referenced.append(column[0])
+
+    # Literal types in `column <op> literal`, `literal <op> column`, IN lists
+    for i, token in enumerate(tokens):
+        if token.kind == "op" and token.text in COMPARISONS and 0 < i < len(tokens) - 1:
+            # Only plain `a op b` comparisons, not `a + 1 > b`
+            outer = [tokens[j] for j in (i - 2, i + 2) if 0 <= j < len(tokens)]
+            if any(t.kind == "op" and t.text not in COMPARISONS for t in outer):
+                continue
+            for col_pos, lit_pos in ((i - 1, i + 1), (i + 1, i - 1)):
+                column = _column_at(tokens, texts, col_pos, index)
+                if column is not None:
+                    op = token.text if col_pos < lit_pos else ""
+                    _check_literal(column, op, lit_pos, tokens, texts, index, problem)
+        elif token.kind == "ident" and token.text.upper() in ("IN", "LIKE") and i:
+            negated = tokens[i - 1].text.upper() == "NOT"
+            column = _column_at(tokens, texts, i - 2 if negated else i - 1, index)
+            if column is None:
+                continue
+            if token.text.upper() == "LIKE":
+                if column[1] and column[1] not in STRING_TYPES | {"BYTES"}:
+                    result.errors.append(
+                        f"LIKE needs a STRING, but {column[0]!r} is {column[1]}"
+                    )
+                continue
+            for lit_pos in _in_list(tokens, i + 1):
+                _check_literal(column, "IN", lit_pos, tokens, texts, index, problem)
+
+    # Fixes are written into texts as they are found; keep them only on repair
+    if repair:
+        result.filter_clause = _render(filter_clause, tokens, texts)
+
+    # columns_used must list exactly the referenced columns
+    declared = {c.lower() for c in result.columns_used}
+    if not has_subquery and declared != {c.lower() for c in referenced}:
+        problem(
+            f"columns_used {result.columns_used} does not match the clause "
+            f"columns {referenced}",
+            True,
+        )
+        if repair:
+            result.columns_used = referenced
+    return result
+
+
+def _column_at(tokens: List[Token], texts: List[str], pos: int, index: ColumnIndex):
+    # Reads the (possibly repaired) text, so a corrected name is type-checked
+    if not 0 <= pos < len(tokens) or tokens[pos].kind != "ident":
+        return None
+    name = texts[pos].strip("`")
+    if "." in name:
+        return None  # struct field; type unknown
+    if pos + 1 < len(tokens) and tokens[pos + 1].text == "(":
+        return None  # function call
+    return index.lookup(name)
+
+
+def _in_list(tokens: List[Token], start: int) -> List[int]:
+    """Positions of the top-level items of ``IN (...)`` that are single tokens."""
+    if start >= len(tokens) or tokens[start].text != "(":
+        return []
+    items, depth = [], 0
+    for pos in range(start, len(tokens)):
+        text = tokens[pos].text
+        if text in "([":
+            depth += 1
+        elif text in ")]":
+            depth -= 1
+            if depth == 0:
+                break
+        elif (
+            depth == 1
+            and tokens[pos - 1].text in ("(", ",")
+            and tokens[pos + 1].text in (")", ",")
+        ):
+            items.append(pos)
+    return items
+
+
+def _check_literal(column, op, lit_pos, tokens, texts, index, problem) -> None:
+    """Check one literal compared with ``column``; ``op`` is "" if it is on the left."""
+    literal = tokens[lit_pos]
+    kind = _literal_kind(literal)
+    name, data_type = column
+    if kind is None or not data_type:
+        return
+    value = literal.text[1:-1] if kind == "string" else literal.text
+
+    if data_type in NUMERIC_TYPES:
+        if kind == "string" and _is_number(value):
+            problem(f"Quoted number {literal.text} compared with {name!r}", True)
+            texts[lit_pos] = value
+        elif kind != "number":
+            problem(f"{literal.text} compared with numeric column {name!r}", False)
+    elif data_type in STRING_TYPES:
+        if kind == "number":
+            problem(f"Number {value} compared with STRING column {name!r}", True)
+            texts[lit_pos] = f"'{value}'"
+        elif kind == "bool":
+            problem(f"{value} compared with STRING column {name!r}", False)
+    elif data_type in BOOL_TYPES:
+        if kind != "bool":
+            problem(f"{literal.text} compared with BOOL column {name!r}", False)
+        return
+
+    if name.lower() not in index.binary or kind != "number" or op not in COMPARISONS:
+        return
+    if op == "=" and value in ("0", "1"):
+        return
+    fixed = BINARY_REPAIRS.get((op, value))
+    problem(
+        f"Binary column {name!r} must be tested with = 1 or = 0, not {op} {value}",
+        fixed is not None,
+    )
+    if fixed is not None:
+        texts[lit_pos - 1] = "="
+        texts[lit_pos] = fixed
+
+
+def _render(clause: str, tokens: List[Token], texts: List[str]) -> str:
+    """Rebuild the clause, keeping the original spacing around tokens."""
+    if all(t.text == text for t, text in zip(tokens, texts)):
+        return clause
+    out = []
+    pos = 0
+    for token, text in zip(tokens, texts):
+        out.append(clause[pos : token.start])
+        out.append(text)
+        pos = token.start + len(token.text)
+    out.append(clause[pos:])
+    return "".join(out)
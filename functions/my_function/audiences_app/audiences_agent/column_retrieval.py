@@ -0,0 +1,295 @@
+"""
+Embedding retrieval of the schema columns relevant to an attribute goal.
+
+On wide event tables the schema listing and the column values make the
+prompt long, and the many unrelated columns distract Gemini. A
+``ColumnRetriever`` keeps one unit vector per column, built from the
+embeddings of its name, description and first few values (weighted 3, 2
+and 1). A goal is embedded the same way, and the best-scoring columns are
+the only ones sent in the prompt.
+
+The vectors are built once per context version and saved under a directory
+as a NumPy ``.npy`` file and a JSON list of column names. Later processes
+load them memory-mapped instead of embedding the schema again. A query is
+then one matrix-vector product.
+
+Two embedders are available:
+
+- ``HashingEmbedder``: word and character-trigram features hashed into a
+  fixed number of dimensions. It is deterministic, needs no network access,
+  and embeds hundreds of columns in a fraction of a second.
+- ``VertexEmbedder``: Vertex AI text embeddings. If they cannot be built,
+  the retriever falls back to hashing.
+"""
+
+import hashlib
+import json
+import math
+import os
+from typing import Any, Dict, List, Optional, Protocol, Sequence
+
+import numpy as np
+
+from .context_selection import tokenize
+
+FORMAT_VERSION = 1
+NAME_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 2.0
+VALUES_WEIGHT = 1.0
+WEIGHTS = (NAME_WEIGHT, DESCRIPTION_WEIGHT, VALUES_WEIGHT)
+DEFAULT_DIMENSIONS = 1024
+DEFAULT_VALUES_PER_COLUMN = 20
+TRIGRAM_WEIGHT = 0.5
+VERTEX_BATCH_SIZE = 50
+# Words in most goals that say nothing about which column is meant
+STOPWORDS = frozenset(
+    "a an and any are at by for from in is of on or the to that who whose with "
+    "user visitor customer people person audience find all".split()
+)
+
+
+class Embedder(Protocol):
+    # Identifies the vector space; indexes are only reused by the same one
+    name: str
+
+    def embed_documents(self, texts: Sequence[str]) -> np.ndarray: ...
+
+    def embed_query(self, text: str) -> np.ndarray: ...
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words and their character trigrams."""
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}-v{FORMAT_VERSION}"
+
+    def _features(self, text: str) -> Dict[str, float]:
+        features: Dict[str, float] = {}
+        for word in tokenize(text):
+            if word in STOPWORDS:
+                continue
+            features[word] = features.get(word, 0.0) + 1.0
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                trigram = "#" + padded[i : i + 3]
+                features[trigram] = features.get(trigram, 0.0) + TRIGRAM_WEIGHT
+        return features
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature, count in self._features(text).items():
+            # Not hash(): the buckets must not change between processes
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            h = int.from_bytes(digest, "little")
+            sign = -1.0 if h >> 63 else 1.0
+            vector[h % self.dimensions] += sign * (1.0 + math.log(count))
+        return _normalize(vector)
+
+    def embed_documents(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return np.stack([self._embed(text) for text in texts])
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._embed(text)
+
+
+class VertexEmbedder:
+    """Vertex AI text embeddings (``vertexai.language_models``)."""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.name = f"vertex-{model_name}"
+        self._model: Any = None
+
+    def _get_model(self):
+        if self._model is None:
+            from vertexai.language_models import TextEmbeddingModel
+
+            from .base_functions import init_vertex
+
+            init_vertex()
+            self._model = TextEmbeddingModel.from_pretrained(self.model_name)
+        return self._model
+
+    def _embed(self, texts: Sequence[str], task_type: str) -> np.ndarray:
+        from vertexai.language_models import TextEmbeddingInput
+
+        model = self._get_model()
+        rows: List[List[float]] = []
+        for start in range(0, len(texts), VERTEX_BATCH_SIZE):
+            batch = texts[start : start + VERTEX_BATCH_SIZE]
+            embeddings = model.get_embeddings(
+                [TextEmbeddingInput(text or " ", task_type) for text in batch]
+            )
+            rows.extend(embedding.values for embedding in embeddings)
+        return _normalize(np.asarray(rows, dtype=np.float32))
+
+    def embed_documents(self, texts: Sequence[str]) -> np.ndarray:
+        return self._embed(texts, "RETRIEVAL_DOCUMENT")
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._embed([text], "RETRIEVAL_QUERY")[0]
+
+
+class ColumnRetriever:
+    """
+    Args:
+        columns: Column names, in schema order.
+        vectors: One unit vector per column (may be a read-only memmap).
+        embedder: The embedder that built ``vectors``; it embeds the goals.
+    """
+
+    def __init__(self, columns: List[str], vectors: np.ndarray, embedder: Embedder):
+        self.columns = columns
+        self.vectors = vectors
+        self.embedder = embedder
+
+    @classmethod
+    def build(
+        cls,
+        context_json: Dict[str, Any],
+        col_values_json: Dict[str, Any],
+        embedder: Embedder,
+        values_per_column: int = DEFAULT_VALUES_PER_COLUMN,
+    ) -> "ColumnRetriever":
+        schema = [col for col in context_json.get("columns", []) if col.get("name")]
+        names = [col["name"] for col in schema]
+        parts = [
+            (
+                " ".join(tokenize(col["name"])),
+                col.get("description", ""),
+                column_values_text(col_values_json.get(col["name"]), values_per_column),
+            )
+            for col in schema
+        ]
+        # One batch for all the texts; empty texts add nothing
+        texts = [text for column in parts for text in column if text.strip()]
+        if not texts:
+            return cls(names, np.zeros((len(names), 1), dtype=np.float32), embedder)
+        embedded = embedder.embed_documents(texts)
+        matrix = np.zeros((len(names), embedded.shape[1]), dtype=np.float32)
+        row = 0
+        for i, column in enumerate(parts):
+            for text, weight in zip(column, WEIGHTS):
+                if text.strip():
+                    matrix[i] += weight * embedded[row]
+                    row += 1
+        return cls(names, _normalize(matrix).astype(np.float32), embedder)
+
+    @classmethod
+    def load_or_build(
+        cls,
+        directory: str,
+        context_version: str,
+        context_json: Dict[str, Any],
+        col_values_json: Dict[str, Any],
+        embedder: Embedder,
+        values_per_column: int = DEFAULT_VALUES_PER_COLUMN,
+    ) -> "ColumnRetriever":
+        """Load the saved index for this version, or build and save it."""
+        base = os.path.join(
+            directory, index_key(context_version, embedder, values_per_column)
+        )
+        try:
+            with open(base + ".json", "r", encoding="utf-8") as f:
+                columns = json.load(f)["columns"]
+            vectors = np.load(base + ".npy", mmap_mode="r")
+            if vectors.shape[0] == len(columns):
+                return cls(columns, vectors, embedder)
+        except (OSError, ValueError, KeyError):
+            pass
+        retriever = cls.build(
+            context_json, col_values_json, embedder, values_per_column
+        )
+        try:
+            retriever.save(base)
+        except OSError as e:
+            print("Error saving column index:", e)
+        return retriever
+
+    def save(self, base: str) -> None:
+        """Write ``base.npy`` and ``base.json``; each appears atomically."""
+        os.makedirs(os.path.dirname(base) or ".", exist_ok=True)
+        tmp = f"{base}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, np.asarray(self.vectors))
+        os.replace(tmp, base + ".npy")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"columns": self.columns, "embedder": self.embedder.name}, f)
+        os.replace(tmp, base + ".json")
+
+    def scores(self, attribute_goal: str) -> np.ndarray:
+        return self.vectors @ self.embedder.embed_query(attribute_goal)
+
+    def top_k(self, attribute_goal: str, k: int) -> List[str]:
+        """The ``k`` columns closest to the goal, best first."""
+        if k >= len(self.columns):
+            k = len(self.columns)
+        if k <= 0:
+            return []
+        scores = self.scores(attribute_goal)
+        best = np.argpartition(-scores, k - 1)[:k]
+        # Stable sort, so ties keep schema order
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [self.columns[i] for i in best]
+
+
+def column_values_text(values: Any, limit: int) -> str:
+    if values is None:
+        return ""
+    if not isinstance(values, list):
+        values = [values]
+    return ", ".join(str(value) for value in values[:limit])
+
+
+def index_key(context_version: str, embedder: Embedder, values_per_column: int) -> str:
+    key = f"{FORMAT_VERSION}|{context_version}|{embedder.name}|{values_per_column}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:24]
+
+
+def build_embedder(agent_config) -> Embedder:
+    """The embedder an ``AgentConfig`` asks for; offline backends use hashing."""
+    if agent_config.column_embedding == "vertex":
+        if agent_config.backend == "gcp":
+            return VertexEmbedder(agent_config.column_embedding_model)
+        return HashingEmbedder()
+    if agent_config.column_embedding != "hashing":
+        raise ValueError(f"Unknown column_embedding {agent_config.column_embedding!r}")
+    return HashingEmbedder()
+
+
+def build_column_retriever(
+    agent_config,
+    context_version: str,
+    context_json: Dict[str, Any],
+    col_values_json: Dict[str, Any],
+    embedder: Optional[Embedder] = None,
+) -> ColumnRetriever:
+    """Load or build the index; falls back to hashing if embedding fails."""
+    embedder = embedder or build_embedder(agent_config)
+    try:
+        return ColumnRetriever.load_or_build(
+            agent_config.column_index_dir,
+            context_version,
+            context_json,
+            col_values_json,
+            embedder,
+        )
+    except Exception as e:
+        if isinstance(embedder, HashingEmbedder):
+            raise
+        print(f"Error embedding columns with {embedder.name}, using hashing:", e)
+        return ColumnRetriever.load_or_build(
+            agent_config.column_index_dir,
+            context_version,
+            context_json,
+            col_values_json,
+            HashingEmbedder(),
+        )
@@ -0,0 +1,218 @@
+"""
+In-process cache for the JSON context blobs read by the audience agent.
+
+The schema dictionary and the distinct column values live in GCS and change
+rarely, but every audience request needs both. ``ContextCache`` keeps the
+parsed JSON in memory for ``ttl_seconds``. When an entry expires it is
+revalidated with a metadata-only lookup: if the object generation is
+unchanged the parsed copy is reused, otherwise the blob is downloaded and
+parsed again.
+
+The object store is pluggable so the cache can be exercised against a local
+directory (``LocalObjectStore``) instead of GCS.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Protocol, Tuple
+
+
+class ObjectStore(Protocol):
+    """Minimal object store interface used by ``ContextCache``."""
+
+    def get_generation(self, bucket_name: str, blob_name: str) -> Optional[str]:
+        """Return the current generation/ETag of a blob, or None if missing."""
+        ...
+
+    def download_text(
+        self, bucket_name: str, blob_name: str
+    ) -> Tuple[str, Optional[str]]:
+        """Return the blob content and the generation it was read at."""
+        ...
+
+
+class GcsObjectStore:
+    """``ObjectStore`` backed by Google Cloud Storage."""
+
+    def __init__(self, client=None):
+        self._client = client
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from google.cloud import storage  # type: ignore[attr-defined]
+
+                    self._client = storage.Client()
+        return self._client
+
+    def get_generation(self, bucket_name: str, blob_name: str) -> Optional[str]:
+        # get_blob issues a metadata-only GET, no object payload is transferred
+        blob = self._get_client().bucket(bucket_name).get_blob(blob_name)
+        if blob is None:
+            return None
+        return _blob_version(blob)
+
+    def download_text(
+        self, bucket_name: str, blob_name: str
+    ) -> Tuple[str, Optional[str]]:
+        blob = self._get_client().bucket(bucket_name).blob(blob_name)
+        content = blob.download_as_text()
+        return content, _blob_version(blob)
+
+
+def _blob_version(blob) -> Optional[str]:
+    if blob.generation is not None:
+        return str(blob.generation)
+    return blob.etag
+
+
+class LocalObjectStore:
+    """
+    ``ObjectStore`` backed by a local directory, laid out as ``root/bucket/blob``.
+
+    The generation is derived from the file's mtime and size, which is enough
+    to detect rewrites in tests and offline runs.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, bucket_name: str, blob_name: str) -> str:
+        return os.path.join(self.root, bucket_name, blob_name)
+
+    def get_generation(self, bucket_name: str, blob_name: str) -> Optional[str]:
+        try:
+            stat = os.stat(self._path(bucket_name, blob_name))
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def download_text(
+        self, bucket_name: str, blob_name: str
+    ) -> Tuple[str, Optional[str]]:
+        path = self._path(bucket_name, blob_name)
+        generation = self.get_generation(bucket_name, blob_name)
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read(), generation
+
+
+@dataclass
+class CachedBlob:
+    """A parsed blob together with the version information it was read at."""
+
+    data: Any
+    generation: Optional[str]
+    content_hash: str
+    fetched_at: float
+    checked_at: float
+
+
+class ContextCache:
+    """
+    TTL cache of parsed JSON blobs with generation-based revalidation.
+
+    Args:
+        store: Object store to read from (default: GCS).
+        ttl_seconds: How long an entry is served without any remote call.
+        clock: Monotonic clock, injectable for tests.
+    """
+
+    def __init__(
+        self,
+        store: Optional[ObjectStore] = None,
+        ttl_seconds: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.store: ObjectStore = store or GcsObjectStore()
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: Dict[Tuple[str, str], CachedBlob] = {}
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def get(self, bucket_name: str, blob_name: str) -> Any:
+        """Return the parsed JSON content of a blob."""
+        return self.get_entry(bucket_name, blob_name).data
+
+    def get_entry(self, bucket_name: str, blob_name: str) -> CachedBlob:
+        """Return the cache entry for a blob, loading or revalidating as needed."""
+        key = (bucket_name, blob_name)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # One loader per key; concurrent requests for the same blob wait for it
+        with key_lock:
+            now = self._clock()
+            entry = self._entries.get(key)
+
+            if entry is not None and now - entry.checked_at < self.ttl_seconds:
+                self._count("hits")
+                return entry
+
+            if entry is not None and entry.generation is not None:
+                generation = self.store.get_generation(bucket_name, blob_name)
+                if generation == entry.generation:
+                    entry.checked_at = now
+                    self._count("revalidations")
+                    return entry
+
+            self._count("misses")
+            content, generation = self.store.download_text(bucket_name, blob_name)
+            entry = CachedBlob(
+                data=json.loads(content),
+                generation=generation,
+                content_hash=hashlib.sha256(content.encode("utf-8")).hexdigest(),
+                fetched_at=now,
+                checked_at=now,
+            )
+            with self._lock:
+                self._entries[key] = entry
+            return entry
+
+    def invalidate(
+        self, bucket_name: Optional[str] = None, blob_name: Optional[str] = None
+    ) -> None:
+        """
+        Drop cached entries.
+
+        With no arguments everything is dropped; with only ``bucket_name`` all
+        blobs of that bucket are dropped.
+        """
+        with self._lock:
+            if bucket_name is None:
+                self._entries.clear()
+                return
+            for key in list(self._entries):
+                if key[0] == bucket_name and blob_name in (None, key[1]):
+                    del self._entries[key]
+
+    def content_hash(self, data: Any) -> Optional[str]:
+        """Return the content hash of a cached parsed object, if it is cached."""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.data is data:
+                    return entry.content_hash
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and the number of cached entries."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "entries": len(self._entries),
+            }
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
@@ -0,0 +1,167 @@
+"""
+Token-budgeted selection of the column values shown in the audience prompt.
+
+By default the prompt carries every column's distinct values as indented
+JSON, which on wide tables dominates the input tokens. ``ContextSelector``
+ranks the columns by relevance to the attribute goal with BM25 over a
+lexical index of each column's name, description and values (the name
+counts three times, the description twice). Then, in column order:
+
+- the ``full_columns`` best-ranked columns keep their whole value list;
+- the others are cut to their first ``truncated_values`` values, followed by
+  a ``"... N more"`` marker;
+- once ``token_budget`` is reached, remaining columns are left out (they are
+  still listed in the schema section, with their descriptions).
+
+The values are rendered as compact JSON (no indentation). ``Selection``
+reports the tokens used and the tokens saved against the full listing.
+Token counts are estimated at four characters per token.
+"""
+
+import json
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Collection, Dict, List, Optional, Sequence
+
+from .prompt_builder import estimate_tokens
+
+NAME_WEIGHT = 3
+DESCRIPTION_WEIGHT = 2
+DEFAULT_FULL_COLUMNS = 20
+DEFAULT_TRUNCATED_VALUES = 10
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD = re.compile(r"[a-z0-9]+")
+_CAMEL = re.compile(r"([a-z0-9])([A-Z])")
+
+
+def tokenize(text: Any) -> List[str]:
+    """Lower-case word tokens; splits snake_case and camelCase, drops plural s."""
+    words = _WORD.findall(_CAMEL.sub(r"\1 \2", str(text)).lower())
+    return [w[:-1] if len(w) > 3 and w.endswith("s") else w for w in words]
+
+
+def compact_json(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+@dataclass
+class Selection:
+    text: str
+    tokens: int
+    full_tokens: int
+    full: List[str] = field(default_factory=list)
+    truncated: List[str] = field(default_factory=list)
+    dropped: List[str] = field(default_factory=list)
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.full_tokens - self.tokens)
+
+
+class ContextSelector:
+    """BM25 index over one context version's columns."""
+
+    def __init__(self, context_json: Dict[str, Any], col_values_json: Dict[str, Any]):
+        self.col_values = col_values_json or {}
+        descriptions = {
+            col.get("name", ""): col.get("description", "")
+            for col in (context_json or {}).get("columns", [])
+        }
+        self.columns = list(self.col_values)
+        self._terms: Dict[str, Counter] = {}
+        for name in self.columns:
+            values = self.col_values[name]
+            values = values if isinstance(values, list) else [values]
+            terms = Counter(tokenize(" ".join(str(v) for v in values)))
+            for word in tokenize(name):
+                terms[word] += NAME_WEIGHT
+            for word in tokenize(descriptions.get(name, "")):
+                terms[word] += DESCRIPTION_WEIGHT
+            self._terms[name] = terms
+        lengths = [sum(t.values()) for t in self._terms.values()]
+        self._average_length = sum(lengths) / len(lengths) if lengths else 0.0
+        document_frequency: Counter = Counter()
+        for terms in self._terms.values():
+            document_frequency.update(terms.keys())
+        n = len(self.columns)
+        self._idf = {
+            word: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for word, df in document_frequency.items()
+        }
+        self.full_text = json.dumps(self.col_values, indent=2, ensure_ascii=False)
+        self.full_tokens = estimate_tokens(self.full_text)
+
+    def scores(self, attribute_goal: str) -> Dict[str, float]:
+        query = set(tokenize(attribute_goal))
+        scores = {}
+        for name, terms in self._terms.items():
+            length = sum(terms.values())
+            norm = BM25_K1 * (
+                1 - BM25_B + BM25_B * length / (self._average_length or 1)
+            )
+            score = 0.0
+            for word in query:
+                tf = terms.get(word, 0)
+                if tf:
+                    score += self._idf[word] * tf * (BM25_K1 + 1) / (tf + norm)
+            scores[name] = score
+        return scores
+
+    def rank(self, attribute_goal: str) -> List[str]:
+        scores = self.scores(attribute_goal)
+        # Ties keep column order, so unrelated columns stay in a stable order
+        return sorted(self.columns, key=lambda name: -scores[name])
+
+    def select(
+        self,
+        attribute_goal: str,
+        token_budget: int,
+        full_columns: int = DEFAULT_FULL_COLUMNS,
+        truncated_values: int = DEFAULT_TRUNCATED_VALUES,
+        columns: Optional[Collection[str]] = None,
+    ) -> Selection:
+        """Pick the values to send; ``columns`` limits the candidates."""
+        ranked = self.rank(attribute_goal)
+        if columns is not None:
+            wanted = set(columns)
+            ranked = [name for name in ranked if name in wanted]
+        top = set(ranked[:full_columns])
+        chosen: Dict[str, Any] = {}
+        selection = Selection("", 0, self.full_tokens)
+        used = 2  # the braces
+        for name in ranked:
+            values = self.col_values[name]
+            candidates: Sequence[Any] = (
+                [values, truncate(values, truncated_values)]
+                if name in top
+                else [truncate(values, truncated_values)]
+            )
+            for candidate in candidates:
+                cost = estimate_tokens(compact_json({name: candidate}))
+                if used + cost <= token_budget:
+                    chosen[name] = candidate
+                    used += cost
+                    if candidate is values:
+                        selection.full.append(name)
+                    else:
+                        selection.truncated.append(name)
+                    break
+            else:
+                selection.dropped.append(name)
+        if columns is not None:
+            selection.dropped += [name for name in self.columns if name not in wanted]
+        ordered = {name: chosen[name] for name in self.columns if name in chosen}
+        selection.text = compact_json(ordered)
+        selection.tokens = estimate_tokens(selection.text)
+        return selection
+
+
+def truncate(values: Any, limit: int) -> Any:
+    """The first ``limit`` values plus a ``"... N more"`` marker."""
+    if not isinstance(values, list) or len(values) <= limit:
+        return values
+    return values[:limit] + [f"... {len(values) - limit} more"]
@@ -0,0 +1,196 @@
+"""
+Background audience counts, shared between requesters.
+
+``CountJobs.submit`` starts a count on an in-process thread pool and returns
+its status straight away; the caller polls ``status(job_id)`` for the result.
+The job id is derived from the count's key (table, normalized clause and
+sizing), so identical clauses submitted while a count is running, or within
+``ttl_seconds`` of a successful one, share that count instead of starting
+another. Failed counts are retried by the next submission.
+
+Jobs live in process memory: with several workers a status request must
+reach the worker that started the job (or the count is simply re-submitted).
+"""
+
+import contextvars
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from .counting import AudienceSize
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_TTL_SECONDS = 600.0
+DEFAULT_MAX_JOBS = 1024
+
+
+def job_id_for(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+@dataclass
+class CountJob:
+    job_id: str
+    key: str
+    status: str = PENDING
+    size: Optional[AudienceSize] = None
+    error: Optional[str] = None
+    finished_at: Optional[float] = None
+    callbacks: List[Callable[[AudienceSize], None]] = field(default_factory=list)
+    done: threading.Event = field(default_factory=threading.Event)
+
+    def as_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"job_id": self.job_id, "status": self.status}
+        if self.size is not None:
+            data.update(self.size.as_dict())
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+    @property
+    def succeeded(self) -> bool:
+        return (
+            self.status == DONE
+            and self.size is not None
+            and self.size.matching_users is not None
+        )
+
+
+class CountJobs:
+    """
+    Args:
+        max_workers: Count queries running at once.
+        ttl_seconds: How long a successful count is shared with new
+            submissions and kept for polling.
+        max_jobs: Finished jobs kept; the oldest are dropped first.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_jobs: int = DEFAULT_MAX_JOBS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_workers = max_workers
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, CountJob] = {}
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.started = 0
+        self.shared = 0
+
+    def submit(
+        self,
+        key: str,
+        count: Callable[[], AudienceSize],
+        on_done: Optional[Callable[[AudienceSize], None]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Start ``count`` unless a job for ``key`` is running or recently
+        succeeded; ``on_done`` is called with the size once the shared
+        count finishes (right away if it already has). Returns the status.
+        """
+        job_id = job_id_for(key)
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            if job is not None and (job.status in (PENDING, RUNNING) or job.succeeded):
+                self.shared += 1
+                if on_done is not None and job.status in (PENDING, RUNNING):
+                    job.callbacks.append(on_done)
+                    on_done = None
+            else:
+                job = CountJob(job_id, key, callbacks=[on_done] if on_done else [])
+                on_done = None
+                self._jobs[job_id] = job
+                self.started += 1
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="count-job"
+                    )
+                # The job's spans log the id of the request that started it
+                context = contextvars.copy_context()
+                self._pool.submit(context.run, self._run, job, count)
+            status = job.as_dict()
+        if on_done is not None and job.size is not None:
+            on_done(job.size)
+        return status
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Current status of ``job_id``, or None if it is unknown or expired."""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            return job.as_dict() if job is not None else None
+
+    def wait(
+        self, job_id: str, timeout: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Block until ``job_id`` finishes (or ``timeout``); returns its status."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job.done.wait(timeout)
+        with self._lock:
+            return job.as_dict()
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+    def _run(self, job: CountJob, count: Callable[[], AudienceSize]) -> None:
+        with self._lock:
+            job.status = RUNNING
+        try:
+            size = count()
+        except Exception as e:
+            print("Count job failed:", e)
+            with self._lock:
+                job.status, job.error = FAILED, str(e)
+                job.finished_at = self._clock()
+                job.callbacks.clear()
+            job.done.set()
+            return
+        with self._lock:
+            job.status, job.size = DONE, size
+            job.finished_at = self._clock()
+            callbacks, job.callbacks = job.callbacks, []
+        for callback in callbacks:
+            try:
+                callback(size)
+            except Exception as e:
+                print("Count job callback failed:", e)
+        job.done.set()
+
+    def _prune(self) -> None:
+        # Caller holds the lock; drops expired jobs, then the oldest finished
+        now = self._clock()
+        finished = sorted(
+            (job for job in self._jobs.values() if job.finished_at is not None),
+            key=lambda job: job.finished_at or 0.0,
+        )
+        for job in finished:
+            expired = (job.finished_at or 0.0) + self.ttl_seconds <= now
+            if expired or len(self._jobs) > self.max_jobs:
+                del self._jobs[job.job_id]
+
+
+def build_count_jobs(agent_config) -> CountJobs:
+    """Build the job pool described by an ``AgentConfig``."""
+    return CountJobs(
+        max_workers=agent_config.count_workers,
+        ttl_seconds=agent_config.count_job_ttl_seconds,
+    )
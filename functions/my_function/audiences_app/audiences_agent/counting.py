@@ -0,0 +1,337 @@
+"""
+Audience counting over the event table.
+
+Counting N audiences one query at a time scans the event table N times.
+``CountingEngine`` folds several filter clauses into one query that computes
+a distinct-visitor count per clause in a single pass, either exactly
+(``COUNT(DISTINCT IF(clause, mcvisid, NULL))``) or approximately
+(``APPROX_COUNT_DISTINCT``), and maps the result columns back to the
+audiences they belong to.
+
+``count_many`` can also route clauses to the pre-aggregated visitor rollup
+(see ``rollup``), which scans far fewer rows than the raw event table.
+
+``sample`` mode counts a fixed subset of visitors, chosen by a hash of the
+visitor id, so a sampled visitor brings all their events with them. The
+count is then a binomial draw from the true audience, which makes the
+scaled estimate and its interval valid. It still reads the whole table
+(BigQuery bills the same bytes); it saves the distinct-count work.
+
+The engine talks to anything with a BigQuery-style ``query(sql).result()``
+interface; the ``dialect`` only changes how the conditional count and the
+visitor sample are spelled, so the same engine runs against SQLite or
+DuckDB stand-ins. A client that is not BigQuery says so with a ``dialect``
+attribute (see ``client_dialect``).
+"""
+
+import math
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Hashable, List, Mapping, Optional, Sequence
+
+ID_COLUMN = "mcvisid"
+DEFAULT_MAX_CLAUSES_PER_QUERY = 100
+DEFAULT_SAMPLE_PERCENT = 1.0
+# Visitors are hashed into this many buckets; the sample rate is rounded to it
+SAMPLE_BUCKETS = 10000
+CONFIDENCE_Z = 1.96  # 95% interval
+
+DIALECTS = ("bigquery", "duckdb", "sqlite")
+
+# exact:  COUNT(DISTINCT mcvisid)
+# approx: APPROX_COUNT_DISTINCT (HyperLogLog++), typically within ~1%
+# sample: exact count over a hash sample of the visitors, scaled up, with a
+#         confidence interval
+SIZING_MODES = ("exact", "approx", "sample")
+
+
+@dataclass
+class AudienceSize:
+    """Audience size plus the mode that produced it and what it cost."""
+
+    matching_users: Optional[int]
+    sizing_mode: str = "exact"
+    matching_users_lower: Optional[int] = None
+    matching_users_upper: Optional[int] = None
+    estimated_bytes: Optional[int] = None
+    count_error: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        size = asdict(self)
+        if self.sizing_mode != "sample":
+            del size["matching_users_lower"], size["matching_users_upper"]
+        if self.count_error is None:
+            del size["count_error"]
+        return size
+
+
+def table_ref(config) -> str:
+    return f"`{config.gcp.project_id}.{config.gcp.dataset_id}.{config.gcp.table_name}`"
+
+
+def client_dialect(client) -> str:
+    """The SQL dialect a query client runs; BigQuery unless it says otherwise."""
+    dialect = getattr(client, "dialect", None)
+    return dialect if dialect in DIALECTS else "bigquery"
+
+
+def check_sizing_mode(sizing_mode: str, dialect: str = "bigquery") -> None:
+    if sizing_mode not in SIZING_MODES:
+        raise ValueError(
+            f"Unknown sizing mode {sizing_mode!r}; expected one of {SIZING_MODES}"
+        )
+    if sizing_mode == "sample" and dialect == "sqlite":
+        raise ValueError("SQLite has no hash function to sample visitors with")
+
+
+def sample_buckets(sample_percent: float) -> int:
+    """Number of the ``SAMPLE_BUCKETS`` visitor buckets that are counted."""
+    return min(SAMPLE_BUCKETS, max(1, round(sample_percent / 100 * SAMPLE_BUCKETS)))
+
+
+def sample_predicate(
+    sample_percent: float, id_col: str = ID_COLUMN, dialect: str = "bigquery"
+) -> str:
+    """Condition keeping the visitors whose id hashes into the sampled buckets."""
+    buckets = sample_buckets(sample_percent)
+    if dialect == "duckdb":
+        # hash() is unsigned in DuckDB
+        return f"hash({id_col}) % {SAMPLE_BUCKETS} < {buckets}"
+    # FARM_FINGERPRINT is signed, and MOD keeps the sign of the dividend
+    fingerprint = f"FARM_FINGERPRINT(CAST({id_col} AS STRING))"
+    return (
+        f"MOD(MOD({fingerprint}, {SAMPLE_BUCKETS}) + {SAMPLE_BUCKETS}, "
+        f"{SAMPLE_BUCKETS}) < {buckets}"
+    )
+
+
+def distinct_count(
+    expr: str, sizing_mode: str = "exact", dialect: str = "bigquery"
+) -> str:
+    # SQLite has no approximate distinct count; fall back to the exact form
+    if sizing_mode == "approx" and dialect != "sqlite":
+        return f"APPROX_COUNT_DISTINCT({expr})"
+    return f"COUNT(DISTINCT {expr})"
+
+
+def conditional_count(
+    clause: str,
+    id_col: str = ID_COLUMN,
+    sizing_mode: str = "exact",
+    dialect: str = "bigquery",
+) -> str:
+    """SQL expression counting distinct ``id_col`` over rows matching ``clause``."""
+    if dialect == "bigquery":
+        matched = f"IF(({clause}), {id_col}, NULL)"
+    else:
+        matched = f"CASE WHEN ({clause}) THEN {id_col} END"
+    return distinct_count(matched, sizing_mode, dialect)
+
+
+def build_size_query(
+    table: str,
+    filter_clause: str,
+    sizing_mode: str = "exact",
+    sample_percent: float = DEFAULT_SAMPLE_PERCENT,
+    id_col: str = ID_COLUMN,
+    dialect: str = "bigquery",
+) -> str:
+    """Single-audience query returning ``matching_users``."""
+    check_sizing_mode(sizing_mode, dialect)
+    where = filter_clause
+    if sizing_mode == "sample":
+        where = f"{sample_predicate(sample_percent, id_col, dialect)} AND ({where})"
+    count = distinct_count(id_col, sizing_mode, dialect)
+    return f"SELECT {count} as matching_users FROM {table} WHERE {where}"
+
+
+def size_from_count(
+    count: Optional[int],
+    sizing_mode: str = "exact",
+    sample_percent: float = DEFAULT_SAMPLE_PERCENT,
+) -> AudienceSize:
+    """
+    Turn a raw query count into an ``AudienceSize``.
+
+    For ``sample`` the count is scaled by the sampling rate (rounded to whole
+    buckets, as in the query) and given a normal approximation confidence
+    interval: each visitor is in the sample with probability ``p`` whatever
+    their activity, so the count is binomial.
+    """
+    if count is None or sizing_mode != "sample":
+        return AudienceSize(count, sizing_mode)
+    p = sample_buckets(sample_percent) / SAMPLE_BUCKETS
+    estimate = count / p
+    margin = CONFIDENCE_Z * math.sqrt(count * (1 - p)) / p
+    return AudienceSize(
+        matching_users=round(estimate),
+        sizing_mode=sizing_mode,
+        matching_users_lower=max(count, math.floor(estimate - margin)),
+        matching_users_upper=math.ceil(estimate + margin),
+    )
+
+
+def build_multi_count_query(
+    table: str,
+    filter_clauses: Sequence[str],
+    id_col: str = ID_COLUMN,
+    sizing_mode: str = "exact",
+    dialect: str = "bigquery",
+    sample_percent: float = DEFAULT_SAMPLE_PERCENT,
+) -> str:
+    """One query returning ``aud_<i>`` = distinct visitors matching clause i."""
+    check_sizing_mode(sizing_mode, dialect)
+    counts = ",\n  ".join(
+        f"{conditional_count(clause, id_col, sizing_mode, dialect)} AS aud_{i}"
+        for i, clause in enumerate(filter_clauses)
+    )
+    # Rows matching none of the clauses cannot contribute to any count
+    where = " OR ".join(f"({clause})" for clause in filter_clauses)
+    if sizing_mode == "sample":
+        where = f"{sample_predicate(sample_percent, id_col, dialect)} AND ({where})"
+    return f"SELECT\n  {counts}\nFROM {table}\nWHERE {where}"
+
+
+class CountingEngine:
+    """
+    Counts many audiences with as few table scans as possible.
+
+    Args:
+        client: Object with a BigQuery-style ``query(sql).result()`` method.
+        table: Fully qualified table reference, quoted for the dialect.
+        id_col: Visitor id column.
+        sizing_mode: ``exact``, ``approx`` or ``sample`` (see ``SIZING_MODES``).
+        sample_percent: Percentage of visitors counted by ``sample`` mode.
+        dialect: ``bigquery``, ``duckdb`` or ``sqlite``.
+        max_clauses_per_query: Clauses per combined query; larger inputs are
+            split into several queries.
+    """
+
+    def __init__(
+        self,
+        client,
+        table: str,
+        id_col: str = ID_COLUMN,
+        sizing_mode: str = "exact",
+        sample_percent: float = DEFAULT_SAMPLE_PERCENT,
+        dialect: str = "bigquery",
+        max_clauses_per_query: int = DEFAULT_MAX_CLAUSES_PER_QUERY,
+    ):
+        if dialect not in DIALECTS:
+            raise ValueError(f"Unknown SQL dialect: {dialect}")
+        check_sizing_mode(sizing_mode, dialect)
+        self.client = client
+        self.table = table
+        self.id_col = id_col
+        self.sizing_mode = sizing_mode
+        self.sample_percent = sample_percent
+        self.dialect = dialect
+        self.max_clauses_per_query = max_clauses_per_query
+        self.queries_run = 0
+
+    def build_query(self, filter_clauses: Sequence[str]) -> str:
+        return build_multi_count_query(
+            self.table,
+            filter_clauses,
+            self.id_col,
+            self.sizing_mode,
+            self.dialect,
+            self.sample_percent,
+        )
+
+    def sizes(self, audiences: Mapping[Hashable, str]) -> Dict[Hashable, AudienceSize]:
+        """
+        Size every audience in ``audiences`` (audience id -> filter clause).
+
+        Identical clauses are counted once. Audiences with an empty clause, or
+        whose clause fails even when run on its own, have no count.
+        """
+        unique = list(dict.fromkeys(c for c in audiences.values() if c))
+        counts: Dict[str, Optional[int]] = {}
+        for start in range(0, len(unique), self.max_clauses_per_query):
+            chunk = unique[start : start + self.max_clauses_per_query]
+            counts.update(zip(chunk, self._count_chunk(chunk)))
+        return {
+            audience: size_from_count(
+                counts.get(clause) if clause else None,
+                self.sizing_mode,
+                self.sample_percent,
+            )
+            for audience, clause in audiences.items()
+        }
+
+    def count(self, audiences: Mapping[Hashable, str]) -> Dict[Hashable, Optional[int]]:
+        """Like ``sizes`` but returning only the (estimated) counts."""
+        return {
+            audience: size.matching_users
+            for audience, size in self.sizes(audiences).items()
+        }
+
+    def count_list(self, filter_clauses: Sequence[str]) -> List[Optional[int]]:
+        """Like ``count`` for a plain list; results are in input order."""
+        counts = self.count(dict(enumerate(filter_clauses)))
+        return [counts[i] for i in range(len(filter_clauses))]
+
+    def _count_chunk(self, filter_clauses: List[str]) -> List[Optional[int]]:
+        try:
+            self.queries_run += 1
+            row = next(
+                iter(self.client.query(self.build_query(filter_clauses)).result())
+            )
+            return [_as_int(row[f"aud_{i}"]) for i in range(len(filter_clauses))]
+        except Exception as e:
+            if len(filter_clauses) == 1:
+                print("Error executing count query:", e)
+                return [None]
+            # Typically one malformed clause; isolate it so the rest still count
+            print("Combined count query failed, counting clauses one by one:", e)
+            return [self._count_chunk([clause])[0] for clause in filter_clauses]
+
+
+def _as_int(value) -> int:
+    # Approximate aggregates over an empty input may come back as NULL
+    return int(value or 0)
+
+
+def count_many(
+    client,
+    config,
+    filter_clauses: Sequence[str],
+    sizing_mode: str = "exact",
+    sample_percent: float = DEFAULT_SAMPLE_PERCENT,
+    rollup=None,
+) -> List[AudienceSize]:
+    """
+    Size each clause with one BigQuery job per chunk of clauses.
+
+    With a ``rollup.RollupRewriter``, clauses it can rewrite are counted on the
+    visitor rollup first; the rest, and any that fail there, on raw events.
+    """
+    if not filter_clauses:
+        return []
+    remaining: Dict[Hashable, str] = dict(enumerate(filter_clauses))
+    sizes: Dict[Hashable, AudienceSize] = {}
+    if rollup is not None:
+        rewritten = {i: rollup.rewrite(clause) for i, clause in remaining.items()}
+        eligible = {i: clause for i, clause in rewritten.items() if clause}
+        if eligible:
+            engine = CountingEngine(
+                client,
+                rollup.table,
+                sizing_mode=sizing_mode,
+                sample_percent=sample_percent,
+                dialect=client_dialect(client),
+            )
+            for i, size in engine.sizes(eligible).items():
+                if size.matching_users is not None:
+                    sizes[i] = size
+                    del remaining[i]
+    if remaining:
+        engine = CountingEngine(
+            client,
+            table_ref(config),
+            sizing_mode=sizing_mode,
+            sample_percent=sample_percent,
+            dialect=client_dialect(client),
+        )
+        sizes.update(engine.sizes(remaining))
+    return [sizes[i] for i in range(len(filter_clauses))]
@@ -0,0 +1,273 @@
+"""
+Ground-truth accuracy benchmark for the audience agent.
+
+Reads a dataset of ``nl_query`` / ``ground_truth_clause`` pairs (JSONL, or
+CSV with those columns and an optional ``id``), generates a filter clause for
+each query with the production prompt, and asks Gemini to judge it against
+the ground truth with ``ground_truth_validation.yaml`` (the same judge as
+``agent.validate_query``).
+
+Unlike calling ``validate_query`` in a loop, the schema, column values,
+sample rows and prompts are loaded once per run, items run concurrently on a
+thread pool, and Gemini calls are spaced to ``--rpm`` requests per minute.
+Each finished item is appended to the results JSONL, so an interrupted run
+resumes where it stopped. The report gives accuracy plus p50/p95 latency and
+token counts per stage (tokens are estimated at four characters each).
+
+Usage:
+    PYTHONPATH=functions python -m my_function.audiences_app.audiences_agent.evaluation \\
+        dataset.jsonl --out results.jsonl --concurrency 8 --rpm 120
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from . import agent
+from .base_functions import get_bq_client, get_config
+from .llm_policy import percentile
+from .prompt_builder import estimate_tokens
+
+STAGES = ("generate", "judge")
+
+
+@dataclass
+class BenchmarkContext:
+    """Everything the prompts need that does not change between items."""
+
+    context_json: Dict[str, Any]
+    col_values_json: Dict[str, Any]
+    context_version: str
+    schema_str: str
+    sample_json_str: str
+    config: Any = None
+
+
+def load_benchmark_context(config=None, client=None) -> BenchmarkContext:
+    config = get_config(config)
+    context_json, col_values_json, version = agent.load_audience_context(config)
+    return BenchmarkContext(
+        context_json,
+        col_values_json,
+        version,
+        agent.format_schema_from_column_list(context_json),
+        agent.fetch_sample_json(config, client or get_bq_client(), context_json),
+        config,
+    )
+
+
+class IntervalLimiter:
+    """Spaces calls at least ``60 / requests_per_minute`` seconds apart."""
+
+    def __init__(
+        self, requests_per_minute: float, clock=time.monotonic, sleep=time.sleep
+    ):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = self._clock()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            self._sleep(start - now)
+
+
+def item_id(item: Dict[str, Any]) -> str:
+    if item.get("id") not in (None, ""):
+        return str(item["id"])
+    key = f"{item['nl_query']}\n{item['ground_truth_clause']}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def load_dataset(path: str) -> List[Dict[str, Any]]:
+    """Dataset rows with ``id``, ``nl_query`` and ``ground_truth_clause``."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            rows: Iterable[Dict[str, Any]] = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    items = []
+    for row in rows:
+        if not row.get("nl_query") or not row.get("ground_truth_clause"):
+            raise ValueError(
+                f"Dataset row needs nl_query and ground_truth_clause: {row}"
+            )
+        items.append({**row, "id": item_id(row)})
+    return items
+
+
+def read_checkpoint(path: str) -> Dict[str, Dict[str, Any]]:
+    """Finished results by item id; a torn last line is ignored."""
+    results: Dict[str, Dict[str, Any]] = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            results[result["id"]] = result
+    return results
+
+
+def timed_generate(
+    prompt: str, response_schema, limiter: IntervalLimiter
+) -> Dict[str, Any]:
+    limiter.acquire()
+    start = time.perf_counter()
+    response = agent.generate(prompt, response_schema)
+    return {
+        "response": response,
+        "seconds": time.perf_counter() - start,
+        "prompt_tokens": estimate_tokens(prompt),
+        "response_tokens": estimate_tokens(response),
+    }
+
+
+def run_item(
+    item: Dict[str, Any], context: BenchmarkContext, limiter: IntervalLimiter
+) -> Dict[str, Any]:
+    result: Dict[str, Any] = {
+        "id": item["id"],
+        "nl_query": item["nl_query"],
+        "ground_truth_clause": item["ground_truth_clause"],
+        "stages": {},
+    }
+    try:
+        prompt, _ = agent.build_audience_prompt(
+            item["nl_query"],
+            context.context_json,
+            context.col_values_json,
+            context.context_version,
+            context.config,
+        )
+        call = timed_generate(prompt, agent.get_prompts()["response_schema"], limiter)
+        definition = agent.parse_audience_response(call.pop("response"))
+        result["stages"]["generate"] = call
+        result["filter_clause"] = definition["filter_clause"]
+
+        prompt = agent.build_judge_prompt(
+            item["nl_query"],
+            definition["filter_clause"],
+            item["ground_truth_clause"],
+            context.schema_str,
+            context.sample_json_str,
+        )
+        call = timed_generate(
+            prompt, agent.get_validation_prompt()["response_schema"], limiter
+        )
+        verdict = json.loads(call.pop("response"))
+        result["stages"]["judge"] = call
+        result["validated"] = str(verdict.get("validated")).lower() == "true"
+        result["reasoning"] = verdict.get("reasoning", "")
+    except Exception as e:
+        result["validated"] = False
+        result["error"] = str(e)
+    return result
+
+
+def summarize(results: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    results = list(results)
+    judged = [r for r in results if "error" not in r]
+    report: Dict[str, Any] = {
+        "items": len(results),
+        "errors": len(results) - len(judged),
+        "passed": sum(1 for r in judged if r["validated"]),
+        "accuracy": (
+            sum(1 for r in judged if r["validated"]) / len(judged) if judged else None
+        ),
+        "stages": {},
+    }
+    for stage in STAGES:
+        calls = [r["stages"][stage] for r in results if stage in r.get("stages", {})]
+        seconds = [c["seconds"] for c in calls]
+        report["stages"][stage] = {
+            "calls": len(calls),
+            "p50_seconds": percentile(seconds, 50),
+            "p95_seconds": percentile(seconds, 95),
+            "prompt_tokens": sum(c["prompt_tokens"] for c in calls),
+            "response_tokens": sum(c["response_tokens"] for c in calls),
+        }
+    return report
+
+
+def run_benchmark(
+    items: List[Dict[str, Any]],
+    context: BenchmarkContext,
+    out_path: str,
+    concurrency: int = 4,
+    requests_per_minute: float = 60.0,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Run every item not yet in ``out_path`` and append its result there.
+
+    Returns the report over all results in ``out_path``, including those
+    from earlier (interrupted) runs.
+    """
+    done = read_checkpoint(out_path)
+    # Items that failed (quota, timeouts) are retried by the next run
+    pending = [
+        item for item in items if item["id"] not in done or "error" in done[item["id"]]
+    ]
+    limiter = IntervalLimiter(requests_per_minute)
+    # Start on a fresh line after a write torn by an interrupted run
+    torn = False
+    if os.path.exists(out_path) and os.path.getsize(out_path):
+        with open(out_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b"\n"
+    with open(out_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(
+        max_workers=concurrency
+    ) as pool:
+        if torn:
+            out.write("\n")
+        futures = [pool.submit(run_item, item, context, limiter) for item in pending]
+        for future in as_completed(futures):
+            result = future.result()
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            done[result["id"]] = result
+            if progress is not None:
+                progress(result)
+    wanted = {item["id"] for item in items}
+    return summarize(r for key, r in done.items() if key in wanted)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("dataset", help="JSONL or CSV of nl_query, ground_truth_clause")
+    parser.add_argument("--out", default="benchmark_results.jsonl")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=float, default=60.0, help="Gemini calls/minute")
+    args = parser.parse_args(argv)
+
+    items = load_dataset(args.dataset)
+    context = load_benchmark_context()
+
+    def progress(result):
+        status = "error" if "error" in result else result["validated"]
+        print(f"{result['id']}: {status}")
+
+    report = run_benchmark(
+        items, context, args.out, args.concurrency, args.rpm, progress=progress
+    )
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
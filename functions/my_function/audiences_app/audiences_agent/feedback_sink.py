@@ -0,0 +1,242 @@
+"""
+Buffered feedback ingestion.
+
+``submit_feedback`` used to run one blocking BigQuery load job per click.
+``FeedbackSink`` instead appends each row to a local SQLite buffer and returns
+at once; a background thread writes buffered rows to BigQuery in batches,
+as soon as ``batch_size`` rows are waiting and otherwise every
+``flush_seconds``. Rows are only removed from the buffer once BigQuery accepted
+them, so anything unflushed when the process stops is sent after restart.
+
+Several workers may share one buffer file: a flusher first claims a batch
+for ``claim_seconds`` so two processes do not send the same rows, and a claim
+left behind by a crashed process simply expires. Each row carries a stable
+``insertId`` so a batch retried after a lost response is de-duplicated by
+BigQuery on a best-effort basis.
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .base_functions import get_agent_config, get_bq_client, get_config
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_SECONDS = 5.0
+DEFAULT_CLAIM_SECONDS = 60.0
+RETRY_MAX_SECONDS = 300.0
+
+Writer = Callable[[Sequence[Dict[str, Any]], Sequence[str]], None]
+
+
+class BigQueryFeedbackWriter:
+    """Streams a batch of rows into a table with ``insert_rows_json``."""
+
+    def __init__(self, client, table: str):
+        self.client = client
+        self.table = table
+
+    def __call__(self, rows: Sequence[Dict[str, Any]], row_ids: Sequence[str]) -> None:
+        errors = self.client.insert_rows_json(self.table, list(rows), row_ids=row_ids)
+        if errors:
+            raise RuntimeError(f"BigQuery rejected feedback rows: {errors}")
+
+
+class FeedbackSink:
+    """
+    Durable local buffer in front of a batch writer.
+
+    Args:
+        writer: Called with a batch of rows and their insert ids; raises on
+            failure, in which case the batch is retried with backoff.
+        path: SQLite buffer file.
+        batch_size: Rows per write; also the backlog that triggers a flush.
+        flush_seconds: Longest time a row waits for its batch to fill up.
+        claim_seconds: How long a flusher owns a claimed batch.
+        start: Start the background flusher (tests flush by hand).
+    """
+
+    def __init__(
+        self,
+        writer: Writer,
+        path: str = "feedback_buffer.sqlite3",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_seconds: float = DEFAULT_FLUSH_SECONDS,
+        claim_seconds: float = DEFAULT_CLAIM_SECONDS,
+        clock: Callable[[], float] = time.time,
+        start: bool = True,
+    ):
+        self.writer = writer
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.claim_seconds = claim_seconds
+        self._clock = clock
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS feedback_buffer (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    row_id TEXT NOT NULL,
+                    row TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    claimed_by TEXT,
+                    claimed_until REAL NOT NULL DEFAULT 0
+                )
+                """
+            )
+        if start:
+            self.start()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="feedback-sink", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.close)
+
+    def submit(self, row: Dict[str, Any]) -> None:
+        """Buffer one row; it is on disk when this returns."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO feedback_buffer (row_id, row, created_at) VALUES (?, ?, ?)",
+                (uuid.uuid4().hex, json.dumps(row), self._clock()),
+            )
+        if self.pending() >= self.batch_size:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM feedback_buffer"
+            ).fetchone()[0]
+
+    def flush(self, force: bool = True) -> int:
+        """
+        Write buffered rows until the buffer is empty, or, unless ``force``,
+        until no full or overdue batch is left. Returns the rows written.
+        """
+        written = 0
+        while force or self._due():
+            batch = self._claim()
+            if not batch:
+                break
+            ids = [entry_id for entry_id, _, _ in batch]
+            try:
+                self.writer([row for _, _, row in batch], [r for _, r, _ in batch])
+            except Exception:
+                self._release(ids)
+                raise
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "DELETE FROM feedback_buffer WHERE id = ?", [(i,) for i in ids]
+                )
+            written += len(batch)
+            self.flushed_rows += len(batch)
+        return written
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stop the flusher after a last attempt to drain the buffer."""
+        self._closed.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _due(self) -> bool:
+        now = self._clock()
+        with self._lock:
+            count, oldest = self._conn.execute(
+                "SELECT COUNT(*), MIN(created_at) FROM feedback_buffer "
+                "WHERE claimed_until <= ?",
+                (now,),
+            ).fetchone()
+        if not count:
+            return False
+        return count >= self.batch_size or now - oldest >= self.flush_seconds
+
+    def _claim(self) -> List[Tuple[int, str, Dict[str, Any]]]:
+        now = self._clock()
+        claim = f"{self._owner}-{uuid.uuid4().hex[:8]}"
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                UPDATE feedback_buffer SET claimed_by = ?, claimed_until = ?
+                WHERE id IN (
+                    SELECT id FROM feedback_buffer WHERE claimed_until <= ?
+                    ORDER BY id LIMIT ?
+                )
+                """,
+                (claim, now + self.claim_seconds, now, self.batch_size),
+            )
+            rows = self._conn.execute(
+                "SELECT id, row_id, row FROM feedback_buffer "
+                "WHERE claimed_by = ? ORDER BY id",
+                (claim,),
+            ).fetchall()
+        return [(entry_id, row_id, json.loads(row)) for entry_id, row_id, row in rows]
+
+    def _release(self, ids: List[int]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE feedback_buffer SET claimed_by = NULL, claimed_until = 0 "
+                "WHERE id = ?",
+                [(i,) for i in ids],
+            )
+
+    def _run(self) -> None:
+        retry_delay = self.flush_seconds
+        # Rows left over from a previous run are due already and go out first
+        while True:
+            closing = self._closed.is_set()
+            try:
+                self.flush(force=closing)
+                retry_delay = self.flush_seconds
+            except Exception as e:
+                self.failed_flushes += 1
+                print("Error flushing feedback rows:", e)
+                retry_delay = min(retry_delay * 2, RETRY_MAX_SECONDS)
+                if closing:
+                    return
+            if closing:
+                return
+            self._wakeup.wait(retry_delay)
+            self._wakeup.clear()
+
+
+_feedback_sink: Optional[FeedbackSink] = None
+_feedback_sink_lock = threading.Lock()
+
+
+def get_feedback_sink(config=None, client=None) -> FeedbackSink:
+    """Process-wide sink writing to ``gcp.feedback_table``."""
+    global _feedback_sink
+    if _feedback_sink is None:
+        with _feedback_sink_lock:
+            if _feedback_sink is None:
+                config = get_config(config)
+                agent_config = get_agent_config(config)
+                writer = BigQueryFeedbackWriter(
+                    client or get_bq_client(), config.gcp.feedback_table
+                )
+                _feedback_sink = FeedbackSink(
+                    writer,
+                    agent_config.feedback_buffer_path,
+                    batch_size=agent_config.feedback_batch_size,
+                    flush_seconds=agent_config.feedback_flush_seconds,
+                )
+    return _feedback_sink
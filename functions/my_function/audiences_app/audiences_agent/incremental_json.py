@@ -0,0 +1,113 @@
+"""
+Incremental parsing of a streamed JSON object.
+
+Gemini streams a structured response as arbitrary text chunks.
+``IncrementalJSONParser`` scans each chunk once and reports every top-level
+field of the object as soon as its value is complete:
+
+- strings, at their closing quote
+- arrays and objects, at their closing bracket
+- numbers, ``true``, ``false`` and ``null``, at the following ``,`` or ``}``
+
+So a caller can act on ``filter_clause`` while the rest of the object is
+still being generated. A leading Markdown fence (```` ```json ````) or other
+text before the opening brace is skipped. Values are decoded with
+``json.loads`` once complete, so escapes are handled as in a full parse.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class IncrementalJSONParser:
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.complete = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        # Top-level parsing: "key" (awaiting a key), "colon", "value", "after"
+        self._phase = "key"
+        self._key_start: Optional[int] = None
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Add ``chunk``; returns the ``(name, value)`` fields it completed."""
+        self.text += chunk
+        completed: List[Tuple[str, Any]] = []
+        text = self.text
+        while self._pos < len(text) and not self.complete:
+            i = self._pos
+            char = text[i]
+            self._pos += 1
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._string_closed(i, completed)
+                continue
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                continue
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    if self._phase == "key":
+                        self._key_start = i
+                    elif self._phase == "value":
+                        self._value_start = i
+                continue
+            if char in "{[":
+                if self._depth == 1 and self._phase == "value":
+                    self._value_start = i
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._phase == "value":
+                    self._finish_value(i + 1, completed)
+                elif self._depth == 0:
+                    if self._phase == "value":
+                        self._finish_value(i, completed)
+                    self.complete = True
+            elif self._depth == 1:
+                if char == ":" and self._phase == "colon":
+                    self._phase = "value"
+                elif char == "," and self._phase in ("value", "after"):
+                    if self._phase == "value":
+                        self._finish_value(i, completed)
+                    self._phase = "key"
+                elif (
+                    self._phase == "value"
+                    and self._value_start is None
+                    and not char.isspace()
+                ):
+                    self._value_start = i
+        return completed
+
+    def _string_closed(self, end: int, completed: List[Tuple[str, Any]]) -> None:
+        if self._phase == "key" and self._key_start is not None:
+            self._key = json.loads(self.text[self._key_start : end + 1])
+            self._phase = "colon"
+        elif self._phase == "value":
+            self._finish_value(end + 1, completed)
+
+    def _finish_value(self, end: int, completed: List[Tuple[str, Any]]) -> None:
+        if self._value_start is None or self._key is None:
+            return
+        raw = self.text[self._value_start : end].strip()
+        self._value_start = None
+        self._phase = "after"
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            return
+        self.fields[self._key] = value
+        completed.append((self._key, value))
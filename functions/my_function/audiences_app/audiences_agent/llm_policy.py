@@ -0,0 +1,469 @@
+"""
+Deadlines, retries, hedging and a circuit breaker around Gemini calls.
+
+``LLMCallPolicy.call(fn, *args)`` runs ``fn`` (one Gemini request) under:
+
+- a timeout per attempt (``agent.llm_attempt_timeout_seconds``) and an
+  overall deadline for the call, retries included
+  (``processing.timeout_seconds``, when set);
+- retries with full-jitter exponential backoff on 429 / 503 responses and
+  attempt timeouts (``agent.llm_max_attempts``, ``agent.llm_backoff_seconds``);
+- optionally, a hedged duplicate request once an attempt has run longer than
+  the ``agent.llm_hedge_percentile`` of recent successful call latencies; the
+  first answer wins;
+- a circuit breaker that fails calls straight away for
+  ``agent.llm_breaker_reset_seconds`` after ``agent.llm_breaker_failures``
+  consecutive failed calls, then lets a single trial call through.
+
+The Vertex AI SDK call takes no timeout, so sync attempts run on a shared
+thread pool: a timed-out or losing attempt that is still queued is
+cancelled, and one already running is abandoned (its thread finishes in the
+background); ``call_async`` cancels them instead. Errors that are neither
+retryable nor an answer from the service (connection errors) count as
+breaker failures. Retries, hedges and breaker
+transitions are counted in ``metrics`` and logged with the request id.
+"""
+
+import asyncio
+import contextvars
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Optional, Sequence, Set
+
+from . import metrics
+from .rate_limiter import RateLimitExceeded
+
+RETRYABLE_CODES = (429, 503)
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 8.0
+DEFAULT_ATTEMPT_TIMEOUT_SECONDS = 60.0
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+CALL_THREADS = 32
+
+# Returned by an ``acquire`` hook: gives back what it took (a governor slot)
+Release = Callable[[], None]
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Gemini calls are failing; the breaker rejects calls until it resets."""
+
+
+def retry_reason(error: BaseException) -> Optional[str]:
+    """Why ``error`` is worth retrying ("429", "503", "timeout"), else None."""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return "timeout"
+    code = getattr(error, "code", None)
+    try:
+        code = int(code)  # type: ignore[arg-type]
+    except (TypeError, ValueError):
+        return None
+    return str(code) if code in RETRYABLE_CODES else None
+
+
+def service_responded(error: BaseException) -> bool:
+    """
+    Whether ``error`` is an answer from Gemini: an HTTP/gRPC status (API
+    errors carry a ``code``) or an unusable response (``ValueError``, see
+    ``base_functions.response_text``).
+    """
+    if isinstance(error, ValueError):
+        return True
+    code = getattr(error, "code", None)
+    if callable(code):
+        # gRPC errors expose the status through a method
+        try:
+            code = code()
+        except Exception:
+            return False
+    return code is not None
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile; None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+class LatencyWindow:
+    """The most recent successful call latencies."""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._values: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._values.append(seconds)
+
+    def percentile(
+        self, q: float, min_samples: int = HEDGE_MIN_SAMPLES
+    ) -> Optional[float]:
+        """Nearest-rank percentile, or None with fewer than ``min_samples``."""
+        with self._lock:
+            values = list(self._values)
+        if len(values) < min_samples:
+            return None
+        return percentile(values, q)
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures; after
+    ``reset_seconds`` one trial call is let through, whose outcome closes or
+    re-opens the breaker. A threshold of 0 disables it.
+    """
+
+    def __init__(
+        self, failure_threshold: int, reset_seconds: float, clock=time.monotonic
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self.state = CLOSED
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if self._clock() - self._opened_at < self.reset_seconds:
+                    return False
+                self.state = HALF_OPEN
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            closed = self.state != CLOSED
+            self.state = CLOSED
+            self._failures = 0
+            self._trial_running = False
+        if closed:
+            self._transition("close")
+
+    def release_trial(self) -> None:
+        """The admitted call was never made; let another trial through."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            opened = self.failure_threshold > 0 and (
+                self.state == HALF_OPEN or self._failures >= self.failure_threshold
+            )
+            if opened:
+                self.state = OPEN
+                self._opened_at = self._clock()
+        if opened:
+            self._transition("open")
+
+    def _transition(self, event: str) -> None:
+        metrics.REGISTRY.llm_breaker.inc(event=event)
+        metrics.log_event("llm_circuit_breaker", transition=event)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=CALL_THREADS, thread_name_prefix="gemini"
+                )
+    return _executor
+
+
+class LLMCallPolicy:
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        backoff_seconds: float = DEFAULT_BACKOFF_SECONDS,
+        attempt_timeout_seconds: float = DEFAULT_ATTEMPT_TIMEOUT_SECONDS,
+        deadline_seconds: Optional[float] = None,
+        hedge_percentile: float = 0.0,
+        breaker: Optional[CircuitBreaker] = None,
+        clock=time.monotonic,
+        sleep=time.sleep,
+        rng: Optional[random.Random] = None,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_seconds = backoff_seconds
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self.deadline_seconds = deadline_seconds
+        self.hedge_percentile = hedge_percentile
+        self.breaker = breaker or CircuitBreaker(0, 0.0)
+        self.latencies = LatencyWindow()
+        self._clock = clock
+        self._sleep = sleep
+        self._rng = rng or random.Random()
+        self._executor = executor
+
+    def hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile <= 0:
+            return None
+        return self.latencies.percentile(self.hedge_percentile)
+
+    def _admit(self) -> Optional[float]:
+        """Check the breaker; returns the call's deadline on ``clock``."""
+        if not self.breaker.allow():
+            metrics.REGISTRY.llm_breaker.inc(event="reject")
+            raise CircuitOpenError("Gemini circuit breaker is open")
+        if self.deadline_seconds:
+            return self._clock() + self.deadline_seconds
+        return None
+
+    def _attempt_timeout(self, deadline: Optional[float]) -> float:
+        if deadline is None:
+            return self.attempt_timeout_seconds
+        remaining = deadline - self._clock()
+        if remaining <= 0:
+            raise TimeoutError("Gemini call deadline exceeded")
+        return min(self.attempt_timeout_seconds, remaining)
+
+    def _backoff(
+        self, attempt: int, error: Exception, deadline: Optional[float]
+    ) -> float:
+        """Delay before the next attempt; re-raises ``error`` if there is none."""
+        reason = retry_reason(error)
+        if isinstance(error, RateLimitExceeded):
+            # Local back-pressure (a hedge refused a slot): Gemini was not called
+            self.breaker.release_trial()
+            raise error
+        if reason is None:
+            if service_responded(error):
+                # A bad request or a blocked response: the service is up
+                self.breaker.record_success()
+            else:
+                # Connection errors and the like never reached the service
+                self.breaker.record_failure()
+            raise error
+        delay = self._rng.uniform(
+            0, min(MAX_BACKOFF_SECONDS, self.backoff_seconds * 2 ** (attempt - 1))
+        )
+        out_of_time = deadline is not None and self._clock() + delay >= deadline
+        if attempt >= self.max_attempts or out_of_time:
+            self.breaker.record_failure()
+            raise error
+        metrics.REGISTRY.llm_retries.inc(reason=reason)
+        metrics.log_event(
+            "llm_retry", attempt=attempt, reason=reason, delay_ms=round(delay * 1000)
+        )
+        return delay
+
+    def _succeeded(self, started: float, hedged: bool) -> None:
+        self.latencies.add(self._clock() - started)
+        self.breaker.record_success()
+        if hedged:
+            metrics.REGISTRY.llm_hedges.inc(outcome="won")
+
+    def _hedged(self, hedge_after: float) -> None:
+        metrics.REGISTRY.llm_hedges.inc(outcome="sent")
+        metrics.log_event("llm_hedge", after_ms=round(hedge_after * 1000))
+
+    def call(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        acquire: Optional[Callable[[], Optional[Release]]] = None,
+    ) -> Any:
+        """
+        Run ``fn(*args)`` under the policy. ``acquire`` (rate limits) is
+        called before each attempt, outside its timeout, and by each hedge;
+        the callable it may return is called once that attempt has finished.
+        """
+        deadline = self._admit()
+        attempt = 0
+        while True:
+            attempt += 1
+            release = self._acquire(acquire)
+            try:
+                return self._run_attempt(fn, args, deadline, acquire, release)
+            except Exception as e:
+                self._sleep(self._backoff(attempt, e, deadline))
+
+    def _acquire(
+        self, acquire: Optional[Callable[[], Optional[Release]]]
+    ) -> Optional[Release]:
+        if acquire is None:
+            return None
+        try:
+            return acquire()
+        except Exception:
+            # No call was made, so the breaker learnt nothing
+            self.breaker.release_trial()
+            raise
+
+    def _run_attempt(
+        self, fn, args, deadline, acquire=None, release: Optional[Release] = None
+    ) -> Any:
+        executor = self._executor or get_executor()
+        started = self._clock()
+
+        def hedge(*args):
+            hedge_release = acquire() if acquire is not None else None
+            try:
+                return fn(*args)
+            finally:
+                if hedge_release is not None:
+                    hedge_release()
+
+        def submit(target) -> Future:
+            # Keep the request id (and other context) in the worker thread
+            return executor.submit(contextvars.copy_context().run, target, *args)
+
+        try:
+            timeout = self._attempt_timeout(deadline)
+            first = submit(fn)
+        except BaseException:
+            if release is not None:
+                release()
+            raise
+        if release is not None:
+            # An abandoned attempt keeps its slot until its thread is done
+            first.add_done_callback(lambda _: release())
+        pending: Set[Future] = {first}
+        try:
+            hedge_after = self.hedge_delay()
+            if hedge_after is not None and hedge_after < timeout:
+                if not wait(pending, timeout=hedge_after).done:
+                    self._hedged(hedge_after)
+                    pending.add(submit(hedge))
+            error: Optional[BaseException] = None
+            while pending:
+                remaining = timeout - (self._clock() - started)
+                done, pending = wait(
+                    pending, timeout=max(remaining, 0), return_when=FIRST_COMPLETED
+                )
+                if not done:
+                    raise TimeoutError(f"Gemini attempt timed out after {timeout:g}s")
+                for future in done:
+                    if future.exception() is None:
+                        self._succeeded(started, future is not first)
+                        return future.result()
+                    error = future.exception()
+            assert error is not None
+            raise error
+        finally:
+            # Attempts still queued behind a busy pool never reach Gemini;
+            # running ones cannot be interrupted and finish in the background
+            for future in pending:
+                future.cancel()
+
+    async def call_async(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        acquire: Optional[Callable[[], Awaitable[Optional[Release]]]] = None,
+    ) -> Any:
+        """``call`` for coroutine functions; losing attempts are cancelled."""
+        deadline = self._admit()
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                release = None
+                if acquire is not None:
+                    try:
+                        release = await acquire()
+                    except Exception:
+                        self.breaker.release_trial()
+                        raise
+                try:
+                    return await self._run_attempt_async(
+                        fn, args, deadline, acquire, release
+                    )
+                except Exception as e:
+                    await asyncio.sleep(self._backoff(attempt, e, deadline))
+        except asyncio.CancelledError:
+            # A client disconnect, say: the call has no outcome, and a
+            # half-open breaker must let another trial through
+            self.breaker.release_trial()
+            raise
+
+    async def _run_attempt_async(
+        self, fn, args, deadline, acquire=None, release: Optional[Release] = None
+    ) -> Any:
+        started = self._clock()
+
+        async def hedge():
+            hedge_release = await acquire() if acquire is not None else None
+            try:
+                return await fn(*args)
+            finally:
+                if hedge_release is not None:
+                    hedge_release()
+
+        try:
+            timeout = self._attempt_timeout(deadline)
+            first = asyncio.ensure_future(fn(*args))
+        except BaseException:
+            if release is not None:
+                release()
+            raise
+        if release is not None:
+            first.add_done_callback(lambda _: release())
+        pending = {first}
+        try:
+            hedge_after = self.hedge_delay()
+            if hedge_after is not None and hedge_after < timeout:
+                if not (await asyncio.wait(pending, timeout=hedge_after))[0]:
+                    self._hedged(hedge_after)
+                    pending.add(asyncio.ensure_future(hedge()))
+            error: Optional[BaseException] = None
+            while pending:
+                remaining = timeout - (self._clock() - started)
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(remaining, 0), return_when=FIRST_COMPLETED
+                )
+                if not done:
+                    raise TimeoutError(f"Gemini attempt timed out after {timeout:g}s")
+                for task in done:
+                    if task.exception() is None:
+                        self._succeeded(started, task is not first)
+                        return task.result()
+                    error = task.exception()
+            assert error is not None
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def build_llm_policy(agent_config, deadline_seconds=None) -> LLMCallPolicy:
+    """Build the policy described by an ``AgentConfig``."""
+    return LLMCallPolicy(
+        max_attempts=agent_config.llm_max_attempts,
+        backoff_seconds=agent_config.llm_backoff_seconds,
+        attempt_timeout_seconds=agent_config.llm_attempt_timeout_seconds,
+        deadline_seconds=deadline_seconds,
+        hedge_percentile=agent_config.llm_hedge_percentile,
+        breaker=CircuitBreaker(
+            agent_config.llm_breaker_failures,
+            agent_config.llm_breaker_reset_seconds,
+        ),
+    )
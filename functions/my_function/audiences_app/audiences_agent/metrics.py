@@ -0,0 +1,273 @@
+"""
+Stage timings for the audience pipeline, exported in Prometheus text format.
+
+Wrap a stage in ``span``; on exit its duration is observed in the
+``audience_stage_duration_seconds`` histogram (labelled by stage), the sizes
+set on the span (``prompt_bytes``, ``response_bytes``, ``bytes_processed``)
+in ``audience_stage_<size>`` histograms, failures in
+``audience_stage_errors_total``, and one JSON log line is written with the
+current request id::
+
+    with span("gemini_call", prompt_bytes=len(prompt)) as s:
+        response = generate(prompt, schema)
+        s["response_bytes"] = len(response)
+
+The request id lives in a context variable set per request by
+``ui.middleware.request_id_middleware``; code running on other threads or
+after the view returned (streamed responses) carries it over with
+``bind_request_id``. The middleware also observes
+``audience_http_request_duration_seconds``; for streamed responses this
+covers the whole body. Metrics are kept per process, so with several workers
+each exposes its own ``/metrics``.
+"""
+
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("audiences")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(float(4**i) for i in range(2, 19))  # 16 B .. 64 GiB
+SIZE_ATTRIBUTES = ("prompt_bytes", "response_bytes", "bytes_processed")
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "request_id", default=None
+)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def get_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def set_request_id(request_id: Optional[str]) -> contextvars.Token:
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token: contextvars.Token) -> None:
+    _request_id.reset(token)
+
+
+def bind_request_id(iterable: Iterable, request_id: Optional[str]) -> Iterator:
+    """Iterate ``iterable`` with ``request_id`` set, e.g. for streamed bodies."""
+    iterator = iter(iterable)
+    while True:
+        token = _request_id.set(request_id)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _request_id.reset(token)
+        yield item
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+                )
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = DURATION_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels -> (per-bucket counts, +Inf count, sum)
+        self._series: Dict[Tuple[Tuple[str, str], ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            series = self._series.get(tuple(sorted(labels.items())))
+            return series[1] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for labels, (counts, total, value_sum) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(labels, le)} {cumulative}"
+                    )
+                inf = _format_labels(labels, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{inf} {total}")
+                lines.append(
+                    f"{self.name}_sum{_format_labels(labels)} {_format_value(value_sum)}"
+                )
+                lines.append(f"{self.name}_count{_format_labels(labels)} {total}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            "audience_stage_duration_seconds", "Time spent per pipeline stage."
+        )
+        self.stage_sizes = {
+            name: Histogram(
+                f"audience_stage_{name}",
+                f"{name.replace('_', ' ').capitalize()} per pipeline stage.",
+                SIZE_BUCKETS,
+            )
+            for name in SIZE_ATTRIBUTES
+        }
+        self.stage_errors = Counter(
+            "audience_stage_errors_total", "Pipeline stages that raised."
+        )
+        self.request_seconds = Histogram(
+            "audience_http_request_duration_seconds",
+            "Time to respond per view, to the end of a streamed body.",
+        )
+        self.llm_retries = Counter(
+            "audience_llm_retries_total", "Gemini attempts retried, by reason."
+        )
+        self.llm_hedges = Counter(
+            "audience_llm_hedges_total",
+            "Hedged duplicate Gemini requests sent, and those that answered first.",
+        )
+        self.llm_breaker = Counter(
+            "audience_llm_circuit_breaker_total",
+            "Gemini circuit breaker transitions and rejected calls.",
+        )
+        self.llm_rate_limit_wait = Histogram(
+            "audience_llm_rate_limit_wait_seconds",
+            "Time Gemini calls queued in the client-side rate limiter.",
+        )
+        self.llm_rate_limited = Counter(
+            "audience_llm_rate_limited_total",
+            "Gemini calls refused because the rate limiter wait was too long.",
+        )
+        self.prompt_tokens_saved = Counter(
+            "audience_prompt_tokens_saved_total",
+            "Estimated prompt tokens removed by the column-values budget.",
+        )
+
+    def metrics(self) -> List[Any]:
+        return [
+            self.stage_seconds,
+            *self.stage_sizes.values(),
+            self.stage_errors,
+            self.request_seconds,
+            self.llm_retries,
+            self.llm_hedges,
+            self.llm_breaker,
+            self.llm_rate_limit_wait,
+            self.llm_rate_limited,
+            self.prompt_tokens_saved,
+        ]
+
+    def render(self) -> str:
+        return "\n".join(line for m in self.metrics() for line in m.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def log_event(event: str, **fields: Any) -> None:
+    """One JSON log line carrying the current request id."""
+    record = {"event": event, "request_id": get_request_id(), **fields}
+    logger.info(json.dumps(record, default=str))
+
+
+@contextmanager
+def span(stage: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """Time a pipeline stage; sizes may be added to the yielded dict."""
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        REGISTRY.stage_seconds.observe(seconds, stage=stage)
+        for name in SIZE_ATTRIBUTES:
+            value = attributes.get(name)
+            if isinstance(value, (int, float)):
+                REGISTRY.stage_sizes[name].observe(value, stage=stage)
+        if error is not None:
+            REGISTRY.stage_errors.inc(stage=stage)
+        log_event(
+            "span",
+            stage=stage,
+            duration_ms=round(seconds * 1000, 3),
+            **attributes,
+            **({"error": repr(error)} if error is not None else {}),
+        )
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,114 @@
+"""
+Process-wide registry of Vertex AI model objects.
+
+``GenerativeModel`` instances hold their own prediction client, so building
+one per call also means building a new gRPC channel on first use. The
+registry builds the model, its ``GenerationConfig`` and the safety settings
+once per ``(model name, response schema)`` pair and hands the same objects
+to every caller. Lookups are guarded by a lock so gunicorn threads can share
+a registry.
+"""
+
+import hashlib
+import json
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from vertexai.generative_models import (
+    GenerationConfig,
+    GenerativeModel,
+    HarmCategory,
+    HarmBlockThreshold,
+    SafetySetting,
+)
+
+MAX_OUTPUT_TOKENS = 8192
+
+
+@dataclass(frozen=True)
+class ModelBundle:
+    """Everything ``generate_content`` needs for one model/schema pair."""
+
+    model: GenerativeModel
+    generation_config: GenerationConfig
+    safety_settings: List[SafetySetting]
+
+
+def schema_key(response_schema: Optional[Dict[str, Any]]) -> str:
+    """Stable key for a response schema; empty for free-text generation."""
+    if not response_schema:
+        return ""
+    payload = json.dumps(response_schema, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def build_safety_settings() -> List[SafetySetting]:
+    return [
+        SafetySetting(category=category, threshold=HarmBlockThreshold.BLOCK_NONE)
+        for category in (
+            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+            HarmCategory.HARM_CATEGORY_HARASSMENT,
+            HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+        )
+    ]
+
+
+def build_generation_config(
+    response_schema: Optional[Dict[str, Any]] = None,
+) -> GenerationConfig:
+    if response_schema:
+        return GenerationConfig(
+            max_output_tokens=MAX_OUTPUT_TOKENS,
+            temperature=0.0,
+            top_p=1,
+            response_mime_type="application/json",
+            response_schema=response_schema,
+        )
+    return GenerationConfig(
+        max_output_tokens=MAX_OUTPUT_TOKENS, temperature=0.0, top_p=1
+    )
+
+
+class ModelRegistry:
+    """Thread-safe cache of ``ModelBundle`` objects."""
+
+    def __init__(self):
+        self._bundles: Dict[Tuple[str, str], ModelBundle] = {}
+        self._models: Dict[str, GenerativeModel] = {}
+        self._safety_settings: Optional[List[SafetySetting]] = None
+        self._lock = threading.Lock()
+
+    def get(
+        self, model_name: str, response_schema: Optional[Dict[str, Any]] = None
+    ) -> ModelBundle:
+        """Return the shared bundle for ``model_name`` and ``response_schema``."""
+        key = (model_name, schema_key(response_schema))
+        bundle = self._bundles.get(key)
+        if bundle is not None:
+            return bundle
+
+        with self._lock:
+            bundle = self._bundles.get(key)
+            if bundle is None:
+                # Schemas differ only in GenerationConfig; the model and its
+                # prediction client are shared across them
+                model = self._models.get(model_name)
+                if model is None:
+                    model = GenerativeModel(model_name)
+                    self._models[model_name] = model
+                if self._safety_settings is None:
+                    self._safety_settings = build_safety_settings()
+                bundle = ModelBundle(
+                    model=model,
+                    generation_config=build_generation_config(response_schema),
+                    safety_settings=self._safety_settings,
+                )
+                self._bundles[key] = bundle
+            return bundle
+
+    def clear(self) -> None:
+        with self._lock:
+            self._bundles.clear()
+            self._models.clear()
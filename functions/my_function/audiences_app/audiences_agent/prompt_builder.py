@@ -0,0 +1,187 @@
+"""
+Prompt assembly for the audience agent.
+
+The audience prompt is dominated by the schema listing and the distinct
+column values, which only change when the context blobs in GCS change.
+``PromptBuilder`` renders that static part once per context version and
+keeps it as a list of fragments around the ``{attribute_goal}`` slot, so a
+request only pays for joining the goal into the pre-rendered text.
+
+Fields named in ``dynamic_fields`` are slots too: their static rendering is
+kept as a default, and a request may pass its own text instead (the column
+values cut to a token budget, for example).
+"""
+
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+GOAL_PLACEHOLDER = "attribute_goal"
+_GOAL_SENTINEL = "\x00attribute_goal\x00"
+_SLOT = re.compile("\x00([A-Za-z_]+)\x00")
+# Rough size of a Gemini token; every token estimate in the agent uses it
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Rough token estimate (about four characters per token for Gemini)."""
+    return tokens_for_chars(len(text or ""))
+
+
+def tokens_for_chars(chars: int) -> int:
+    return -(-chars // CHARS_PER_TOKEN)
+
+
+def hash_json(data: Any) -> str:
+    """Stable content hash of a JSON-serialisable object."""
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def combine_versions(*versions: str) -> str:
+    """Combine several content hashes into a single short version key."""
+    return hashlib.sha256("|".join(versions).encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class RenderedPrefix:
+    """Static part of a prompt, split around the goal and dynamic slots."""
+
+    version: str
+    fragments: List[str]
+    # Field filling each gap between fragments; empty means the goal everywhere
+    slots: List[str] = field(default_factory=list)
+    defaults: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def static_chars(self) -> int:
+        return sum(len(fragment) for fragment in self.fragments)
+
+    @property
+    def dynamic_chars(self) -> int:
+        """Size of the default text of the dynamic slots, as rendered."""
+        return sum(len(self.defaults.get(slot, "")) for slot in self.slots)
+
+    @property
+    def prefix_chars(self) -> int:
+        """Size of the prompt sent when no slot is overridden (goal excluded)."""
+        return self.static_chars + self.dynamic_chars
+
+    @property
+    def estimated_tokens(self) -> int:
+        return tokens_for_chars(self.prefix_chars)
+
+    def render(self, attribute_goal: str, **fields: str) -> str:
+        if not self.slots:
+            return attribute_goal.join(self.fragments)
+        values = {**self.defaults, **fields, GOAL_PLACEHOLDER: attribute_goal}
+        parts = [self.fragments[0]]
+        for slot, fragment in zip(self.slots, self.fragments[1:]):
+            parts.append(values[slot])
+            parts.append(fragment)
+        return "".join(parts)
+
+
+class PromptBuilder:
+    """
+    Renders a prompt template once per context version.
+
+    Args:
+        template: ``str.format`` template with an ``{attribute_goal}`` slot.
+        render_static: Callable returning the remaining template fields for a
+            given ``(context_json, col_values_json)`` pair.
+        max_versions: Number of rendered context versions kept in memory.
+        dynamic_fields: Fields of ``render_static`` that a request may override.
+    """
+
+    def __init__(
+        self,
+        template: str,
+        render_static: Callable[[Any, Any], Dict[str, str]],
+        max_versions: int = 4,
+        dynamic_fields: Sequence[str] = (),
+    ):
+        self.template = template
+        self.template_version = hashlib.sha256(template.encode("utf-8")).hexdigest()
+        self._render_static = render_static
+        self.max_versions = max_versions
+        self.dynamic_fields = tuple(dynamic_fields)
+        self._prefixes: "OrderedDict[str, RenderedPrefix]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def prefix(
+        self,
+        context_json: Any,
+        col_values_json: Any,
+        context_version: Optional[str] = None,
+    ) -> RenderedPrefix:
+        """Return the rendered static prefix for a context, rendering on first use."""
+        if context_version is None:
+            context_version = combine_versions(
+                hash_json(context_json), hash_json(col_values_json)
+            )
+        version = combine_versions(self.template_version, context_version)
+
+        with self._lock:
+            rendered = self._prefixes.get(version)
+            if rendered is not None:
+                self._prefixes.move_to_end(version)
+                self.hits += 1
+                return rendered
+
+        fields = self._render_static(context_json, col_values_json)
+        defaults = {name: fields[name] for name in self.dynamic_fields}
+        slots = {name: f"\x00{name}\x00" for name in self.dynamic_fields}
+        text = self.template.format(
+            **{**fields, **slots, GOAL_PLACEHOLDER: _GOAL_SENTINEL}
+        )
+        parts = _SLOT.split(text)
+        rendered = RenderedPrefix(
+            version=version,
+            fragments=parts[0::2],
+            slots=parts[1::2],
+            defaults=defaults,
+        )
+
+        with self._lock:
+            self.misses += 1
+            self._prefixes[version] = rendered
+            while len(self._prefixes) > self.max_versions:
+                self._prefixes.popitem(last=False)
+        return rendered
+
+    def build(
+        self,
+        attribute_goal: str,
+        context_json: Any,
+        col_values_json: Any,
+        context_version: Optional[str] = None,
+        **fields: str,
+    ) -> str:
+        """Return the full prompt for ``attribute_goal``; ``fields`` override slots."""
+        return self.prefix(context_json, col_values_json, context_version).render(
+            attribute_goal, **fields
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the size of the cached prefixes."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "versions": len(self._prefixes),
+                "prefix_chars": {
+                    version: rendered.prefix_chars
+                    for version, rendered in self._prefixes.items()
+                },
+                "static_chars": {
+                    version: rendered.static_chars
+                    for version, rendered in self._prefixes.items()
+                },
+            }
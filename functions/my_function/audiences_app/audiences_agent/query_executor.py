@@ -0,0 +1,231 @@
+"""
+Cost gate for every BigQuery query the agent and the views run.
+
+``QueryExecutor.query`` dry-runs a statement first, rejects it if the
+estimated bytes exceed the per-query limit or the caller's remaining budget,
+and otherwise submits it with ``maximum_bytes_billed`` set, so BigQuery itself
+refuses a query whose real scan would exceed the limit. Dry-run estimates are
+cached per normalized SQL for a while, so repeated queries cost one round
+trip instead of two.
+
+Per-user budgets are a sliding window of estimated bytes kept in process
+memory; with several workers each enforces its own share.
+
+``bind(client, user)`` returns an object with the BigQuery client's
+``query(sql, job_config=None)`` signature, so existing code (for example
+``counting.CountingEngine``) can run through the gate unchanged.
+"""
+
+import copy
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from .counting import client_dialect
+
+GIB = 1024**3
+DEFAULT_MAX_BYTES_PER_QUERY = 500 * GIB
+DEFAULT_BUDGET_WINDOW_SECONDS = 24 * 3600.0
+DEFAULT_DRY_RUN_TTL_SECONDS = 600.0
+DEFAULT_DRY_RUN_CACHE_SIZE = 1024
+ANONYMOUS_USER = "anonymous"
+
+
+class QueryBudgetError(Exception):
+    """A query was refused before it ran because it would scan too much."""
+
+    def __init__(self, message: str, estimated_bytes: Optional[int]):
+        super().__init__(message)
+        self.estimated_bytes = estimated_bytes
+
+
+# A quoted string or identifier (kept as written), or a run of whitespace
+_QUOTED_OR_SPACE = re.compile(r"""('(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*"|`[^`]*`)|\s+""")
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and drop a trailing semicolon (literals untouched)."""
+    collapsed = _QUOTED_OR_SPACE.sub(lambda m: m.group(1) or " ", sql)
+    return collapsed.strip().rstrip(";").rstrip()
+
+
+class QueryExecutor:
+    """
+    Args:
+        max_bytes_per_query: Largest estimated scan a single query may have;
+            also sent as ``maximum_bytes_billed``.
+        user_bytes_per_window: Estimated bytes one user may scan per
+            ``window_seconds``; None disables per-user budgets.
+        dry_run_ttl_seconds: How long a dry-run estimate is reused.
+        dry_run_cache_size: Estimates kept, least recently used evicted first.
+    """
+
+    def __init__(
+        self,
+        max_bytes_per_query: int = DEFAULT_MAX_BYTES_PER_QUERY,
+        user_bytes_per_window: Optional[int] = None,
+        window_seconds: float = DEFAULT_BUDGET_WINDOW_SECONDS,
+        dry_run_ttl_seconds: float = DEFAULT_DRY_RUN_TTL_SECONDS,
+        dry_run_cache_size: int = DEFAULT_DRY_RUN_CACHE_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_bytes_per_query = max_bytes_per_query
+        self.user_bytes_per_window = user_bytes_per_window
+        self.window_seconds = window_seconds
+        self.dry_run_ttl_seconds = dry_run_ttl_seconds
+        self.dry_run_cache_size = dry_run_cache_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._estimates: "OrderedDict[str, Tuple[Optional[int], float]]" = OrderedDict()
+        self._spent: Dict[str, Deque[Tuple[float, int]]] = {}
+        self.dry_runs = 0
+        self.dry_run_hits = 0
+
+    def estimate(self, client, sql: str, job_config=None) -> Optional[int]:
+        """
+        Estimated bytes processed, from cache or a dry run.
+
+        The dry run uses a copy of ``job_config`` (query parameters, for
+        example). Returns None when the estimate is unavailable. A dry run
+        that fails (syntax error, unknown column) raises, as the real query
+        would.
+        """
+        key = normalize_sql(sql)
+        now = self._clock()
+        with self._lock:
+            cached = self._estimates.get(key)
+            if cached is not None and cached[1] > now:
+                self._estimates.move_to_end(key)
+                self.dry_run_hits += 1
+                return cached[0]
+
+        dry_run_config = copy_job_config(job_config)
+        dry_run_config.dry_run = True
+        dry_run_config.use_query_cache = False
+        job = client.query(sql, job_config=dry_run_config)
+        estimated = job.total_bytes_processed
+        if not isinstance(estimated, int):
+            estimated = None
+        with self._lock:
+            self.dry_runs += 1
+            self._estimates[key] = (estimated, now + self.dry_run_ttl_seconds)
+            self._estimates.move_to_end(key)
+            while len(self._estimates) > self.dry_run_cache_size:
+                self._estimates.popitem(last=False)
+        return estimated
+
+    def spent(self, user: Optional[str] = None) -> int:
+        """Estimated bytes charged to ``user`` in the current window."""
+        with self._lock:
+            return sum(b for _, b in self._window(user or ANONYMOUS_USER))
+
+    def query(
+        self,
+        client,
+        sql: str,
+        user: Optional[str] = None,
+        job_config=None,
+        max_bytes: Optional[int] = None,
+    ):
+        """
+        Dry-run, check the budgets, and submit ``sql``; returns the query job.
+
+        Raises ``QueryBudgetError`` if the query may not run.
+        """
+        return self.submit(client, sql, user, job_config, max_bytes)[0]
+
+    def submit(
+        self,
+        client,
+        sql: str,
+        user: Optional[str] = None,
+        job_config=None,
+        max_bytes: Optional[int] = None,
+    ) -> Tuple[Any, Optional[int]]:
+        """Like ``query`` but also returns the estimated bytes."""
+        limit = max_bytes if max_bytes is not None else self.max_bytes_per_query
+        estimated = self.estimate(client, sql, job_config)
+        user = user or ANONYMOUS_USER
+        if estimated is not None and estimated > limit:
+            raise QueryBudgetError(
+                f"Query would process {estimated} bytes, over the {limit} byte limit",
+                estimated,
+            )
+        with self._lock:
+            window = self._window(user)
+            if self.user_bytes_per_window is not None and estimated is not None:
+                spent = sum(b for _, b in window)
+                if spent + estimated > self.user_bytes_per_window:
+                    raise QueryBudgetError(
+                        f"Query would process {estimated} bytes; {user} has "
+                        f"{max(self.user_bytes_per_window - spent, 0)} bytes of "
+                        "budget left",
+                        estimated,
+                    )
+            if estimated:
+                window.append((self._clock(), estimated))
+
+        job_config = copy_job_config(job_config)
+        job_config.maximum_bytes_billed = limit
+        return client.query(sql, job_config=job_config), estimated
+
+    def bind(self, client, user: Optional[str] = None) -> "BoundQueryExecutor":
+        return BoundQueryExecutor(self, client, user)
+
+    def _window(self, user: str) -> Deque[Tuple[float, int]]:
+        # Caller holds the lock
+        window = self._spent.setdefault(user, deque())
+        horizon = self._clock() - self.window_seconds
+        while window and window[0][0] <= horizon:
+            window.popleft()
+        return window
+
+
+class BoundQueryExecutor:
+    """Client-shaped view of a ``QueryExecutor`` for one client and user."""
+
+    def __init__(self, executor: QueryExecutor, client, user: Optional[str] = None):
+        self.executor = executor
+        self.client = client
+        self.user = user
+        self.estimated_bytes: Optional[int] = None
+
+    @property
+    def dialect(self) -> str:
+        return client_dialect(self.client)
+
+    def query(self, sql: str, job_config=None):
+        try:
+            job, estimated = self.executor.submit(
+                self.client, sql, user=self.user, job_config=job_config
+            )
+        except QueryBudgetError as e:
+            self._add(e.estimated_bytes)
+            raise
+        self._add(estimated)
+        return job
+
+    def _add(self, estimated: Optional[int]) -> None:
+        # Estimate of the latest query attempted through this view
+        self.estimated_bytes = estimated
+
+
+def copy_job_config(job_config=None):
+    """A ``QueryJobConfig`` to modify without touching the caller's."""
+    if job_config is not None:
+        return copy.deepcopy(job_config)
+    from google.cloud import bigquery
+
+    return bigquery.QueryJobConfig()
+
+
+def build_query_executor(agent_config) -> QueryExecutor:
+    """Build the executor described by an ``AgentConfig``."""
+    user_budget = agent_config.user_daily_budget_gb
+    return QueryExecutor(
+        max_bytes_per_query=int(agent_config.query_max_gb * GIB),
+        user_bytes_per_window=int(user_budget * GIB) if user_budget else None,
+        dry_run_ttl_seconds=agent_config.dry_run_cache_ttl_seconds,
+    )
@@ -0,0 +1,338 @@
+"""
+Client-side rate limiting for Vertex AI calls.
+
+``RateLimiter`` is a token bucket over two budgets at once, requests per
+minute and tokens per minute (prompt tokens are estimated at four characters
+each before the call; the response is charged after it). Each bucket holds
+up to one minute's allowance and refills continuously.
+
+A caller *reserves* its request and tokens in one atomic update, even if that
+takes a bucket below zero, and then sleeps until the debt is repaid. So
+callers are served in arrival order, and there is no polling. If the wait
+would be longer than ``max_wait_seconds``, nothing is reserved and
+``RateLimitExceeded`` is raised, so overload fails after a bounded queue
+instead of piling up.
+
+The bucket state lives in a ``BucketStore``:
+
+- ``ThreadBucketStore``: process memory, shared by the threads of a worker
+- ``FileBucketStore``: a small file locked with ``fcntl.flock``, shared by
+  every worker process on the machine (gunicorn workers, for example)
+
+``ConcurrencyGovernor`` additionally caps the Gemini calls in flight per
+process, with the same bounded wait.
+
+``LLMCallPolicy`` acquires the limiter and a governor slot before each
+attempt, so the wait does not count against the attempt timeout, and a
+refusal (``RateLimitExceeded``) never counts as a Gemini failure.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Optional, Protocol, Tuple
+
+from . import metrics
+
+DEFAULT_MAX_WAIT_SECONDS = 30.0
+
+# (request level, token level, last refill time)
+State = Tuple[float, float, float]
+
+
+class RateLimitExceeded(RuntimeError):
+    """The limiter could not admit a call within its maximum wait."""
+
+
+class BucketStore(Protocol):
+    def update(self, fn: Callable[[Optional[State]], Tuple[State, float]]) -> float:
+        """Atomically replace the state with ``fn(state)[0]``; return ``[1]``."""
+        ...
+
+
+class ThreadBucketStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Optional[State] = None
+
+    def update(self, fn):
+        with self._lock:
+            self._state, result = fn(self._state)
+            return result
+
+
+class FileBucketStore:
+    """Bucket state in ``path``, shared between processes via ``flock``."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def update(self, fn):
+        import fcntl
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.read(fd, 4096)
+            try:
+                state: Optional[State] = tuple(json.loads(raw))
+            except ValueError:
+                # New (empty) or corrupt file: start from full buckets
+                state = None
+            state, result = fn(state)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, json.dumps(state).encode("utf-8"))
+            return result
+        finally:
+            # Closing the descriptor releases the lock
+            os.close(fd)
+
+
+class RateLimiter:
+    """
+    Args:
+        requests_per_minute: Request budget; 0 disables it.
+        tokens_per_minute: Token budget; 0 disables it.
+        store: Where the bucket state lives (default: this process).
+        max_wait_seconds: Longest a caller queues before ``RateLimitExceeded``.
+        clock: Wall-clock seconds; must agree between processes sharing a
+            ``FileBucketStore``.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 0.0,
+        tokens_per_minute: float = 0.0,
+        store: Optional[BucketStore] = None,
+        max_wait_seconds: float = DEFAULT_MAX_WAIT_SECONDS,
+        clock=time.time,
+        sleep=time.sleep,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.store = store or ThreadBucketStore()
+        self.max_wait_seconds = max_wait_seconds
+        self._clock = clock
+        self._sleep = sleep
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests_per_minute > 0 or self.tokens_per_minute > 0
+
+    def _refill(self, state: Optional[State], now: float) -> Tuple[float, float]:
+        if state is None:
+            return self.requests_per_minute, self.tokens_per_minute
+        requests, tokens, updated = state
+        elapsed = max(0.0, now - updated)
+        return (
+            min(
+                self.requests_per_minute,
+                requests + elapsed * self.requests_per_minute / 60,
+            ),
+            min(self.tokens_per_minute, tokens + elapsed * self.tokens_per_minute / 60),
+        )
+
+    def _debt_seconds(self, level: float, per_minute: float) -> float:
+        if per_minute <= 0 or level >= 0:
+            return 0.0
+        return -level * 60 / per_minute
+
+    def reserve(self, tokens: int = 0) -> float:
+        """Reserve one request and ``tokens``; returns the seconds to wait."""
+        if not self.enabled:
+            return 0.0
+        # A call larger than the whole bucket would never fit; let it drain it
+        if self.tokens_per_minute > 0:
+            tokens = min(tokens, int(self.tokens_per_minute))
+
+        def take(state):
+            now = self._clock()
+            requests, token_level = self._refill(state, now)
+            requests -= 1 if self.requests_per_minute > 0 else 0
+            token_level -= tokens if self.tokens_per_minute > 0 else 0
+            wait = max(
+                self._debt_seconds(requests, self.requests_per_minute),
+                self._debt_seconds(token_level, self.tokens_per_minute),
+            )
+            if wait > self.max_wait_seconds:
+                # Leave the buckets as they were, apart from the refill
+                return (*self._refill(state, now), now), -1.0
+            return (requests, token_level, now), wait
+
+        wait = self.store.update(take)
+        if wait < 0:
+            metrics.REGISTRY.llm_rate_limited.inc()
+            raise RateLimitExceeded(
+                f"Gemini rate limit: no capacity within {self.max_wait_seconds:g}s"
+            )
+        metrics.REGISTRY.llm_rate_limit_wait.observe(wait)
+        return wait
+
+    def acquire(self, tokens: int = 0) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self._sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0) -> None:
+        import asyncio
+
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def charge(self, tokens: int) -> None:
+        """Take ``tokens`` already used (a response) without waiting."""
+        if self.tokens_per_minute <= 0 or tokens <= 0:
+            return
+
+        def take(state):
+            now = self._clock()
+            requests, token_level = self._refill(state, now)
+            return (requests, token_level - tokens, now), 0.0
+
+        self.store.update(take)
+
+
+class _Waiter:
+    """A call queued for a governor slot; ``granted`` is set under its lock."""
+
+    def __init__(self, loop: Any = None):
+        self.granted = False
+        self.loop = loop
+        # Sync waiters block on the event, async ones await the future
+        self.event = threading.Event()
+        self.future: Any = loop.create_future() if loop is not None else None
+
+    def grant(self) -> bool:
+        if self.loop is None:
+            self.event.set()
+        else:
+            try:
+                self.loop.call_soon_threadsafe(self._resolve)
+            except RuntimeError:
+                return False  # the waiter's event loop is closed
+        self.granted = True
+        return True
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class ConcurrencyGovernor:
+    """
+    At most ``max_concurrency`` calls in flight per process (0: no cap).
+
+    ``acquire`` and ``acquire_async`` wait for a slot, in arrival order, and
+    return the callable that gives it back. Async callers wait on their event
+    loop, not on a worker thread.
+    """
+
+    def __init__(
+        self, max_concurrency: int, max_wait_seconds: float = DEFAULT_MAX_WAIT_SECONDS
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_wait_seconds = max_wait_seconds
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters: Deque[_Waiter] = deque()
+
+    def acquire(self) -> Callable[[], None]:
+        if self.max_concurrency <= 0:
+            return _no_release
+        waiter = _Waiter()
+        if not self._enter(waiter):
+            waiter.event.wait(self.max_wait_seconds)
+            if self._abandon(waiter):
+                self._refuse()
+        return self.release
+
+    async def acquire_async(self) -> Callable[[], None]:
+        import asyncio
+
+        if self.max_concurrency <= 0:
+            return _no_release
+        waiter = _Waiter(asyncio.get_running_loop())
+        if self._enter(waiter):
+            return self.release
+        try:
+            await asyncio.wait_for(waiter.future, self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                self._refuse()
+        except asyncio.CancelledError:
+            if not self._abandon(waiter):
+                self.release()  # granted just as the wait was cancelled
+            raise
+        return self.release
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                # Hand the slot straight to the oldest waiter still waiting
+                if self._waiters.popleft().grant():
+                    return
+            self._in_flight -= 1
+
+    def _enter(self, waiter: _Waiter) -> bool:
+        """Take a free slot, or queue ``waiter``; True if a slot was taken."""
+        with self._lock:
+            if self._in_flight < self.max_concurrency and not self._waiters:
+                self._in_flight += 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Stop waiting; False if the slot was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._waiters.remove(waiter)
+            return True
+
+    def _refuse(self) -> None:
+        metrics.REGISTRY.llm_rate_limited.inc()
+        raise RateLimitExceeded(
+            f"{self.max_concurrency} Gemini calls already in flight"
+        )
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.max_concurrency > 0:
+            self.release()
+        return False
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return self.__exit__(*exc_info)
+
+
+def _no_release() -> None:
+    pass
+
+
+def build_rate_limiter(agent_config) -> RateLimiter:
+    """Build the limiter described by an ``AgentConfig``."""
+    store: Optional[BucketStore] = None
+    if agent_config.llm_rate_limit_backend == "file":
+        store = FileBucketStore(agent_config.llm_rate_limit_path)
+    elif agent_config.llm_rate_limit_backend != "thread":
+        raise ValueError(
+            f"Unknown llm_rate_limit_backend {agent_config.llm_rate_limit_backend!r}"
+        )
+    return RateLimiter(
+        requests_per_minute=agent_config.llm_requests_per_minute,
+        tokens_per_minute=agent_config.llm_tokens_per_minute,
+        store=store,
+        max_wait_seconds=agent_config.llm_rate_limit_max_wait_seconds,
+    )
@@ -0,0 +1,341 @@
+"""
+Response cache for audience generation.
+
+Analysts often resubmit the same, or nearly the same, attribute goal. Each
+answer costs a Gemini call plus a BigQuery count, so ``ResponseCache`` keeps
+finished results keyed on the normalized goal, the context version and the
+model name. Lookups try an exact match first. Optionally they then fall
+back to a token-set similarity match within the same context/model scope;
+the logical words of the two goals (and, or, not, without, except, ...) must
+be identical, in order, since they change the audience.
+
+Two storage backends are provided: ``MemoryBackend`` (LRU with size and TTL
+eviction) and ``SQLiteBackend`` (shared across worker processes on the same
+host and kept across restarts).
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Protocol, Tuple
+
+_STOPWORDS = frozenset(
+    "a an the who that which whose with of to in on for users user "
+    "people visitors customers have has had did do does is are was were".split()
+)
+# Words that change which users match; never ignored by similarity matching
+_LOGICAL_WORDS = frozenset(
+    "and or not no nor non neither never without except excluding exclude "
+    "excluded but only didn doesn don hasn haven hadn isn aren wasn weren".split()
+)
+
+
+def normalize_goal(goal: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace."""
+    text = unicodedata.normalize("NFKC", goal).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def goal_tokens(normalized_goal: str) -> FrozenSet[str]:
+    """Content tokens of a normalized goal, used for similarity matching."""
+    return frozenset(t for t in normalized_goal.split() if t not in _STOPWORDS)
+
+
+def logical_words(normalized_goal: str) -> Tuple[str, ...]:
+    """The goal's operators and negations, in order."""
+    return tuple(t for t in normalized_goal.split() if t in _LOGICAL_WORDS)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class CacheBackend(Protocol):
+    """Storage interface used by ``ResponseCache``."""
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]: ...
+
+    def set(self, key: str, scope: str, goal: str, value: Dict[str, Any]) -> None: ...
+
+    def scan(self, scope: str) -> List[Tuple[str, Dict[str, Any]]]: ...
+
+    def clear(self) -> None: ...
+
+
+class MemoryBackend:
+    """In-process LRU with a maximum size and a per-entry TTL."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[str, str, Dict[str, Any], float]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[3] <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key: str, scope: str, goal: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (scope, goal, value, self._clock() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def scan(self, scope: str) -> List[Tuple[str, Dict[str, Any]]]:
+        now = self._clock()
+        with self._lock:
+            return [
+                (goal, value)
+                for entry_scope, goal, value, expires_at in self._entries.values()
+                if entry_scope == scope and expires_at > now
+            ]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """
+    SQLite-backed cache table.
+
+    Suitable for sharing cached answers between gunicorn workers on one host
+    and for keeping them across restarts. Eviction is by TTL and then by
+    least recent use once ``max_entries`` is exceeded.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    scope TEXT NOT NULL,
+                    goal TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS response_cache_scope ON response_cache (scope)"
+            )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = self._clock()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(row[0])
+
+    def set(self, key: str, scope: str, goal: str, value: Dict[str, Any]) -> None:
+        now = self._clock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (key, scope, goal, json.dumps(value), now + self.ttl_seconds, now),
+            )
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE expires_at <= ?", (now,)
+            )
+            self._conn.execute(
+                """
+                DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM response_cache
+                    ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def scan(self, scope: str) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT goal, value FROM response_cache WHERE scope = ? AND expires_at > ?",
+                (scope, self._clock()),
+            ).fetchall()
+        return [(goal, json.loads(value)) for goal, value in rows]
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM response_cache")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[
+                0
+            ]
+
+
+class ResponseCache:
+    """
+    Exact-match and similarity cache in front of audience generation.
+
+    Args:
+        backend: Storage backend (default: ``MemoryBackend()``).
+        similarity_threshold: Minimum token-set Jaccard similarity for a
+            near-identical goal to reuse a cached answer. ``None`` (the
+            default), 0 or a value above 1 disables similarity matching.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        similarity_threshold: Optional[float] = None,
+    ):
+        self.backend: CacheBackend = backend if backend is not None else MemoryBackend()
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def scope(context_version: str, model_name: str, variant: str = "") -> str:
+        return f"{context_version}:{model_name}:{variant}"
+
+    @staticmethod
+    def key(normalized_goal: str, scope: str) -> str:
+        return hashlib.sha256(f"{scope}\n{normalized_goal}".encode("utf-8")).hexdigest()
+
+    def lookup(
+        self,
+        attribute_goal: str,
+        context_version: str,
+        model_name: str,
+        variant: str = "",
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Return a cached result for the goal, or None on a miss.
+
+        ``variant`` separates answers computed with different request options
+        (for example the sizing mode) for the same goal.
+        """
+        normalized = normalize_goal(attribute_goal)
+        scope = self.scope(context_version, model_name, variant)
+
+        value = self.backend.get(self.key(normalized, scope))
+        if value is not None:
+            self._count("exact_hits")
+            return dict(value)
+
+        threshold = self.similarity_threshold
+        if threshold and threshold <= 1:
+            tokens = goal_tokens(normalized)
+            logic = logical_words(normalized)
+            best: Optional[Dict[str, Any]] = None
+            best_score = threshold
+            for goal, candidate in self.backend.scan(scope):
+                if logical_words(goal) != logic:
+                    continue
+                score = jaccard(tokens, goal_tokens(goal))
+                if score >= best_score:
+                    best, best_score = candidate, score
+            if best is not None:
+                self._count("semantic_hits")
+                return dict(best)
+
+        self._count("misses")
+        return None
+
+    def store(
+        self,
+        attribute_goal: str,
+        context_version: str,
+        model_name: str,
+        value: Dict[str, Any],
+        variant: str = "",
+    ) -> None:
+        """Cache a finished result for the goal."""
+        normalized = normalize_goal(attribute_goal)
+        scope = self.scope(context_version, model_name, variant)
+        self.backend.set(self.key(normalized, scope), scope, normalized, value)
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the overall hit rate."""
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+def build_response_cache(agent_config) -> Optional[ResponseCache]:
+    """Build the cache described by an ``AgentConfig``, or None if disabled."""
+    backend_name = agent_config.response_cache_backend
+    backend: CacheBackend
+    if backend_name == "memory":
+        backend = MemoryBackend(
+            max_entries=agent_config.response_cache_size,
+            ttl_seconds=agent_config.response_cache_ttl_seconds,
+        )
+    elif backend_name == "sqlite":
+        backend = SQLiteBackend(
+            agent_config.response_cache_path,
+            max_entries=agent_config.response_cache_size,
+            ttl_seconds=agent_config.response_cache_ttl_seconds,
+        )
+    elif backend_name in ("none", "", None):
+        return None
+    else:
+        raise ValueError(f"Unknown response cache backend: {backend_name}")
+    return ResponseCache(backend, agent_config.response_cache_similarity)
@@ -0,0 +1,281 @@
+"""
+Visitor-level rollup of the event table for cheaper audience counts.
+
+Every raw audience count filters event rows and then deduplicates visitors.
+The rollup stores one row per (``event_date``, ``mcvisid``) with, for every
+binary event column ``c`` (values only ever 0 or 1):
+
+- ``c__max``: 1 if any of the visitor's events that day had ``c = 1``
+- ``c__min``: 0 if any of the visitor's events that day had ``c = 0``
+
+plus ``event_count``, ``first_seen`` and ``last_seen``. It is partitioned by
+``event_date`` and clustered by ``mcvisid``. When the table does not exist yet
+it is created from the whole event history, so rollup counts cover the same
+days as raw counts; after that it is refreshed one partition at a time (late
+events are picked up by re-running the last few days). The refresh must run
+at least every ``rollup_lookback_days`` days to leave no gaps.
+
+``RollupRewriter`` maps filter clauses that only test binary columns with
+``c = 1`` / ``c = 0`` (the form the prompt enforces), optionally OR-ed
+together, onto the rollup. Conditions joined by AND are not rewritten: on raw
+events they must hold on the same event, which the rollup cannot express.
+"""
+
+import argparse
+import datetime
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .base_functions import get_agent_config
+from .counting import ID_COLUMN, table_ref
+
+EVENT_DATE_COLUMN = "event_date"
+DEFAULT_PARTITION_COLUMN = "date_time"
+BINARY_TYPES = ("INTEGER", "INT64", "INT", "BOOL", "BOOLEAN")
+
+_TOKEN = re.compile(r"\s*(?:(`[^`]+`|[A-Za-z_][A-Za-z0-9_]*)|(=)|([01])\b|(\()|(\)))")
+
+
+def binary_columns(context_json, col_values_json) -> List[str]:
+    """Integer/boolean columns whose distinct values are a subset of {0, 1}."""
+    columns = []
+    for col in (context_json or {}).get("columns", []):
+        name = col.get("name", "")
+        if name == ID_COLUMN or col.get("data_type", "").upper() not in BINARY_TYPES:
+            continue
+        values = (col_values_json or {}).get(name)
+        if values and {str(v).lower() for v in values} <= {"0", "1", "true", "false"}:
+            columns.append(name)
+    return columns
+
+
+def flag_column(column: str, value: int) -> str:
+    return f"{column}__max" if value else f"{column}__min"
+
+
+def build_rollup_select(
+    source_table: str,
+    columns: Sequence[str],
+    start_date: Optional[datetime.date],
+    end_date: datetime.date,
+    partition_column: str = DEFAULT_PARTITION_COLUMN,
+    id_col: str = ID_COLUMN,
+) -> str:
+    """Rollup rows for ``[start_date, end_date]``; all history up to ``end_date``
+    when ``start_date`` is None."""
+    flags = "".join(
+        f",\n  MAX({c}) AS {flag_column(c, 1)},\n  MIN({c}) AS {flag_column(c, 0)}"
+        for c in columns
+    )
+    return (
+        f"SELECT\n  DATE({partition_column}) AS {EVENT_DATE_COLUMN},\n  {id_col},\n"
+        f"  COUNT(*) AS event_count,\n  MIN({partition_column}) AS first_seen,\n"
+        f"  MAX({partition_column}) AS last_seen{flags}\n"
+        f"FROM {source_table}\n"
+        f"WHERE {_date_range(f'DATE({partition_column})', start_date, end_date)}\n"
+        f"GROUP BY {EVENT_DATE_COLUMN}, {id_col}"
+    )
+
+
+def _date_range(
+    column: str, start_date: Optional[datetime.date], end_date: datetime.date
+) -> str:
+    if start_date is None:
+        return f"{column} <= '{end_date}'"
+    return f"{column} BETWEEN '{start_date}' AND '{end_date}'"
+
+
+def build_refresh_script(
+    source_table: str,
+    rollup_table: str,
+    columns: Sequence[str],
+    start_date: datetime.date,
+    end_date: datetime.date,
+    partition_column: str = DEFAULT_PARTITION_COLUMN,
+    id_col: str = ID_COLUMN,
+    rebuild: bool = False,
+) -> str:
+    """
+    BigQuery script replacing the rollup partitions in ``[start_date, end_date]``.
+
+    If the rollup table does not exist (or ``rebuild`` is set, which is needed
+    when binary columns were added to the schema), it is created from the
+    whole event history up to ``end_date`` instead. Partitions are swapped in
+    one transaction, so counts never see a half-refreshed day.
+    """
+    select = build_rollup_select(
+        source_table, columns, start_date, end_date, partition_column, id_col
+    )
+    backfill = build_rollup_select(
+        source_table, columns, None, end_date, partition_column, id_col
+    )
+    create = (
+        f"CREATE OR REPLACE TABLE {rollup_table}\n"
+        f"PARTITION BY {EVENT_DATE_COLUMN}\nCLUSTER BY {id_col}\n"
+        f"AS {backfill};"
+    )
+    if rebuild:
+        return create
+    dataset, table_name = rollup_table.strip("`").rsplit(".", 1)
+    # The partition swap re-runs right after a backfill; it is cheap and keeps
+    # the transaction at the top level of the script
+    return (
+        "DECLARE rollup_exists BOOL DEFAULT EXISTS (\n"
+        f"  SELECT 1 FROM `{dataset}`.INFORMATION_SCHEMA.TABLES\n"
+        f"  WHERE table_name = '{table_name}');\n"
+        f"IF NOT rollup_exists THEN\n{create}\nEND IF;\n"
+        "BEGIN TRANSACTION;\n"
+        f"DELETE FROM {rollup_table}\n"
+        f"WHERE {_date_range(EVENT_DATE_COLUMN, start_date, end_date)};\n"
+        f"INSERT INTO {rollup_table}\n{select};\n"
+        "COMMIT TRANSACTION;"
+    )
+
+
+def _tokenize(clause: str) -> Optional[List[Tuple[str, str]]]:
+    tokens = []
+    pos = 0
+    clause = clause.rstrip()
+    while pos < len(clause):
+        match = _TOKEN.match(clause, pos)
+        if not match:
+            return None
+        ident, eq, digit, lparen, rparen = match.groups()
+        if ident is not None:
+            kind = "OR" if ident.upper() == "OR" else "IDENT"
+            tokens.append((kind, ident.strip("`")))
+        elif eq:
+            tokens.append(("=", eq))
+        elif digit:
+            tokens.append(("DIGIT", digit))
+        else:
+            tokens.append(("(", "(") if lparen else (")", ")"))
+        pos = match.end()
+    return tokens
+
+
+class RollupRewriter:
+    """
+    Rewrites eligible filter clauses to run against the rollup table.
+
+    Args:
+        table: Fully qualified, quoted rollup table reference.
+        columns: Binary columns present in the rollup.
+    """
+
+    def __init__(self, table: str, columns: Iterable[str]):
+        self.table = table
+        self.columns = set(columns)
+
+    def rewrite(self, filter_clause: str) -> Optional[str]:
+        """Equivalent clause over the rollup, or None if not eligible."""
+        tokens = _tokenize(filter_clause or "")
+        if not tokens:
+            return None
+        out: List[str] = []
+        depth = 0
+        expect_term = True
+        i = 0
+        while i < len(tokens):
+            kind, value = tokens[i]
+            if expect_term and kind == "(":
+                depth += 1
+                out.append("(")
+                i += 1
+                continue
+            if expect_term:
+                atom = tokens[i : i + 3]
+                if [k for k, _ in atom] != ["IDENT", "=", "DIGIT"] or atom[0][
+                    1
+                ] not in self.columns:
+                    return None
+                out.append(f"{flag_column(atom[0][1], int(atom[2][1]))} = {atom[2][1]}")
+                expect_term = False
+                i += 3
+            elif kind == ")" and depth > 0:
+                depth -= 1
+                out.append(")")
+                i += 1
+            elif kind == "OR":
+                out.append(" OR ")
+                expect_term = True
+                i += 1
+            else:
+                return None
+        if expect_term or depth:
+            return None
+        return "".join(out)
+
+
+def rollup_table_ref(config, rollup_table: str) -> str:
+    return f"`{config.gcp.project_id}.{config.gcp.dataset_id}.{rollup_table}`"
+
+
+def refresh_rollup(
+    client,
+    config,
+    context_json,
+    col_values_json,
+    end_date: Optional[datetime.date] = None,
+    days: Optional[int] = None,
+    rebuild: bool = False,
+) -> Dict[str, Any]:
+    """
+    Rebuild the last ``days`` rollup partitions up to ``end_date`` (UTC
+    today); a missing table is backfilled from the whole history.
+    """
+    agent_config = get_agent_config(config)
+    if not agent_config.rollup_table:
+        raise ValueError("agent.rollup_table is not configured")
+    end_date = end_date or datetime.datetime.now(datetime.timezone.utc).date()
+    days = days or agent_config.rollup_lookback_days
+    start_date = end_date - datetime.timedelta(days=days - 1)
+    columns = binary_columns(context_json, col_values_json)
+    script = build_refresh_script(
+        table_ref(config),
+        rollup_table_ref(config, agent_config.rollup_table),
+        columns,
+        start_date,
+        end_date,
+        agent_config.rollup_partition_column,
+        rebuild=rebuild,
+    )
+    client.query(script).result()
+    return {
+        "start_date": str(start_date),
+        "end_date": str(end_date),
+        "binary_columns": columns,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh the visitor rollup table")
+    parser.add_argument("--end-date", type=datetime.date.fromisoformat)
+    parser.add_argument("--days", type=int, help="Partitions to refresh")
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Recreate the table from the whole history (schema change)",
+    )
+    args = parser.parse_args(argv)
+
+    from . import agent
+    from .base_functions import get_bq_client, get_config
+
+    config = get_config()
+    context_json, col_values_json, _ = agent.load_audience_context(config)
+    print(
+        refresh_rollup(
+            get_bq_client(),
+            config,
+            context_json,
+            col_values_json,
+            end_date=args.end_date,
+            days=args.days,
+            rebuild=args.rebuild,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,19 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("submit_feedback/", views.submit_feedback, name="submit_feedback"),
     path("submit_question/", views.generate_audience, name="submit_question"),
+    path(
+        "submit_question_stream/",
+        views.generate_audience_stream,
+        name="submit_question_stream",
+    ),
+    path(
+        "submit_question_async/",
+        views.generate_audience_async,
+        name="submit_question_async",
+    ),
+    path("submit_batch/", views.generate_audience_batch, name="submit_batch"),
+    path("count_jobs/<str:job_id>/", views.count_job_status, name="count_job_status"),
+    path("metrics", views.metrics_view, name="metrics"),
     path("", views.index, name="index"),
 ]
 
@@ -13,81 +13,69 @@ document.getElementById("generate-sql-button").addEventListener("click", async f
     const progressMsg = document.getElementById("progress-messages");
     document.querySelector(".query-feedback-buttons").classList.add("hidden");
     loadingIndicator.classList.remove("hidden");
-
-    // Stream messages
-    const messages = [
-        "Submitting the user input...",
-        "Reviewing the dataset schema...",
-        "Identifying relevant columns and filter logic...",
-        "Generating the audience insights..."
-    ];
-
-    let msgIndex = 0;
-    progressMsg.textContent = messages[msgIndex];
-    msgIndex++;
-
-    const messageInterval = setInterval(() => {
-        if (msgIndex < messages.length) {
-            progressMsg.textContent = messages[msgIndex];
-            msgIndex++;
-        } else {
-            clearInterval(messageInterval);
-        }
-    }, 3000);
+    progressMsg.textContent = "Submitting the user input...";
 
     // Clear previous generated attribute
     const explanationSection = document.querySelector("#attribute-explanation-section .explanation-content p");
     explanationSection.innerHTML = "";
 
+    window.attributeGoal = attributeGoal;
+
+    // Each NDJSON line is one stage of the agent; render it as soon as it arrives
+    const renderStage = (event) => {
+        if (!event.success) {
+            explanationSection.innerHTML = `Error: ${event.error || "Failed to generate attribute."}`;
+            return;
+        }
+        if (event.stage === "context") {
+            progressMsg.textContent = "Identifying relevant columns and filter logic...";
+            return;
+        }
+        window.filterClause = event.filter_clause || "";
+        window.columnsUsed = event.columns_used || [];
+        if (event.stage === "clause") {
+            // The clause arrives while the name and description are still being written
+            updateSQLBox(event);
+            updateDataSources(event);
+            progressMsg.textContent = "Counting the users in the audience...";
+            return;
+        }
+        updateExplanation(explanationSection, event);
+        updateSQLBox(event);
+        updateDataSources(event);
+        if (event.stage === "generated") {
+            progressMsg.textContent = "Checking the filter against the schema...";
+        } else if (event.stage === "validated") {
+            progressMsg.textContent = "Counting the users in the audience...";
+        } else if (event.stage === "result") {
+            updateDataBox(event);
+        }
+    };
+
     try {
         // Call backend API
-        const response = await fetch("/submit_question/", {
+        const response = await fetch("/submit_question_stream/", {
             method: "POST",
             headers: { "Content-Type": "application/json" },
             body: JSON.stringify({ attribute_goal: attributeGoal })
         });
 
-        const result = await response.json();
-
-       if (result.success) {
-            const attributeName = result.attribute_name || "";
-            const attributeDescription = result.attribute_description || "No description generated.";
-
-            window.attributeGoal = attributeGoal;
-            window.filterClause = result.filter_clause || "";
-            window.columnsUsed = result.columns_used || [];
-
-            // Clear previous content
-            explanationSection.innerHTML = "";
-
-            // Add Attribute Name
-            const nameEl = document.createElement("strong");
-            nameEl.textContent = attributeName;
-            explanationSection.appendChild(nameEl);
-
-            // Create the inner card dynamically
-            const innerCard = document.createElement("div");
-            innerCard.className = "card description-card";
-            innerCard.style.marginTop = "10px"; 
-            innerCard.style.backgroundColor = "#f9f9f9";
-            innerCard.style.border = "1px solid #d9d0d0";
-
-            // Add description text
-            const descEl = document.createElement("p");
-            descEl.textContent = attributeDescription;
-            innerCard.appendChild(descEl);
-
-            // Add the inner card below the name
-            explanationSection.appendChild(innerCard);
-          
-
+        if (!response.ok) {
+            renderStage(await response.json());
         } else {
-            explanationSection.innerHTML = `Error: ${result.error || "Failed to generate attribute."}`;
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffered = "";
+            while (true) {
+                const { done, value } = await reader.read();
+                buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+                const lines = buffered.split("\n");
+                buffered = lines.pop();
+                lines.filter(line => line.trim()).forEach(line => renderStage(JSON.parse(line)));
+                if (done) break;
+            }
         }
-        updateDataBox(result)
-        updateDataSources(result);
-        updateSQLBox(result);
-        
+
         // Show feedback buttons after generation
         document.querySelector(".query-feedback-buttons").classList.remove("hidden");
         const feedbackMsg = document.getElementById("feedback-message");
@@ -100,6 +88,34 @@ document.getElementById("generate-sql-button").addEventListener("click", async f
     }
 });
 
+function updateExplanation(explanationSection, result) {
+    const attributeName = result.attribute_name || "";
+    const attributeDescription = result.attribute_description || "No description generated.";
+
+    // Clear previous content
+    explanationSection.innerHTML = "";
+
+    // Add Attribute Name
+    const nameEl = document.createElement("strong");
+    nameEl.textContent = attributeName;
+    explanationSection.appendChild(nameEl);
+
+    // Create the inner card dynamically
+    const innerCard = document.createElement("div");
+    innerCard.className = "card description-card";
+    innerCard.style.marginTop = "10px"; 
+    innerCard.style.backgroundColor = "#f9f9f9";
+    innerCard.style.border = "1px solid #d9d0d0";
+
+    // Add description text
+    const descEl = document.createElement("p");
+    descEl.textContent = attributeDescription;
+    innerCard.appendChild(descEl);
+
+    // Add the inner card below the name
+    explanationSection.appendChild(innerCard);
+}
+
 function updateDataSources(data) {
     resetDataSources();
     const container = document.querySelector(".data-sources-grid");
@@ -146,8 +162,14 @@ function updateDataBox(data) {
     console.log('data in updateDataBox:', data.matching_users);
     const dataParagraph = document.querySelector("#audience-data .data-content p");
 
-    if (data.matching_users == 'null') {
+    if (data.validation_errors) {
+        dataParagraph.textContent = `❌The generated filter does not match the schema: ${data.validation_errors.join('; ')}`;
+    } else if (data.matching_users == 'null') {
         dataParagraph.textContent = "❌Failed to retrieve the number of users in the audience.";
+    } else if (data.sizing_mode == 'sample') {
+        dataParagraph.textContent = `The estimated number of users in the audience is ${data.matching_users} (95% range ${data.matching_users_lower} to ${data.matching_users_upper}).`;
+    } else if (data.sizing_mode == 'approx') {
+        dataParagraph.textContent = `The approximate number of users in the audience is ${data.matching_users}.`;
     } else {
         dataParagraph.textContent = `The number of users in the audience is ${data.matching_users}.`;
     }
@@ -1,6 +1,59 @@
+import os
+import threading
+import time
+
 from django.apps import AppConfig
 
 
 class UiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "ui"
+
+    def ready(self):
+        from audiences_agent.backends import install_from_config
+        from audiences_agent.base_functions import get_agent_config, get_config_provider
+
+        # `kill -HUP <pid>` re-reads config.yaml without a restart
+        get_config_provider().install_reload_signal()
+
+        agent_config = get_agent_config()
+        # Record/replay and DuckDB backends (agent.backend, agent.duckdb_parquet)
+        install_from_config(agent_config)
+        if agent_config.startup_mode == "lazy":
+            # Nothing warms up, but feedback buffered before a restart must
+            # not wait for the next submission to be sent
+            if os.path.exists(agent_config.feedback_buffer_path):
+                threading.Thread(
+                    target=start_feedback_sink, name="feedback-sink", daemon=True
+                ).start()
+        elif agent_config.startup_mode == "eager":
+            warm_up()
+        elif agent_config.startup_mode == "background":
+            # Give the server a moment to bind its port before competing for
+            # the GIL with SDK imports
+            threading.Thread(
+                target=warm_up,
+                args=(agent_config.warmup_delay_seconds,),
+                name="warm-up",
+                daemon=True,
+            ).start()
+
+
+def warm_up(delay_seconds: float = 0.0):
+    time.sleep(delay_seconds)
+    from audiences_agent.agent import warm_up as warm_up_agent
+
+    timings = warm_up_agent()
+    print(
+        "Warm-up done:",
+        ", ".join(f"{step} {seconds:.2f}s" for step, seconds in timings.items()),
+    )
+
+
+def start_feedback_sink():
+    from audiences_agent.feedback_sink import get_feedback_sink
+
+    try:
+        get_feedback_sink()
+    except Exception as e:
+        print("Error starting the feedback sink:", e)
@@ -0,0 +1,97 @@
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from audiences_agent import metrics
+
+REQUEST_ID_HEADER = "X-Request-Id"
+TRACE_HEADER = "X-Cloud-Trace-Context"
+
+
+def request_id_for(request):
+    """The caller's X-Request-Id, else the Cloud Run trace id, else a new id."""
+    request_id = request.headers.get(REQUEST_ID_HEADER)
+    if not request_id:
+        request_id = request.headers.get(TRACE_HEADER, "").split("/")[0]
+    return request_id or metrics.new_request_id()
+
+
+@sync_and_async_middleware
+def request_id_middleware(get_response):
+    """
+    Give every request an id for the structured logs, time it per view, and
+    return the id in the ``X-Request-Id`` response header. A streamed
+    response is timed until its body has been sent.
+    """
+
+    def start(request):
+        request.request_id = request_id_for(request)
+        return metrics.set_request_id(request.request_id), time.perf_counter()
+
+    def record(request, response, started):
+        seconds = time.perf_counter() - started
+        match = getattr(request, "resolver_match", None)
+        view = match.url_name if match is not None and match.url_name else "other"
+        metrics.REGISTRY.request_seconds.observe(seconds, view=view)
+        metrics.log_event(
+            "request",
+            method=request.method,
+            path=request.path,
+            view=view,
+            status=response.status_code,
+            duration_ms=round(seconds * 1000, 3),
+        )
+
+    def record_after(request, response, started):
+        # Runs when the server has sent the whole body, or closed the stream
+        token = metrics.set_request_id(request.request_id)
+        try:
+            record(request, response, started)
+        finally:
+            metrics.reset_request_id(token)
+
+    def timed_stream(content, request, response, started):
+        try:
+            yield from metrics.bind_request_id(content, request.request_id)
+        finally:
+            record_after(request, response, started)
+
+    async def timed_async_stream(content, request, response, started):
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            record_after(request, response, started)
+
+    def finish(request, response, token, started):
+        response[REQUEST_ID_HEADER] = request.request_id
+        if not response.streaming:
+            record(request, response, started)
+        elif getattr(response, "is_async", False):
+            response.streaming_content = timed_async_stream(
+                response.streaming_content, request, response, started
+            )
+        else:
+            # Streamed bodies are produced after the view returned
+            response.streaming_content = timed_stream(
+                response.streaming_content, request, response, started
+            )
+        metrics.reset_request_id(token)
+        return response
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            token, started = start(request)
+            response = await get_response(request)
+            return finish(request, response, token, started)
+
+    else:
+
+        def middleware(request):
+            token, started = start(request)
+            response = get_response(request)
+            return finish(request, response, token, started)
+
+    return middleware
@@ -1,38 +1,65 @@
 from django.shortcuts import render
-from django.http import JsonResponse, StreamingHttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from django.utils.timezone import now
-import pandas as pd
 import json
-from google.cloud import bigquery
 import sys
 import os
-from my_function.config import FunctionConfig
 
-# Load config from YAML
-config = FunctionConfig.from_yaml("config.yaml")
-# Add current directory to path to import your agent
+# Add current directory to path to import your agent. The agent modules are
+# cheap to import: the Google SDKs, the BigQuery client and config.yaml are
+# loaded on first use, or by the warm-up thread started in UiConfig.ready()
 sys.path.append(os.getcwd())
 agent = __import__("audiences_agent.agent", fromlist=["*"])
+async_agent = __import__("audiences_agent.async_agent", fromlist=["*"])
+batch = __import__("audiences_agent.batch", fromlist=["*"])
+counting = __import__("audiences_agent.counting", fromlist=["*"])
+feedback_sink = __import__("audiences_agent.feedback_sink", fromlist=["*"])
+metrics = __import__("audiences_agent.metrics", fromlist=["*"])
+query_executor_module = __import__("audiences_agent.query_executor", fromlist=["*"])
 
-# Initialize BigQuery client
-client = bigquery.Client(project=config.gcp.project_id)
+MAX_BATCH_GOALS = 500
+get_config = agent.get_config
+
+# Shared BigQuery client, created on first use
+get_client = agent.get_bq_client
 
 # Load your agent
 audience_agent = agent.run_audience_agent
 
 
+def sizing_mode_error(sizing_mode):
+    """400 response for an unknown ``sizing_mode``; None if it is usable."""
+    if sizing_mode is None or sizing_mode in counting.SIZING_MODES:
+        return None
+    return JsonResponse(
+        {"error": f"sizing_mode must be one of {', '.join(counting.SIZING_MODES)}"},
+        status=400,
+    )
+
+
+def request_user(request):
+    """Who a request's query bytes are charged to (IAP identity or client IP)."""
+    # Without IAP in front, the header is whatever the client chose to send
+    if agent.get_agent_config().iap_fronted:
+        user = request.headers.get("X-Goog-Authenticated-User-Email")
+        if user:
+            return user
+    return request.META.get("REMOTE_ADDR")
+
+
 # Function to dry run SQL query in BQ
-def run_sql_query(sql_query, max_bytes_gb=500):
+def run_sql_query(sql_query, max_bytes_gb=500, user=None):
+    # Dry run, budget check and maximum_bytes_billed via the shared executor
+    query_executor = agent.get_query_executor()
     try:
-        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
-        query_job = client.query(sql_query, job_config=job_config)
-        bytes_processed = query_job.total_bytes_processed
-        max_bytes = max_bytes_gb * (1024**3)
-        if bytes_processed <= max_bytes:
-            return client.query(sql_query).to_dataframe()
-        else:
-            return f"Query exceeds {max_bytes_gb} GB limit (processed: {bytes_processed} bytes)."
+        query_job = query_executor.query(
+            get_client(), sql_query, user=user, max_bytes=int(max_bytes_gb * 1024**3)
+        )
+        # to_dataframe() imports pandas on first use only
+        return query_job.to_dataframe()
+    except query_executor_module.QueryBudgetError as e:
+        return f"Query exceeds {max_bytes_gb} GB limit (processed: {e.estimated_bytes} bytes)."
     except Exception as e:
         return f"There was a problem executing the generated SQL query. Error: {e}"
 
@@ -55,10 +82,17 @@ def generate_audience(request):
 
         if not attribute_goal:
             return JsonResponse({"error": "Missing attribute goal"}, status=400)
+        sizing_mode = data.get("sizing_mode")
+        error = sizing_mode_error(sizing_mode)
+        if error:
+            return error
 
-        # Call your agent function
+        # "count": "background" returns the clause now with a count_job to poll
         result = audience_agent(
-            attribute_goal
+            attribute_goal,
+            sizing_mode=sizing_mode,
+            user=request_user(request),
+            background_count=data.get("count") == "background",
         )  # Should return dict with filter_clause, columns_used, matching_users
 
         return JsonResponse({"success": True, **result})
@@ -70,9 +104,139 @@ def generate_audience(request):
         return JsonResponse({"success": False, "error": str(e)}, status=500)
 
 
+@csrf_exempt
+def generate_audience_stream(request):
+    """Generate an audience, streaming each stage back as NDJSON."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError as e:
+        return JsonResponse({"success": False, "error": str(e)}, status=400)
+
+    attribute_goal = data.get("attribute_goal", "")
+    if not attribute_goal:
+        return JsonResponse({"error": "Missing attribute goal"}, status=400)
+    sizing_mode = data.get("sizing_mode")
+    error = sizing_mode_error(sizing_mode)
+    if error:
+        return error
+
+    user = request_user(request)
+    background_count = data.get("count") == "background"
+
+    def stream():
+        try:
+            for event in agent.stream_audience_agent(
+                attribute_goal,
+                sizing_mode=sizing_mode,
+                user=user,
+                background_count=background_count,
+            ):
+                yield json.dumps({"success": True, **event}) + "\n"
+        except Exception as e:
+            import logging
+
+            logging.exception("submit_question_stream failed")
+            error = {"stage": "error", "success": False, "error": str(e)}
+            yield json.dumps(error) + "\n"
+
+    response = StreamingHttpResponse(stream(), content_type="application/x-ndjson")
+    # Stop reverse proxies from holding events back until the end
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def generate_audience_async(request):
+    """Generate audience without blocking the event loop (serve under ASGI)."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        attribute_goal = data.get("attribute_goal", "")
+
+        if not attribute_goal:
+            return JsonResponse({"error": "Missing attribute goal"}, status=400)
+        sizing_mode = data.get("sizing_mode")
+        error = sizing_mode_error(sizing_mode)
+        if error:
+            return error
+
+        result = await async_agent.arun_audience_agent(
+            attribute_goal, sizing_mode=sizing_mode, user=request_user(request)
+        )
+
+        return JsonResponse({"success": True, **result})
+
+    except Exception as e:
+        import logging
+
+        logging.exception("submit_question_async failed")
+        return JsonResponse({"success": False, "error": str(e)}, status=500)
+
+
+# Set directly: csrf_exempt() only keeps coroutine views async from Django 5.0
+generate_audience_async.csrf_exempt = True  # type: ignore[attr-defined]
+
+
+@csrf_exempt
+def generate_audience_batch(request):
+    """Generate audiences for many goals, streamed back as NDJSON."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError as e:
+        return JsonResponse({"success": False, "error": str(e)}, status=400)
+
+    attribute_goals = data.get("attribute_goals", [])
+    if not isinstance(attribute_goals, list) or not attribute_goals:
+        return JsonResponse({"error": "Missing attribute goals"}, status=400)
+    if len(attribute_goals) > MAX_BATCH_GOALS:
+        return JsonResponse(
+            {"error": f"At most {MAX_BATCH_GOALS} attribute goals per batch"},
+            status=400,
+        )
+    sizing_mode = data.get("sizing_mode")
+    error = sizing_mode_error(sizing_mode)
+    if error:
+        return error
+
+    user = request_user(request)
+
+    def stream():
+        try:
+            for item in batch.run_audience_batch(
+                attribute_goals, sizing_mode=sizing_mode, user=user
+            ):
+                yield json.dumps(item) + "\n"
+        except Exception as e:
+            import logging
+
+            logging.exception("submit_batch failed")
+            yield json.dumps({"success": False, "error": str(e)}) + "\n"
+
+    return StreamingHttpResponse(stream(), content_type="application/x-ndjson")
+
+
+def count_job_status(request, job_id):
+    """Poll a background count started with ``"count": "background"``."""
+    if request.method != "GET":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    status = agent.get_count_jobs().status(job_id)
+    if status is None:
+        return JsonResponse({"error": "Unknown or expired count job"}, status=404)
+    return JsonResponse({"success": True, **status})
+
+
 @csrf_exempt
 def submit_feedback(request):
-    """Store user feedback in BigQuery."""
+    """Queue user feedback for BigQuery."""
     if request.method != "POST":
         return JsonResponse({"error": "Invalid request method"}, status=405)
 
@@ -87,22 +251,17 @@ def submit_feedback(request):
         if not (attribute_goal and filter_clause):
             return JsonResponse({"error": "Missing required fields"}, status=400)
 
-        # Prepare row for BigQuery
-        feedback_df = pd.DataFrame(
-            {
-                "attribute_goal": [attribute_goal],
-                "filter_clause": [filter_clause],
-                "columns_used": [columns_used],
-                "approved": [approved],
-                "feedback_text": [feedback_text],
-            }
-        )
-
-        feedback_table = config.gcp.feedback_table
-        job_config = bigquery.LoadJobConfig(write_disposition="WRITE_APPEND")
-        client.load_table_from_dataframe(
-            feedback_df, feedback_table, job_config=job_config
-        ).result()
+        # Buffered locally and streamed to BigQuery in batches
+        with metrics.span("feedback_submit"):
+            feedback_sink.get_feedback_sink().submit(
+                {
+                    "attribute_goal": attribute_goal,
+                    "filter_clause": filter_clause,
+                    "columns_used": columns_used,
+                    "approved": approved,
+                    "feedback_text": feedback_text,
+                }
+            )
 
         return JsonResponse(
             {"success": True, "message": "Feedback recorded successfully"}
@@ -110,3 +269,10 @@ def submit_feedback(request):
 
     except Exception as e:
         return JsonResponse({"success": False, "error": str(e)}, status=500)
+
+
+def metrics_view(request):
+    """Stage and request latency histograms in Prometheus text format."""
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
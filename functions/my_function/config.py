@@ -5,9 +5,98 @@ This module shows how to handle configuration for your function using
 environment variables (.env) or YAML configuration files (config.yaml).
 """
 
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, Optional
 import os
+import signal
+import threading
+
+
+@dataclass
+class GcpConfig:
+    """
+    The ``gcp`` section of config.yaml.
+
+    Holds the project, table and GCS locations the audience agent reads.
+    Unknown keys in the YAML section are ignored.
+    """
+
+    project_id: str = ""
+    region: str = ""
+    dataset_id: str = ""
+    table_name: str = ""
+    bucket_name: str = ""
+    schema_blob_name: str = ""
+    col_values_blob_name: str = ""
+    ai_model: str = ""
+    feedback_table: str = ""
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "GcpConfig":
+        """Build a GcpConfig from a mapping, keeping only known fields."""
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in known})
+
+
+@dataclass
+class AgentConfig:
+    """
+    The ``agent`` section of config.yaml: tuning knobs for the audience agent.
+
+    Every field has a default, so the section can be omitted entirely.
+    """
+
+    response_cache_backend: str = "memory"
+    response_cache_path: str = "response_cache.sqlite3"
+    response_cache_size: int = 1024
+    response_cache_ttl_seconds: float = 3600.0
+    response_cache_similarity: float = 0.0
+    sizing_mode: str = "exact"
+    sample_percent: float = 1.0
+    rollup_table: str = ""
+    rollup_partition_column: str = "date_time"
+    rollup_lookback_days: int = 3
+    feedback_buffer_path: str = "feedback_buffer.sqlite3"
+    feedback_batch_size: int = 500
+    feedback_flush_seconds: float = 5.0
+    startup_mode: str = "background"
+    query_max_gb: float = 500.0
+    user_daily_budget_gb: float = 0.0
+    dry_run_cache_ttl_seconds: float = 600.0
+    iap_fronted: bool = False
+    warmup_delay_seconds: float = 1.0
+    clause_validation: str = "repair"
+    count_workers: int = 4
+    count_job_ttl_seconds: float = 600.0
+    backend: str = "gcp"
+    backend_dir: str = "offline"
+    duckdb_parquet: str = ""
+    llm_max_attempts: int = 4
+    llm_backoff_seconds: float = 0.5
+    llm_attempt_timeout_seconds: float = 60.0
+    llm_hedge_percentile: float = 0.0
+    llm_breaker_failures: int = 5
+    llm_breaker_reset_seconds: float = 30.0
+    llm_requests_per_minute: float = 0.0
+    llm_tokens_per_minute: float = 0.0
+    llm_max_concurrency: int = 0
+    llm_rate_limit_backend: str = "thread"
+    llm_rate_limit_path: str = "llm_rate_limit.state"
+    llm_rate_limit_max_wait_seconds: float = 30.0
+    llm_streaming: bool = False
+    context_token_budget: int = 0
+    context_full_columns: int = 20
+    context_truncated_values: int = 10
+    column_top_k: int = 0
+    column_embedding: str = "hashing"
+    column_embedding_model: str = "text-embedding-005"
+    column_index_dir: str = "column_index"
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "AgentConfig":
+        """Build an AgentConfig from a mapping, keeping only known fields."""
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in known})
 
 
 @dataclass
@@ -31,6 +120,8 @@ class FunctionConfig:
     table_name: str
     batch_size: int = 100
     timeout_seconds: Optional[int] = None
+    gcp: GcpConfig = field(default_factory=GcpConfig)
+    agent: AgentConfig = field(default_factory=AgentConfig)
 
     @classmethod
     def from_env(cls) -> "FunctionConfig":
@@ -51,16 +142,22 @@ class FunctionConfig:
             >>> # Create a .env file with your configuration
             >>> config = FunctionConfig.from_env()
         """
+        project_id = os.environ.get("GCP_PROJECT_ID", "")
+        dataset_id = os.environ.get("DATASET_ID", "")
+        table_name = os.environ.get("TABLE_ID", "")
         return cls(
-            project_id=os.environ.get("GCP_PROJECT_ID", ""),
-            dataset_id=os.environ.get("DATASET_ID", ""),
-            table_name=os.environ.get("TABLE_ID", ""),
+            project_id=project_id,
+            dataset_id=dataset_id,
+            table_name=table_name,
             batch_size=int(os.environ.get("BATCH_SIZE", "100")),
             timeout_seconds=(
                 int(os.environ["TIMEOUT_SECONDS"])
                 if "TIMEOUT_SECONDS" in os.environ
                 else None
             ),
+            gcp=GcpConfig(
+                project_id=project_id, dataset_id=dataset_id, table_name=table_name
+            ),
         )
 
     @classmethod
@@ -84,10 +181,73 @@ class FunctionConfig:
             data = yaml.safe_load(f)
 
         gcp = data.get("gcp", {})
-        # processing = data.get("processing", {})
+        processing = data.get("processing", {})
 
         return cls(
             project_id=gcp.get("project_id", ""),
             dataset_id=gcp.get("dataset_id", ""),
             table_name=gcp.get("table_name", ""),
+            batch_size=int(processing.get("batch_size", 100)),
+            timeout_seconds=processing.get("timeout_seconds"),
+            gcp=GcpConfig.from_dict(gcp),
+            agent=AgentConfig.from_dict(data.get("agent", {})),
         )
+
+
+class ConfigProvider:
+    """
+    Process-wide, lazily loaded FunctionConfig.
+
+    The YAML file is parsed on first access and again only when its mtime
+    changes or ``reload()`` is called (for example from a SIGHUP handler).
+
+    Args:
+        config_path: Path to YAML config file (default: config.yaml)
+
+    Example:
+        >>> provider = ConfigProvider("config.yaml")
+        >>> provider.gcp.bucket_name
+    """
+
+    def __init__(self, config_path: str = "config.yaml"):
+        self.config_path = config_path
+        self._config: Optional[FunctionConfig] = None
+        self._mtime_ns: Optional[int] = None
+        self._stale = False
+        self._lock = threading.Lock()
+
+    def get(self) -> FunctionConfig:
+        """Return the current config, reloading it if the file changed."""
+        mtime_ns = os.stat(self.config_path).st_mtime_ns
+        config = self._config
+        if config is not None and not self._stale and mtime_ns == self._mtime_ns:
+            return config
+
+        with self._lock:
+            if self._config is None or self._stale or mtime_ns != self._mtime_ns:
+                self._config = FunctionConfig.from_yaml(self.config_path)
+                self._mtime_ns = mtime_ns
+                self._stale = False
+            return self._config
+
+    @property
+    def gcp(self) -> GcpConfig:
+        """Typed access to the ``gcp`` section."""
+        return self.get().gcp
+
+    def reload(self) -> None:
+        """Force the next ``get()`` to re-read the file."""
+        self._stale = True
+
+    def install_reload_signal(self, signum: int = signal.SIGHUP) -> bool:
+        """
+        Reload the config when the process receives ``signum``.
+
+        Signal handlers can only be installed from the main thread; returns
+        False when that is not possible.
+        """
+        try:
+            signal.signal(signum, lambda *_: self.reload())
+        except ValueError:
+            return False
+        return True
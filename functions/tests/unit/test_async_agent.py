@@ -0,0 +1,118 @@
+import asyncio
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from my_function.audiences_app.audiences_agent import async_agent
+
+
+@pytest.fixture
+def mock_config():
+    mock = MagicMock()
+    mock.gcp.project_id = "syntasa-saas"
+    mock.gcp.dataset_id = "ccdp_demo"
+    mock.gcp.table_name = "web_tb_event"
+    mock.gcp.bucket_name = "syntasa-saas"
+    mock.gcp.schema_blob_name = "schema.json"
+    mock.gcp.col_values_blob_name = "values.json"
+    return mock
+
+
+BLOBS = {
+    "schema.json": {"columns": [{"name": "age", "data_type": "INTEGER"}]},
+    "values.json": {"age": [20, 25, 30]},
+}
+RESPONSE = (
+    '{"filter_clause": "age > 25", "columns_used": ["age"], '
+    '"attribute_name": "Older users", "attribute_description": "Users older than 25"}'
+)
+
+
+@patch.object(async_agent, "QUERY_POLL_INITIAL_SECONDS", 0)
+@patch.object(async_agent, "generate_async", new_callable=AsyncMock)
+@patch.object(async_agent.agent, "load_context_from_gcs")
+def test_arun_audience_agent_polls_count_job(
+    mock_load_context, mock_generate, mock_config
+):
+    mock_load_context.side_effect = lambda bucket, blob: BLOBS[blob]
+    mock_generate.return_value = RESPONSE
+    query_job = MagicMock()
+    query_job.done.side_effect = [False, False, True]
+    query_job.result.return_value = [{"matching_users": 42}]
+    client = MagicMock()
+    client.query.return_value = query_job
+
+    result = asyncio.run(
+        async_agent.arun_audience_agent(
+            "Find users older than 25",
+            config=mock_config,
+            client=client,
+            use_cache=False,
+        )
+    )
+
+    assert result["filter_clause"] == "age > 25"
+    assert result["matching_users"] == 42
+    assert query_job.done.call_count == 3
+    assert "WHERE age > 25" in client.query.call_args.args[0]
+
+
+@patch.object(async_agent, "generate_async", new_callable=AsyncMock)
+@patch.object(async_agent.agent, "load_context_from_gcs")
+def test_arun_audience_agent_count_failure(
+    mock_load_context, mock_generate, mock_config
+):
+    mock_load_context.side_effect = lambda bucket, blob: BLOBS[blob]
+    mock_generate.return_value = RESPONSE
+    client = MagicMock()
+    client.query.side_effect = Exception("BigQuery error")
+
+    result = asyncio.run(
+        async_agent.arun_audience_agent(
+            "BQ error test", config=mock_config, client=client, use_cache=False
+        )
+    )
+
+    assert result["filter_clause"] == "age > 25"
+    assert result["matching_users"] is None
+
+
+@patch.object(async_agent, "generate_async", new_callable=AsyncMock)
+@patch.object(async_agent.agent, "load_context_from_gcs")
+def test_arun_audience_agent_keeps_client_and_cache_io_off_the_loop(
+    mock_load_context, mock_generate, mock_config
+):
+    mock_load_context.side_effect = lambda bucket, blob: BLOBS[blob]
+    mock_generate.return_value = RESPONSE
+    threads = {}
+
+    def record(name, value=None):
+        def call(*args, **kwargs):
+            threads[name] = threading.get_ident()
+            return value
+
+        return call
+
+    query_job = MagicMock()
+    query_job.result.return_value = [{"matching_users": 42}]
+    client = MagicMock()
+    client.query.return_value = query_job
+    cache = MagicMock()
+    cache.lookup.side_effect = record("lookup")
+    cache.store.side_effect = record("store")
+
+    async def run():
+        threads["loop"] = threading.get_ident()
+        return await async_agent.arun_audience_agent("Older users", config=mock_config)
+
+    with patch.object(
+        async_agent, "get_bq_client", side_effect=record("client", client)
+    ), patch.object(
+        async_agent.agent, "get_response_cache", side_effect=record("cache", cache)
+    ):
+        result = asyncio.run(run())
+
+    assert result["matching_users"] == 42
+    assert set(threads) == {"loop", "client", "cache", "lookup", "store"}
+    assert all(t != threads["loop"] for name, t in threads.items() if name != "loop")
@@ -0,0 +1,160 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from my_function.audiences_app.audiences_agent import agent, backends, base_functions
+from my_function.audiences_app.audiences_agent.backends import (
+    RecordingLLM,
+    RecordingObjectStore,
+    RecordingWarehouse,
+    ReplayLLM,
+    ReplayMissError,
+    ReplayWarehouse,
+    replay_object_store,
+)
+from my_function.audiences_app.audiences_agent.context_cache import LocalObjectStore
+
+CONFIG = SimpleNamespace(
+    gcp=SimpleNamespace(
+        project_id="p",
+        dataset_id="d",
+        table_name="events",
+        bucket_name="bucket",
+        schema_blob_name="ctx/schema.json",
+        col_values_blob_name="ctx/values.json",
+        ai_model="gemini-test",
+    )
+)
+DEFINITION = {
+    "filter_clause": "cart_add = 1",
+    "columns_used": ["cart_add"],
+    "attribute_name": "Carts",
+    "attribute_description": "Users who added to cart",
+}
+
+
+@pytest.fixture(autouse=True)
+def isolated_backends():
+    with patch.object(base_functions, "_llm_backend", None), patch.object(
+        base_functions, "_bq_client", None
+    ), patch.object(agent, "_context_cache", None), patch.object(
+        backends, "get_config", return_value=CONFIG
+    ):
+        yield
+
+
+def test_llm_record_then_replay(tmp_path):
+    inner = MagicMock()
+    inner.generate.return_value = '{"ok": true}'
+    recorder = RecordingLLM(str(tmp_path), inner)
+
+    assert recorder.generate("prompt", {"type": "object"}) == '{"ok": true}'
+
+    replay = ReplayLLM(str(tmp_path))
+    assert replay.generate("prompt", {"type": "object"}) == '{"ok": true}'
+    with pytest.raises(ReplayMissError):
+        replay.generate("prompt", None)
+
+
+def test_object_store_recording_is_a_local_store(tmp_path):
+    source = tmp_path / "source"
+    (source / "bucket" / "ctx").mkdir(parents=True)
+    (source / "bucket" / "ctx" / "schema.json").write_text('{"columns": []}')
+    recorder = RecordingObjectStore(
+        str(tmp_path / "rec"), LocalObjectStore(str(source))
+    )
+
+    recorder.download_text("bucket", "ctx/schema.json")
+
+    content, _ = replay_object_store(str(tmp_path / "rec")).download_text(
+        "bucket", "ctx/schema.json"
+    )
+    assert content == '{"columns": []}'
+
+
+def test_warehouse_record_then_replay_keeps_rows_and_bytes(tmp_path):
+    inner = MagicMock()
+    inner.query.return_value.result.return_value = [{"matching_users": 42}]
+    inner.query.return_value.total_bytes_processed = 1024
+    RecordingWarehouse(str(tmp_path), inner).query("SELECT 1  AS x")
+
+    job = ReplayWarehouse(str(tmp_path)).query("SELECT 1\n AS x")
+
+    assert list(job.result()) == [{"matching_users": 42}]
+    assert job.total_bytes_processed == 1024
+    assert job.done()
+    with pytest.raises(ReplayMissError):
+        ReplayWarehouse(str(tmp_path)).query(
+            "SELECT 1 AS x", job_config=SimpleNamespace(dry_run=True)
+        )
+
+
+def test_replayed_run_is_offline_and_deterministic(tmp_path):
+    store = tmp_path / "objects" / "bucket" / "ctx"
+    store.mkdir(parents=True)
+    (store / "schema.json").write_text(
+        json.dumps({"columns": [{"name": "cart_add", "data_type": "INTEGER"}]})
+    )
+    (store / "values.json").write_text(json.dumps({"cart_add": [0, 1]}))
+    llm, warehouse = MagicMock(), MagicMock()
+    llm.generate.return_value = json.dumps(DEFINITION)
+    warehouse.query.return_value.result.return_value = [{"matching_users": 7}]
+    warehouse.query.return_value.total_bytes_processed = 10
+
+    backends.install(
+        llm=RecordingLLM(str(tmp_path), llm),
+        object_store=replay_object_store(str(tmp_path)),
+        warehouse=RecordingWarehouse(str(tmp_path), warehouse),
+    )
+    recorded = agent.run_audience_agent("carts", CONFIG, use_cache=False)
+    backends.install(**backends.build_backends("replay", str(tmp_path)))
+    replayed = agent.run_audience_agent("carts", CONFIG, use_cache=False)
+
+    assert replayed == recorded
+    assert replayed["matching_users"] == 7
+
+
+def test_duckdb_warehouse_counts_on_parquet(tmp_path):
+    duckdb = pytest.importorskip("duckdb")
+    parquet = tmp_path / "events.parquet"
+    duckdb.connect().execute(
+        "COPY (SELECT 'v' || (i % 5) AS mcvisid, CAST(i % 2 AS INTEGER) AS cart_add,"
+        " 'it''s' AS note FROM range(20) t(i)) "
+        f"TO '{parquet}' (FORMAT parquet)"
+    )
+    warehouse = backends.DuckDBWarehouse({"p.d.events": str(parquet)})
+    sql = (
+        "SELECT COUNT(DISTINCT IF((`cart_add` = 1), mcvisid, NULL)) as matching_users "
+        "FROM `p.d.events` WHERE note != '`p.d.events`'"
+    )
+
+    rows = list(warehouse.query(sql).result())
+    dry = warehouse.query(sql, job_config=SimpleNamespace(dry_run=True))
+
+    assert rows == [{"matching_users": 5}]
+    assert "'`p.d.events`'" in warehouse.translate(sql)
+    assert dry.total_bytes_processed == parquet.stat().st_size
+    assert list(dry.result()) == []
+
+
+def test_sample_counts_run_on_the_duckdb_warehouse(tmp_path, monkeypatch):
+    duckdb = pytest.importorskip("duckdb")
+    monkeypatch.setattr(agent, "_query_executor", None)
+    parquet = tmp_path / "events.parquet"
+    duckdb.connect().execute(
+        "COPY (SELECT 'v' || i AS mcvisid, CAST(i % 2 AS INTEGER) AS cart_add"
+        " FROM range(2000) t(i)) "
+        f"TO '{parquet}' (FORMAT parquet)"
+    )
+    warehouse = backends.DuckDBWarehouse({"p.d.events": str(parquet)})
+
+    size = agent.count_matching_users(
+        warehouse, CONFIG, "cart_add = 1", sizing_mode="sample", sample_percent=50
+    )
+
+    assert RecordingWarehouse(str(tmp_path / "rec"), warehouse).dialect == "duckdb"
+    assert size.count_error is None
+    assert size.matching_users is not None
+    assert size.matching_users_lower <= 1000 <= size.matching_users_upper
@@ -0,0 +1,140 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from my_function.audiences_app.audiences_agent import agent
+from my_function.audiences_app.audiences_agent.batch import run_audience_batch
+
+BLOBS = {
+    "schema.json": {
+        "columns": [
+            {"name": "cart_add", "data_type": "INTEGER"},
+            {"name": "product_view", "data_type": "INTEGER"},
+        ]
+    },
+    "values.json": {"cart_add": [0, 1], "product_view": [0, 1]},
+}
+CLAUSES = {
+    "cart adders": "cart_add = 1",
+    "product viewers": "product_view = 1",
+    "no clause": "",
+    "unknown column": "basket_size > 2",
+}
+
+
+@pytest.fixture(autouse=True)
+def fresh_query_executor(monkeypatch):
+    # Dry-run estimates are cached per SQL; start each test with none
+    monkeypatch.setattr(agent, "_query_executor", None)
+
+
+def count_queries(client):
+    return [
+        c.args[0]
+        for c in client.query.call_args_list
+        if not c.kwargs["job_config"].dry_run
+    ]
+
+
+@pytest.fixture
+def mock_config():
+    mock = MagicMock()
+    mock.gcp.project_id = "syntasa-saas"
+    mock.gcp.dataset_id = "ccdp_demo"
+    mock.gcp.table_name = "web_tb_event"
+    mock.gcp.schema_blob_name = "schema.json"
+    mock.gcp.col_values_blob_name = "values.json"
+    return mock
+
+
+def fake_generate(prompt, response_schema=None):
+    for goal, clause in CLAUSES.items():
+        if f"**User Question**: {goal}\n" in prompt:
+            return json.dumps(
+                {
+                    "filter_clause": clause,
+                    "columns_used": [clause.split(" ")[0]] if clause else [],
+                    "attribute_name": goal,
+                    "attribute_description": goal,
+                }
+            )
+    raise RuntimeError("Gemini unavailable")
+
+
+@patch.object(agent, "generate", side_effect=fake_generate)
+@patch.object(agent, "load_context_from_gcs")
+def test_batch_counts_in_one_job_with_per_item_errors(
+    mock_load_context, mock_generate, mock_config
+):
+    mock_load_context.side_effect = lambda bucket_name, blob_name: BLOBS[blob_name]
+    client = MagicMock()
+    client.query.return_value.result.return_value = [{"aud_0": 10, "aud_1": 20}]
+
+    goals = [
+        "cart adders",
+        "broken goal",
+        "product viewers",
+        "no clause",
+        "unknown column",
+    ]
+    results = list(
+        run_audience_batch(
+            goals, config=mock_config, client=client, max_concurrency=1, use_cache=False
+        )
+    )
+    by_goal = {r["attribute_goal"]: r for r in results}
+
+    assert mock_load_context.call_count == 2
+    assert len(count_queries(client)) == 1
+    query = count_queries(client)[0]
+    assert "COUNT(DISTINCT IF((cart_add = 1), mcvisid, NULL)) AS aud_0" in query
+    assert "COUNT(DISTINCT IF((product_view = 1), mcvisid, NULL)) AS aud_1" in query
+
+    assert by_goal["cart adders"]["matching_users"] == 10
+    assert by_goal["product viewers"]["matching_users"] == 20
+    assert by_goal["cart adders"]["success"] is True
+    assert "error" not in by_goal["cart adders"]
+    assert by_goal["no clause"]["matching_users"] is None
+    assert by_goal["no clause"]["success"] is False
+    assert "no usable filter clause" in by_goal["no clause"]["error"]
+    assert by_goal["unknown column"]["success"] is False
+    assert "basket_size" in by_goal["unknown column"]["error"]
+    assert by_goal["broken goal"]["success"] is False
+    assert "Gemini unavailable" in by_goal["broken goal"]["error"]
+    assert sorted(r["index"] for r in results) == [0, 1, 2, 3, 4]
+
+
+@patch.object(agent, "generate", side_effect=fake_generate)
+@patch.object(agent, "load_context_from_gcs")
+def test_batch_falls_back_to_single_counts(
+    mock_load_context, mock_generate, mock_config
+):
+    mock_load_context.side_effect = lambda bucket_name, blob_name: BLOBS[blob_name]
+    ok = MagicMock()
+    ok.result.return_value = [{"aud_0": 10}]
+    client = MagicMock()
+    # The combined query and the bad clause already fail their dry run
+    client.query.side_effect = [
+        Exception("Unrecognized name"),
+        MagicMock(),
+        ok,
+        Exception("Unrecognized name"),
+    ]
+
+    results = list(
+        run_audience_batch(
+            ["cart adders", "product viewers"],
+            config=mock_config,
+            client=client,
+            max_concurrency=1,
+            use_cache=False,
+        )
+    )
+    by_goal = {r["attribute_goal"]: r for r in results}
+
+    assert by_goal["cart adders"]["matching_users"] == 10
+    assert by_goal["cart adders"]["success"] is True
+    assert by_goal["product viewers"]["matching_users"] is None
+    assert by_goal["product viewers"]["success"] is False
+    assert by_goal["product viewers"]["error"] == "Count query failed"
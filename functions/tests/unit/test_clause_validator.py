@@ -0,0 +1,170 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from my_function.audiences_app.audiences_agent import agent
+from my_function.audiences_app.audiences_agent.clause_validator import (
+    ColumnIndex,
+    validate_clause,
+)
+
+SCHEMA = {
+    "columns": [
+        {"name": "mcvisid", "data_type": "STRING"},
+        {"name": "age", "data_type": "INTEGER"},
+        {"name": "country", "data_type": "STRING"},
+        {"name": "pagename", "data_type": "STRING"},
+        {"name": "cart_add", "data_type": "INTEGER"},
+        {"name": "date_time", "data_type": "DATETIME"},
+        {"name": "is_new", "data_type": "BOOL"},
+    ]
+}
+INDEX = ColumnIndex.from_context(SCHEMA, ["cart_add"])
+
+
+@pytest.mark.parametrize(
+    "clause, columns",
+    [
+        ("age > 25", ["age"]),
+        ("cart_add = 1 OR LOWER(pagename) LIKE '%cart%'", ["cart_add", "pagename"]),
+        (
+            "date_time >= DATETIME_SUB(CURRENT_DATETIME(), INTERVAL 30 DAY)",
+            ["date_time"],
+        ),
+        ("EXTRACT(DAYOFWEEK FROM date_time) IN (1, 7)", ["date_time"]),
+        ("country IN ('US', 'CA') AND NOT is_new", ["country", "is_new"]),
+        ("CAST(age AS STRING) = '30' AND `country` != \"it's\"", ["age", "country"]),
+    ],
+)
+def test_valid_clauses_pass_unchanged(clause, columns):
+    result = validate_clause(clause, columns, INDEX)
+
+    assert result.valid, result.errors
+    assert result.filter_clause == clause
+    assert result.columns_used == columns
+    assert result.repairs == []
+
+
+@pytest.mark.parametrize(
+    "clause, error",
+    [
+        ("(age > 25", "Unbalanced"),
+        ("country = 'US", "Unterminated string"),
+        ("age > 1; DROP TABLE t", "Unexpected character"),
+        ("browser = 'chrome'", "Unknown column 'browser'"),
+        ("age = 'thirty'", "numeric column 'age'"),
+        ("is_new = 1", "BOOL column 'is_new'"),
+        ("age LIKE '3%'", "LIKE needs a STRING"),
+        ("cart_add > 2", "Binary column 'cart_add'"),
+    ],
+)
+def test_invalid_clauses_are_rejected(clause, error):
+    result = validate_clause(clause, ["age"], INDEX)
+
+    assert not result.valid
+    assert any(error in e for e in result.errors), result.errors
+
+
+@pytest.mark.parametrize(
+    "clause, stripped",
+    [
+        (
+            "country = 'US' -- landing page visitors\n AND age > 2",
+            "country = 'US'  \n AND age > 2",
+        ),
+        ("country = 'US' /* note */ AND age > 2", "country = 'US'   AND age > 2"),
+        (
+            "country = '-- not /* a comment' AND age > 2 # trailing",
+            "country = '-- not /* a comment' AND age > 2",
+        ),
+    ],
+)
+def test_comments_are_not_columns(clause, stripped):
+    result = validate_clause(clause, ["country", "age"], INDEX)
+
+    assert result.valid, result.errors
+    assert result.repairs == []
+    assert result.filter_clause == stripped
+
+
+def test_unterminated_comment_is_a_syntax_error():
+    result = validate_clause("age > 2 /* note", ["age"], INDEX)
+
+    assert any("Unterminated comment" in e for e in result.errors), result.errors
+
+
+def test_repairs_keep_the_clause_layout():
+    result = validate_clause(
+        "(cart_add > 0 OR agee >= '30')  AND contry = 5",
+        ["cart_add"],
+        INDEX,
+    )
+
+    assert result.valid, result.errors
+    assert result.filter_clause == "(cart_add = 1 OR age >= 30)  AND country = '5'"
+    assert result.columns_used == ["cart_add", "age", "country"]
+    assert len(result.repairs) == 6
+
+
+def test_reject_mode_reports_fixable_problems():
+    result = validate_clause("cart_add != 0", ["cart_add"], INDEX, repair=False)
+
+    assert not result.valid
+    assert result.filter_clause == "cart_add != 0"
+    assert result.repairs == []
+
+
+def test_arithmetic_comparisons_are_not_type_checked():
+    result = validate_clause("age + 1 > '5' OR '5' < age * 2", ["age"], INDEX)
+
+    assert result.valid
+    assert result.repairs == []
+
+
+@patch("my_function.audiences_app.audiences_agent.agent.generate")
+@patch("my_function.audiences_app.audiences_agent.agent.load_context_from_gcs")
+def test_agent_skips_the_count_for_rejected_clauses(mock_load_context, mock_generate):
+    mock_load_context.side_effect = [SCHEMA, {}]
+    mock_generate.return_value = json.dumps(
+        {
+            "filter_clause": "browser = 'chrome'",
+            "columns_used": ["browser"],
+            "attribute_name": "Chrome",
+            "attribute_description": "Chrome users",
+        }
+    )
+    client = MagicMock()
+
+    result = agent.run_audience_agent(
+        "goal", config=MagicMock(), client=client, use_cache=False
+    )
+
+    assert result["matching_users"] is None
+    assert result["validation_errors"] == ["Unknown column 'browser'"]
+    client.query.assert_not_called()
+
+
+@patch("my_function.audiences_app.audiences_agent.agent.generate")
+@patch("my_function.audiences_app.audiences_agent.agent.load_context_from_gcs")
+def test_agent_counts_the_repaired_clause(mock_load_context, mock_generate):
+    mock_load_context.side_effect = [SCHEMA, {}]
+    mock_generate.return_value = json.dumps(
+        {
+            "filter_clause": "agee > '30'",
+            "columns_used": [],
+            "attribute_name": "Over 30",
+            "attribute_description": "Visitors over 30",
+        }
+    )
+
+    with patch.object(agent, "count_matching_users") as count:
+        count.return_value = agent.AudienceSize(5)
+        result = agent.run_audience_agent(
+            "goal", config=MagicMock(), client=MagicMock(), use_cache=False
+        )
+
+    assert count.call_args.args[2] == "age > 30"
+    assert result["columns_used"] == ["age"]
+    assert len(result["clause_repairs"]) == 3
+    assert "validation_errors" not in result
@@ -0,0 +1,144 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from my_function.audiences_app.audiences_agent import agent
+from my_function.audiences_app.audiences_agent.column_retrieval import (
+    ColumnRetriever,
+    HashingEmbedder,
+    build_column_retriever,
+)
+from my_function.config import AgentConfig
+
+
+SCHEMA = {
+    "columns": [
+        {"name": "geo_country", "data_type": "STRING", "description": "Country"},
+        {"name": "device_type", "data_type": "STRING", "description": "Device"},
+        {"name": "event_name", "data_type": "STRING", "description": "Event"},
+        {"name": "page_url", "data_type": "STRING", "description": "Page viewed"},
+    ]
+    + [
+        {"name": f"custom_dim_{i}", "data_type": "STRING", "description": ""}
+        for i in range(40)
+    ]
+}
+COL_VALUES = {
+    "geo_country": ["United States", "India", "Germany"],
+    "device_type": ["mobile", "desktop", "tablet"],
+    "event_name": ["purchase", "add_to_cart", "page_view"],
+    "page_url": ["https://example.com/checkout"],
+}
+
+
+def test_hashing_embedder_is_deterministic_unit_length():
+    embedder = HashingEmbedder(dimensions=64)
+
+    vector = embedder.embed_query("mobile users from India")
+
+    assert vector.shape == (64,)
+    assert np.isclose(np.linalg.norm(vector), 1.0)
+    assert np.array_equal(
+        vector, HashingEmbedder(64).embed_query("mobile users from India")
+    )
+
+
+def test_top_k_returns_the_columns_closest_to_the_goal():
+    retriever = ColumnRetriever.build(SCHEMA, COL_VALUES, HashingEmbedder())
+
+    assert retriever.top_k("users on a mobile device", 1) == ["device_type"]
+    assert retriever.top_k("visitors who purchased", 1) == ["event_name"]
+    assert "geo_country" in retriever.top_k("users from India", 3)
+    assert len(retriever.top_k("anything", 100)) == len(SCHEMA["columns"])
+
+
+def test_index_is_saved_once_per_version_and_memory_mapped(tmp_path):
+    embedder = HashingEmbedder()
+    built = ColumnRetriever.load_or_build(
+        str(tmp_path), "v1", SCHEMA, COL_VALUES, embedder
+    )
+    loaded = ColumnRetriever.load_or_build(
+        str(tmp_path), "v1", {"columns": []}, {}, embedder
+    )
+
+    assert isinstance(loaded.vectors, np.memmap)
+    assert loaded.columns == built.columns
+    assert loaded.top_k("mobile", 2) == built.top_k("mobile", 2)
+    assert len(list(tmp_path.glob("*.npy"))) == 1
+
+    ColumnRetriever.load_or_build(str(tmp_path), "v2", SCHEMA, COL_VALUES, embedder)
+    assert len(list(tmp_path.glob("*.npy"))) == 2
+
+
+def test_falls_back_to_hashing_when_embeddings_fail(tmp_path):
+    class Offline:
+        name = "vertex-test"
+
+        def embed_documents(self, texts):
+            raise ConnectionError("no network")
+
+    agent_config = AgentConfig(column_index_dir=str(tmp_path))
+
+    retriever = build_column_retriever(
+        agent_config, "v1", SCHEMA, COL_VALUES, embedder=Offline()
+    )
+
+    assert isinstance(retriever.embedder, HashingEmbedder)
+    assert retriever.top_k("mobile users", 1) == ["device_type"]
+
+
+@pytest.mark.parametrize("budget", [0, 400])
+def test_agent_prompt_lists_only_the_top_columns(tmp_path, budget):
+    config = SimpleNamespace(
+        agent=AgentConfig(
+            column_top_k=2,
+            column_index_dir=str(tmp_path),
+            context_token_budget=budget,
+        )
+    )
+
+    prompt, stage = agent.build_audience_prompt(
+        "mobile users from India", SCHEMA, COL_VALUES, f"retrieval-{budget}", config
+    )
+
+    assert "- device_type (STRING)" in prompt
+    assert "- geo_country (STRING)" in prompt
+    assert "custom_dim_7" not in prompt
+    assert "add_to_cart" not in prompt
+    assert stage["columns_sent"] == 2
+    assert stage["tokens_saved"] > 0
+
+
+def test_concurrent_first_requests_build_the_index_once(tmp_path, monkeypatch):
+    import threading
+    import time
+
+    from my_function.audiences_app.audiences_agent import column_retrieval
+
+    builds = []
+    real_build = column_retrieval.build_column_retriever
+
+    def slow_build(*args, **kwargs):
+        builds.append(1)
+        time.sleep(0.05)
+        return real_build(*args, **kwargs)
+
+    monkeypatch.setattr(agent, "_column_retriever", None)
+    monkeypatch.setattr(column_retrieval, "build_column_retriever", slow_build)
+    config = SimpleNamespace(agent=AgentConfig(column_index_dir=str(tmp_path)))
+    retrievers = []
+
+    def request():
+        retrievers.append(
+            agent.get_column_retriever(SCHEMA, COL_VALUES, "locked-v1", config)
+        )
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(builds) == 1
+    assert all(retriever is retrievers[0] for retriever in retrievers)
@@ -0,0 +1,57 @@
+import os
+
+from my_function.config import ConfigProvider, FunctionConfig, GcpConfig
+
+CONFIG_YAML = """
+gcp:
+  project_id: "syntasa-saas"
+  dataset_id: "ccdp_demo"
+  table_name: "web_tb_event"
+  bucket_name: "syntasa-saas"
+  schema_blob_name: "donorai_attr_aud/context_dictionary.json"
+  col_values_blob_name: "donorai_attr_aud/distinct_col_values.json"
+  ai_model: "gemini-2.5-pro"
+  unknown_key: "ignored"
+"""
+
+
+def write_config(path, text, mtime_ns):
+    path.write_text(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_from_yaml_keeps_gcp_section(tmp_path):
+    path = tmp_path / "config.yaml"
+    path.write_text(CONFIG_YAML)
+
+    config = FunctionConfig.from_yaml(str(path))
+
+    assert config.project_id == "syntasa-saas"
+    assert isinstance(config.gcp, GcpConfig)
+    assert config.gcp.bucket_name == "syntasa-saas"
+    assert config.gcp.ai_model == "gemini-2.5-pro"
+    assert config.gcp.col_values_blob_name.endswith("distinct_col_values.json")
+
+
+def test_provider_reloads_only_on_change(tmp_path):
+    path = tmp_path / "config.yaml"
+    write_config(path, CONFIG_YAML, 1_000)
+    provider = ConfigProvider(str(path))
+
+    first = provider.get()
+    assert provider.get() is first
+    assert provider.gcp.table_name == "web_tb_event"
+
+    write_config(path, CONFIG_YAML.replace("web_tb_event", "web_tb_v2"), 2_000)
+    assert provider.gcp.table_name == "web_tb_v2"
+
+
+def test_provider_reload_signal(tmp_path):
+    path = tmp_path / "config.yaml"
+    write_config(path, CONFIG_YAML, 1_000)
+    provider = ConfigProvider(str(path))
+
+    first = provider.get()
+    provider.reload()
+
+    assert provider.get() is not first
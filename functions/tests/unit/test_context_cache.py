@@ -0,0 +1,103 @@
+import json
+import os
+
+import pytest
+
+from my_function.audiences_app.audiences_agent.context_cache import (
+    ContextCache,
+    LocalObjectStore,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingStore(LocalObjectStore):
+    def __init__(self, root):
+        super().__init__(root)
+        self.downloads = 0
+        self.metadata_calls = 0
+
+    def get_generation(self, bucket_name, blob_name):
+        self.metadata_calls += 1
+        return super().get_generation(bucket_name, blob_name)
+
+    def download_text(self, bucket_name, blob_name):
+        self.downloads += 1
+        return super().download_text(bucket_name, blob_name)
+
+
+def write_blob(root, bucket, name, payload, mtime_ns=None):
+    path = os.path.join(root, bucket, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def store(tmp_path):
+    write_blob(str(tmp_path), "bucket", "ctx/schema.json", {"columns": []}, 1_000)
+    return CountingStore(str(tmp_path))
+
+
+def test_serves_from_memory_within_ttl(store):
+    clock = FakeClock()
+    cache = ContextCache(store=store, ttl_seconds=60, clock=clock)
+
+    first = cache.get("bucket", "ctx/schema.json")
+    clock.now = 30
+    second = cache.get("bucket", "ctx/schema.json")
+
+    assert first == {"columns": []}
+    assert second is first
+    assert store.downloads == 1
+    assert store.metadata_calls == 1  # generation read alongside the download
+    assert cache.stats() == {"hits": 1, "misses": 1, "revalidations": 0, "entries": 1}
+
+
+def test_revalidates_unchanged_blob_without_download(store):
+    clock = FakeClock()
+    cache = ContextCache(store=store, ttl_seconds=60, clock=clock)
+
+    cache.get("bucket", "ctx/schema.json")
+    clock.now = 120
+    cache.get("bucket", "ctx/schema.json")
+
+    assert store.downloads == 1
+    assert cache.stats()["revalidations"] == 1
+
+
+def test_reloads_when_generation_changes(store, tmp_path):
+    clock = FakeClock()
+    cache = ContextCache(store=store, ttl_seconds=60, clock=clock)
+
+    cache.get("bucket", "ctx/schema.json")
+    write_blob(
+        str(tmp_path),
+        "bucket",
+        "ctx/schema.json",
+        {"columns": [{"name": "age"}]},
+        2_000,
+    )
+    clock.now = 120
+
+    assert cache.get("bucket", "ctx/schema.json") == {"columns": [{"name": "age"}]}
+    assert store.downloads == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_invalidate_forces_download(store):
+    cache = ContextCache(store=store, ttl_seconds=60, clock=FakeClock())
+
+    cache.get("bucket", "ctx/schema.json")
+    cache.invalidate("bucket", "ctx/schema.json")
+    cache.get("bucket", "ctx/schema.json")
+
+    assert store.downloads == 2
@@ -0,0 +1,75 @@
+import json
+
+from my_function.audiences_app.audiences_agent.context_selection import (
+    ContextSelector,
+    tokenize,
+    truncate,
+)
+
+
+SCHEMA = {
+    "columns": [
+        {"name": "geo_country", "description": "Country of the visit"},
+        {"name": "deviceType", "description": "Device category"},
+        {"name": "page_url", "description": "Page viewed"},
+        {"name": "event_name", "description": "Tracked event"},
+    ]
+}
+COL_VALUES = {
+    "geo_country": ["United States", "India", "Germany"],
+    "deviceType": ["mobile", "desktop", "tablet"],
+    "page_url": [f"https://example.com/page/{i}" for i in range(200)],
+    "event_name": ["purchase", "add_to_cart", "page_view"],
+}
+
+
+def test_tokenize_splits_identifiers():
+    assert tokenize("geo_country deviceType Purchases") == [
+        "geo",
+        "country",
+        "device",
+        "type",
+        "purchase",
+    ]
+
+
+def test_ranks_columns_by_relevance_to_goal():
+    selector = ContextSelector(SCHEMA, COL_VALUES)
+
+    assert selector.rank("mobile users from India")[:2] == ["deviceType", "geo_country"]
+    assert selector.rank("users who made a purchase")[0] == "event_name"
+
+
+def test_top_columns_keep_full_values_and_others_are_truncated():
+    selector = ContextSelector(SCHEMA, COL_VALUES)
+
+    selection = selector.select(
+        "mobile users from India", 10_000, full_columns=2, truncated_values=5
+    )
+    values = json.loads(selection.text)
+
+    # Column order is preserved; there is no indentation
+    assert list(values) == list(COL_VALUES)
+    assert "\n" not in selection.text
+    assert values["deviceType"] == COL_VALUES["deviceType"]
+    assert values["page_url"] == COL_VALUES["page_url"][:5] + ["... 195 more"]
+    assert selection.truncated == ["page_url"]
+    assert selection.tokens_saved > 0
+    assert selection.tokens + selection.tokens_saved == selection.full_tokens
+
+
+def test_columns_past_the_budget_are_dropped():
+    selector = ContextSelector(SCHEMA, COL_VALUES)
+
+    selection = selector.select("mobile users", 20, full_columns=1)
+
+    assert selection.tokens <= 20
+    assert selection.full == ["deviceType"]
+    assert "page_url" in selection.dropped
+    assert "deviceType" in json.loads(selection.text)
+
+
+def test_truncate_leaves_short_lists_alone():
+    assert truncate([1, 2], 5) == [1, 2]
+    assert truncate("scalar", 1) == "scalar"
+    assert truncate([1, 2, 3], 2) == [1, 2, "... 1 more"]
@@ -0,0 +1,125 @@
+import json
+import threading
+from unittest.mock import MagicMock, patch
+
+from my_function.audiences_app.audiences_agent import agent
+from my_function.audiences_app.audiences_agent.count_jobs import CountJobs
+from my_function.audiences_app.audiences_agent.counting import AudienceSize
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_identical_keys_share_one_running_count():
+    jobs = CountJobs()
+    release = threading.Event()
+    calls = []
+
+    def count():
+        calls.append(1)
+        release.wait(5)
+        return AudienceSize(42)
+
+    first, second = [], []
+    a = jobs.submit("clause", count, first.append)
+    b = jobs.submit("clause", count, second.append)
+    release.set()
+    done = jobs.wait(a["job_id"], timeout=5)
+
+    assert a["job_id"] == b["job_id"]
+    assert a["status"] in ("pending", "running")
+    assert done["status"] == "done"
+    assert done["matching_users"] == 42
+    assert len(calls) == 1
+    assert jobs.started == 1 and jobs.shared == 1
+    assert first[0].matching_users == second[0].matching_users == 42
+    jobs.shutdown()
+
+
+def test_finished_counts_are_reused_until_they_expire():
+    clock = Clock()
+    jobs = CountJobs(ttl_seconds=60, clock=clock)
+    count = MagicMock(return_value=AudienceSize(7))
+
+    job_id = jobs.submit("clause", count)["job_id"]
+    jobs.wait(job_id, timeout=5)
+    reused = []
+    status = jobs.submit("clause", count, reused.append)
+
+    assert status["status"] == "done"
+    assert reused[0].matching_users == 7
+    assert count.call_count == 1
+
+    clock.now = 61
+    assert jobs.status(job_id) is None
+    jobs.wait(jobs.submit("clause", count)["job_id"], timeout=5)
+    assert count.call_count == 2
+    jobs.shutdown()
+
+
+def test_job_keys_differ_for_clauses_differing_inside_a_literal():
+    config = MagicMock()
+
+    spaced = agent.count_job_key(config, "page = 'a  b'")
+
+    assert spaced != agent.count_job_key(config, "page = 'a b'")
+    assert spaced == agent.count_job_key(config, "page  =  'a  b'")
+
+
+def test_failed_counts_are_retried():
+    jobs = CountJobs()
+    count = MagicMock(
+        side_effect=[RuntimeError("boom"), AudienceSize(None), AudienceSize(3)]
+    )
+
+    for expected in ("failed", "done", "done"):
+        status = jobs.wait(jobs.submit("clause", count)["job_id"], timeout=5)
+        assert status["status"] == expected
+
+    assert status["matching_users"] == 3
+    assert count.call_count == 3
+    jobs.shutdown()
+
+
+@patch("my_function.audiences_app.audiences_agent.agent.generate")
+@patch("my_function.audiences_app.audiences_agent.agent.load_context_from_gcs")
+def test_agent_returns_the_clause_before_the_count(mock_load_context, mock_generate):
+    schema = {"columns": [{"name": "age", "data_type": "INTEGER"}]}
+    mock_load_context.side_effect = [schema, {}]
+    mock_generate.return_value = json.dumps(
+        {
+            "filter_clause": "age > 25",
+            "columns_used": ["age"],
+            "attribute_name": "Older",
+            "attribute_description": "Older users",
+        }
+    )
+    release = threading.Event()
+
+    def count_matching_users(*args):
+        release.wait(5)
+        return AudienceSize(42)
+
+    jobs = CountJobs()
+    with patch.object(agent, "_count_jobs", jobs), patch.object(
+        agent, "count_matching_users", side_effect=count_matching_users
+    ):
+        result = agent.run_audience_agent(
+            "goal",
+            config=MagicMock(),
+            client=MagicMock(),
+            use_cache=False,
+            background_count=True,
+        )
+        assert result["filter_clause"] == "age > 25"
+        assert result["matching_users"] is None
+        release.set()
+        status = jobs.wait(result["count_job"]["job_id"], timeout=5)
+
+    assert status["matching_users"] == 42
+    jobs.shutdown()
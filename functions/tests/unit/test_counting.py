@@ -0,0 +1,198 @@
+import json
+import sqlite3
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from my_function.audiences_app.audiences_agent import agent
+from my_function.audiences_app.audiences_agent.counting import (
+    AudienceSize,
+    CountingEngine,
+    build_multi_count_query,
+    build_size_query,
+    sample_predicate,
+    size_from_count,
+)
+
+
+class SQLiteClient:
+    """BigQuery-style ``query(sql).result()`` over an SQLite connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.queries = []
+
+    def query(self, sql, job_config=None):
+        self.queries.append(sql)
+        cursor = self.conn.execute(sql)
+        names = [d[0] for d in cursor.description]
+        rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        return type("Job", (), {"result": lambda self: rows})()
+
+
+@pytest.fixture
+def client():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE events (mcvisid TEXT, cart_add INT, product_view INT, country TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO events VALUES (?, ?, ?, ?)",
+        [
+            ("v1", 1, 0, "US"),
+            ("v1", 0, 1, "US"),
+            ("v2", 0, 1, "IN"),
+            ("v3", 1, 1, "IN"),
+            ("v3", 1, 0, "IN"),
+            ("v4", 0, 0, "US"),
+        ],
+    )
+    return SQLiteClient(conn)
+
+
+def single_count(client, clause):
+    sql = f"SELECT COUNT(DISTINCT mcvisid) AS n FROM events WHERE {clause}"
+    return client.conn.execute(sql).fetchone()[0]
+
+
+def test_single_pass_matches_individual_counts(client):
+    audiences = {
+        "carts": "cart_add = 1",
+        "views": "product_view = 1",
+        "india_views": "country = 'IN' AND product_view = 1",
+        "nobody": "country = 'FR'",
+        "empty": "",
+    }
+    engine = CountingEngine(client, "events", dialect="sqlite")
+
+    counts = engine.count(audiences)
+
+    assert engine.queries_run == 1
+    assert len(client.queries) == 1
+    for audience, clause in audiences.items():
+        expected = single_count(client, clause) if clause else None
+        assert counts[audience] == expected
+
+
+def test_duplicate_clauses_counted_once_and_chunked(client):
+    engine = CountingEngine(client, "events", dialect="sqlite", max_clauses_per_query=2)
+
+    counts = engine.count_list(
+        ["cart_add = 1", "product_view = 1", "cart_add = 1", "country = 'US'"]
+    )
+
+    assert counts == [2, 3, 2, 2]
+    assert engine.queries_run == 2
+
+
+def test_bad_clause_is_isolated(client):
+    engine = CountingEngine(client, "events", dialect="sqlite")
+
+    counts = engine.count_list(["cart_add = 1", "no_such_column = 1"])
+
+    assert counts == [2, None]
+
+
+def test_bigquery_query_shape():
+    exact = build_multi_count_query("`p.d.t`", ["a = 1", "b = 1"])
+    approx = build_multi_count_query("`p.d.t`", ["a = 1"], sizing_mode="approx")
+
+    assert "COUNT(DISTINCT IF((a = 1), mcvisid, NULL)) AS aud_0" in exact
+    assert "COUNT(DISTINCT IF((b = 1), mcvisid, NULL)) AS aud_1" in exact
+    assert exact.endswith("WHERE (a = 1) OR (b = 1)")
+    assert "APPROX_COUNT_DISTINCT(IF((a = 1), mcvisid, NULL)) AS aud_0" in approx
+
+
+def test_size_query_per_mode():
+    exact = build_size_query("`p.d.t`", "a = 1")
+    approx = build_size_query("`p.d.t`", "a = 1", sizing_mode="approx")
+    sample = build_size_query(
+        "`p.d.t`", "a = 1", sizing_mode="sample", sample_percent=5
+    )
+
+    assert exact == (
+        "SELECT COUNT(DISTINCT mcvisid) as matching_users FROM `p.d.t` WHERE a = 1"
+    )
+    assert "APPROX_COUNT_DISTINCT(mcvisid)" in approx
+    assert sample.endswith(
+        "FROM `p.d.t` WHERE MOD(MOD(FARM_FINGERPRINT(CAST(mcvisid AS STRING)), "
+        "10000) + 10000, 10000) < 500 AND (a = 1)"
+    )
+    with pytest.raises(ValueError):
+        build_size_query("`p.d.t`", "a = 1", sizing_mode="guess")
+
+
+def test_sampled_size_is_scaled_with_interval():
+    size = size_from_count(100, "sample", sample_percent=10)
+
+    assert size.matching_users == 1000
+    assert size.matching_users_lower < 1000 < size.matching_users_upper
+    assert size.matching_users_lower >= 100
+    assert set(size.as_dict()) == {
+        "matching_users",
+        "sizing_mode",
+        "matching_users_lower",
+        "matching_users_upper",
+        "estimated_bytes",
+    }
+    assert size_from_count(42, "approx").as_dict() == {
+        "matching_users": 42,
+        "sizing_mode": "approx",
+        "estimated_bytes": None,
+    }
+    assert size_from_count(None, "sample") == AudienceSize(None, "sample")
+
+
+def test_sample_mode_keeps_or_drops_whole_visitors():
+    duckdb = pytest.importorskip("duckdb")
+    conn = duckdb.connect()
+    # 4000 visitors; the first 1000 are heavy, with 20 events each
+    conn.execute(
+        "CREATE TABLE events AS SELECT 'v' || (i % 4000) AS mcvisid, "
+        "CASE WHEN i % 4000 < 1000 THEN 1 ELSE 0 END AS heavy "
+        "FROM range(80000) t(i) WHERE i < 4000 OR i % 4000 < 1000"
+    )
+    engine = CountingEngine(
+        SQLiteClient(conn),
+        "events",
+        sizing_mode="sample",
+        sample_percent=25,
+        dialect="duckdb",
+    )
+
+    size = engine.sizes({"heavy": "heavy = 1"})["heavy"]
+    sampled_events = conn.execute(
+        "SELECT COUNT(*) FROM events WHERE heavy = 1 AND "
+        + sample_predicate(25, dialect="duckdb")
+    ).fetchone()[0]
+
+    assert sampled_events == 20 * size.matching_users // 4
+    assert size.matching_users_lower <= 1000 <= size.matching_users_upper
+
+
+@patch.object(agent, "generate")
+@patch.object(agent, "load_context_from_gcs")
+def test_agent_reports_requested_sizing_mode(mock_load_context, mock_generate):
+    mock_load_context.side_effect = [
+        {"columns": [{"name": "a", "data_type": "INTEGER"}]},
+        {},
+    ]
+    mock_generate.return_value = json.dumps(
+        {
+            "filter_clause": "a = 1",
+            "columns_used": ["a"],
+            "attribute_name": "A",
+            "attribute_description": "A",
+        }
+    )
+    client = MagicMock()
+    client.query.return_value.result.return_value = [{"matching_users": 20}]
+
+    result = agent.run_audience_agent(
+        "goal", config=MagicMock(), client=client, use_cache=False, sizing_mode="sample"
+    )
+
+    assert "FARM_FINGERPRINT" in client.query.call_args.args[0]
+    assert result["sizing_mode"] == "sample"
+    assert result["matching_users"] == 2000
+    assert result["matching_users_lower"] < 2000 < result["matching_users_upper"]
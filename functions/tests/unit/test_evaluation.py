@@ -0,0 +1,98 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from my_function.audiences_app.audiences_agent import evaluation
+from my_function.audiences_app.audiences_agent.evaluation import (
+    BenchmarkContext,
+    IntervalLimiter,
+    load_dataset,
+    run_benchmark,
+)
+
+CONTEXT = BenchmarkContext(
+    {"columns": [{"name": "cart_add", "data_type": "INTEGER"}]},
+    {"cart_add": [0, 1]},
+    "v1",
+    "- cart_add (INTEGER)",
+    "[]",
+)
+
+
+def fake_generate(prompt, response_schema=None):
+    if "Ground Truth Filter Clause" in prompt:
+        verdict = "True" if "add to cart" in prompt else "False"
+        return json.dumps({"validated": verdict, "reasoning": "r"})
+    return json.dumps(
+        {
+            "filter_clause": "cart_add = 1",
+            "columns_used": ["cart_add"],
+            "attribute_name": "n",
+            "attribute_description": "d",
+        }
+    )
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = tmp_path / "dataset.jsonl"
+    rows = [
+        {"nl_query": "users who add to cart", "ground_truth_clause": "cart_add = 1"},
+        {"nl_query": "users who buy", "ground_truth_clause": "purchase = 1"},
+        {"id": "q3", "nl_query": "add to cart", "ground_truth_clause": "cart_add > 0"},
+    ]
+    path.write_text("\n".join(json.dumps(r) for r in rows) + "\n")
+    return load_dataset(str(path))
+
+
+def test_load_dataset_assigns_stable_ids(dataset, tmp_path):
+    csv_path = tmp_path / "dataset.csv"
+    csv_path.write_text(
+        "nl_query,ground_truth_clause\nusers who add to cart,cart_add = 1\n"
+    )
+
+    assert dataset[2]["id"] == "q3"
+    assert load_dataset(str(csv_path))[0]["id"] == dataset[0]["id"]
+
+
+@patch.object(evaluation.agent, "generate", side_effect=fake_generate)
+def test_run_benchmark_reports_accuracy_and_stages(mock_generate, dataset, tmp_path):
+    out = tmp_path / "results.jsonl"
+
+    report = run_benchmark(dataset, CONTEXT, str(out), requests_per_minute=0)
+
+    assert report["items"] == 3
+    assert report["passed"] == 2
+    assert report["accuracy"] == pytest.approx(2 / 3)
+    assert report["stages"]["generate"]["calls"] == 3
+    assert report["stages"]["judge"]["prompt_tokens"] > 0
+    assert report["stages"]["judge"]["p95_seconds"] is not None
+    assert mock_generate.call_count == 6
+    assert len(out.read_text().splitlines()) == 3
+
+
+@patch.object(evaluation.agent, "generate", side_effect=fake_generate)
+def test_run_benchmark_resumes_from_checkpoint(mock_generate, dataset, tmp_path):
+    out = tmp_path / "results.jsonl"
+    finished = {"id": dataset[0]["id"], "validated": True, "stages": {}}
+    failed = {"id": "q3", "validated": False, "error": "quota", "stages": {}}
+    out.write_text(json.dumps(finished) + "\n" + json.dumps(failed) + "\n{torn")
+
+    report = run_benchmark(dataset, CONTEXT, str(out), requests_per_minute=0)
+
+    # Only the unfinished and the failed item are run again
+    assert mock_generate.call_count == 4
+    assert report["items"] == 3
+    assert report["errors"] == 0
+    assert len(evaluation.read_checkpoint(str(out))) == 3
+
+
+def test_interval_limiter_spaces_calls():
+    now, slept = [0.0], []
+    limiter = IntervalLimiter(120, clock=lambda: now[0], sleep=slept.append)
+
+    for _ in range(3):
+        limiter.acquire()
+
+    assert slept == [0.5, 1.0]
@@ -0,0 +1,108 @@
+import pytest
+
+from my_function.audiences_app.audiences_agent.feedback_sink import (
+    BigQueryFeedbackWriter,
+    FeedbackSink,
+)
+
+
+class RecordingWriter:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+
+    def __call__(self, rows, row_ids):
+        if self.fail:
+            raise RuntimeError("quota exceeded")
+        self.batches.append((list(rows), list(row_ids)))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def row(n):
+    return {"attribute_goal": f"goal {n}", "filter_clause": "a = 1", "approved": True}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "feedback.sqlite3")
+
+
+def test_rows_flush_in_batches(path):
+    writer = RecordingWriter()
+    sink = FeedbackSink(writer, path, batch_size=2, start=False)
+    for n in range(3):
+        sink.submit(row(n))
+
+    assert sink.pending() == 3
+    assert sink.flush() == 3
+    assert [len(rows) for rows, _ in writer.batches] == [2, 1]
+    assert writer.batches[0][0][0] == row(0)
+    assert sink.pending() == 0
+
+
+def test_flush_waits_for_full_or_overdue_batch(path):
+    clock = FakeClock()
+    writer = RecordingWriter()
+    sink = FeedbackSink(
+        writer, path, batch_size=10, flush_seconds=5, clock=clock, start=False
+    )
+    sink.submit(row(0))
+
+    assert sink.flush(force=False) == 0
+    clock.now += 6
+    assert sink.flush(force=False) == 1
+
+
+def test_failed_flush_keeps_rows_and_restart_replays_them(path):
+    sink = FeedbackSink(RecordingWriter(fail=True), path, start=False)
+    sink.submit(row(0))
+    sink.submit(row(1))
+
+    with pytest.raises(RuntimeError):
+        sink.flush()
+    assert sink.pending() == 2
+
+    writer = RecordingWriter()
+    restarted = FeedbackSink(writer, path, start=False)
+    assert restarted.flush() == 2
+    assert [r["attribute_goal"] for r in writer.batches[0][0]] == ["goal 0", "goal 1"]
+
+
+def test_claimed_rows_are_not_sent_twice(path):
+    clock = FakeClock()
+    first = FeedbackSink(RecordingWriter(), path, clock=clock, start=False)
+    second_writer = RecordingWriter()
+    second = FeedbackSink(second_writer, path, clock=clock, start=False)
+    first.submit(row(0))
+
+    assert first._claim()
+    assert second.flush() == 0
+    clock.now += first.claim_seconds + 1
+    assert second.flush() == 1
+
+
+def test_background_flusher_drains_on_close(path):
+    writer = RecordingWriter()
+    sink = FeedbackSink(writer, path, flush_seconds=60)
+    sink.submit(row(0))
+
+    sink.close()
+
+    assert sink.pending() == 0
+    assert writer.batches[0][0] == [row(0)]
+
+
+def test_bigquery_writer_raises_on_row_errors():
+    class Client:
+        def insert_rows_json(self, table, rows, row_ids):
+            return [{"index": 0, "errors": ["bad"]}]
+
+    with pytest.raises(RuntimeError):
+        BigQueryFeedbackWriter(Client(), "p.d.t")([row(0)], ["id"])
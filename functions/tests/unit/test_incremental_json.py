@@ -0,0 +1,51 @@
+import json
+import random
+
+from my_function.audiences_app.audiences_agent.incremental_json import (
+    IncrementalJSONParser,
+)
+
+DOCUMENT = {
+    "filter_clause": "country = 'U\"S' AND note != '}{,'",
+    "columns_used": ["country", "note]"],
+    "score": -1.5e3,
+    "flag": True,
+    "missing": None,
+    "nested": {"k": [1, {"q": "}"}]},
+    "attribute_description": "café users",
+}
+
+
+def test_fields_are_reported_as_soon_as_they_are_complete():
+    parser = IncrementalJSONParser()
+
+    assert parser.feed('```json\n{"filter_clause": "age > 2') == []
+    assert parser.feed('5", "columns_used": ["age"') == [("filter_clause", "age > 25")]
+    assert parser.feed('], "attribute_name": "Ol') == [("columns_used", ["age"])]
+    assert parser.feed('der"}\n```') == [("attribute_name", "Older")]
+    assert parser.complete
+
+
+def test_any_chunking_yields_every_field_in_order():
+    text = json.dumps(DOCUMENT, indent=2)
+    rng = random.Random(7)
+    for _ in range(200):
+        parser = IncrementalJSONParser()
+        fields = []
+        pos = 0
+        while pos < len(text):
+            size = rng.randint(1, 9)
+            fields += parser.feed(text[pos : pos + size])
+            pos += size
+
+        assert fields == list(DOCUMENT.items())
+        assert parser.complete
+
+
+def test_scalars_complete_at_the_next_delimiter():
+    parser = IncrementalJSONParser()
+
+    assert parser.feed('{"count": 12') == []
+    assert parser.feed("3,") == [("count", 123)]
+    assert parser.feed(' "ok": true') == []
+    assert parser.feed("}") == [("ok", True)]
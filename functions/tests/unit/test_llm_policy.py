@@ -0,0 +1,336 @@
+import asyncio
+import random
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from my_function.audiences_app.audiences_agent import base_functions, metrics
+from my_function.audiences_app.audiences_agent.llm_policy import (
+    CircuitBreaker,
+    CircuitOpenError,
+    LLMCallPolicy,
+    percentile,
+)
+
+
+class ServiceUnavailable(Exception):
+    code = 503
+
+
+class TooManyRequests(Exception):
+    code = 429
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    with patch.object(metrics, "REGISTRY", metrics.MetricsRegistry()):
+        yield metrics.REGISTRY
+
+
+def flaky(*errors, result="ok", delay=0.0):
+    """A call raising ``errors`` in turn, then returning ``result``."""
+    outcomes = list(errors)
+
+    def call(*args):
+        if delay:
+            time.sleep(delay)
+        if outcomes:
+            raise outcomes.pop(0)
+        return result
+
+    return MagicMock(side_effect=call)
+
+
+def test_retries_429_and_503_with_jittered_backoff(fresh_registry):
+    slept = []
+    policy = LLMCallPolicy(
+        max_attempts=3, backoff_seconds=1.0, sleep=slept.append, rng=random.Random(0)
+    )
+    call = flaky(TooManyRequests(), ServiceUnavailable())
+
+    assert policy.call(call, "prompt") == "ok"
+
+    assert call.call_count == 3
+    assert 0 <= slept[0] <= 1.0 and 0 <= slept[1] <= 2.0
+    assert fresh_registry.llm_retries.value(reason="429") == 1
+    assert fresh_registry.llm_retries.value(reason="503") == 1
+
+
+def test_other_errors_and_exhausted_attempts_are_raised():
+    policy = LLMCallPolicy(max_attempts=2, sleep=lambda s: None)
+    bad_request = flaky(ValueError("blocked"))
+    unavailable = flaky(ServiceUnavailable(), ServiceUnavailable())
+
+    with pytest.raises(ValueError):
+        policy.call(bad_request)
+    with pytest.raises(ServiceUnavailable):
+        policy.call(unavailable)
+
+    assert bad_request.call_count == 1
+    assert unavailable.call_count == 2
+
+
+def test_slow_attempts_time_out_and_the_deadline_bounds_retries(fresh_registry):
+    policy = LLMCallPolicy(
+        max_attempts=5,
+        attempt_timeout_seconds=0.05,
+        deadline_seconds=0.12,
+        sleep=lambda s: None,
+        rng=random.Random(0),
+        backoff_seconds=0.0,
+    )
+    slow = flaky(delay=0.3)
+    start = time.monotonic()
+
+    with pytest.raises(TimeoutError):
+        policy.call(slow)
+
+    assert time.monotonic() - start < 0.25
+    assert 1 <= fresh_registry.llm_retries.value(reason="timeout") < 4
+
+
+def test_hedged_request_answers_when_the_first_is_slow(fresh_registry):
+    policy = LLMCallPolicy(hedge_percentile=95)
+    for _ in range(20):
+        policy.latencies.add(0.01)
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.5)
+            return "slow"
+        return "hedge"
+
+    assert policy.call(call) == "hedge"
+    assert fresh_registry.llm_hedges.value(outcome="sent") == 1
+    assert fresh_registry.llm_hedges.value(outcome="won") == 1
+
+
+def test_circuit_breaker_fails_fast_then_lets_a_trial_through(fresh_registry):
+    now = [0.0]
+    breaker = CircuitBreaker(2, reset_seconds=30, clock=lambda: now[0])
+    policy = LLMCallPolicy(max_attempts=1, breaker=breaker)
+    failing = flaky(ServiceUnavailable(), ServiceUnavailable())
+
+    for _ in range(2):
+        with pytest.raises(ServiceUnavailable):
+            policy.call(failing)
+    with pytest.raises(CircuitOpenError):
+        policy.call(failing)
+    now[0] = 31.0
+    assert policy.call(failing) == "ok"
+
+    assert failing.call_count == 3
+    assert breaker.state == "closed"
+    assert fresh_registry.llm_breaker.value(event="open") == 1
+    assert fresh_registry.llm_breaker.value(event="reject") == 1
+    assert fresh_registry.llm_breaker.value(event="close") == 1
+
+
+def test_call_async_retries(fresh_registry):
+    policy = LLMCallPolicy(max_attempts=2, backoff_seconds=0.0)
+    attempts = []
+
+    async def call(prompt):
+        attempts.append(prompt)
+        if len(attempts) == 1:
+            raise ServiceUnavailable()
+        return prompt.upper()
+
+    assert asyncio.run(policy.call_async(call, "p")) == "P"
+    assert fresh_registry.llm_retries.value(reason="503") == 1
+
+
+def test_generate_goes_through_the_policy():
+    backend = MagicMock()
+    backend.generate.side_effect = [TooManyRequests(), "answer"]
+    policy = LLMCallPolicy(sleep=lambda s: None)
+
+    with patch.object(base_functions, "_llm_backend", backend), patch.object(
+        base_functions, "get_llm_policy", return_value=policy
+    ):
+        assert base_functions.generate("prompt") == "answer"
+
+    assert backend.generate.call_count == 2
+
+
+def test_response_text_without_candidates_raises_value_error():
+    with pytest.raises(ValueError, match="no text"):
+        base_functions.response_text(SimpleNamespace(candidates=[]))
+
+
+def test_generate_stream_retries_until_the_first_chunk():
+    opened = []
+
+    class StreamingBackend:
+        def generate_stream(self, prompt, response_schema=None):
+            opened.append(prompt)
+            if len(opened) == 1:
+                raise ServiceUnavailable()
+            yield from ("a", "b")
+
+    policy = LLMCallPolicy(sleep=lambda s: None)
+    with patch.object(base_functions, "_llm_backend", StreamingBackend()), patch.object(
+        base_functions, "get_llm_policy", return_value=policy
+    ):
+        assert list(base_functions.generate_stream("prompt")) == ["a", "b"]
+
+    assert len(opened) == 2
+
+
+def test_rate_limit_wait_is_outside_the_attempt_timeout():
+    policy = LLMCallPolicy(max_attempts=1, attempt_timeout_seconds=0.05)
+    waited = []
+
+    def acquire():
+        time.sleep(0.1)
+        waited.append(True)
+
+    assert policy.call(flaky(delay=0.01), acquire=acquire) == "ok"
+    assert waited == [True]
+
+
+def test_refused_rate_limit_releases_the_breaker_trial():
+    now = [0.0]
+    breaker = CircuitBreaker(1, 10.0, clock=lambda: now[0])
+    policy = LLMCallPolicy(max_attempts=1, breaker=breaker)
+    with pytest.raises(ServiceUnavailable):
+        policy.call(flaky(ServiceUnavailable()))
+    now[0] = 11.0
+
+    def refuse():
+        raise RuntimeError("no capacity")
+
+    with pytest.raises(RuntimeError):
+        policy.call(flaky(), acquire=refuse)
+    assert policy.call(flaky()) == "ok"
+
+
+def test_timed_out_attempts_queued_on_a_busy_pool_never_run():
+    from concurrent.futures import ThreadPoolExecutor
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+    pool.submit(release.wait)  # the only worker is busy
+    policy = LLMCallPolicy(
+        max_attempts=3,
+        attempt_timeout_seconds=0.02,
+        backoff_seconds=0.0,
+        executor=pool,
+    )
+    call = flaky()
+
+    with pytest.raises(TimeoutError):
+        policy.call(call)
+    release.set()
+    pool.shutdown(wait=True)
+
+    assert call.call_count == 0
+
+
+def test_transport_errors_count_as_breaker_failures():
+    breaker = CircuitBreaker(2, reset_seconds=30)
+    policy = LLMCallPolicy(max_attempts=1, breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            policy.call(flaky(ConnectionError("reset by peer")))
+    assert breaker.state == "open"
+
+    breaker = CircuitBreaker(2, reset_seconds=30)
+    policy = LLMCallPolicy(max_attempts=1, breaker=breaker)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            policy.call(flaky(ValueError("blocked")))
+    assert breaker.state == "closed"
+
+
+def test_percentile_nearest_rank():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2, 4], 50) == 2
+    assert percentile(list(range(1, 101)), 95) == 95
+
+
+def test_cancelled_trial_lets_the_breaker_recover():
+    now = [0.0]
+    breaker = CircuitBreaker(1, reset_seconds=10, clock=lambda: now[0])
+    policy = LLMCallPolicy(max_attempts=1, breaker=breaker)
+
+    async def failing():
+        raise ServiceUnavailable()
+
+    async def hanging():
+        await asyncio.sleep(10)
+
+    async def ok():
+        return "ok"
+
+    async def scenario():
+        with pytest.raises(ServiceUnavailable):
+            await policy.call_async(failing)
+        now[0] = 11.0
+        trial = asyncio.ensure_future(policy.call_async(hanging))
+        await asyncio.sleep(0.01)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        now[0] = 1000.0
+        return await policy.call_async(ok)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_governor_refusals_are_not_breaker_failures():
+    from my_function.audiences_app.audiences_agent.rate_limiter import (
+        ConcurrencyGovernor,
+        RateLimitExceeded,
+    )
+
+    governor = ConcurrencyGovernor(1, max_wait_seconds=0.1)
+    breaker = CircuitBreaker(1, reset_seconds=30)
+    policy = LLMCallPolicy(
+        max_attempts=1, attempt_timeout_seconds=0.05, breaker=breaker
+    )
+    release = governor.acquire()
+    with pytest.raises(RateLimitExceeded):
+        policy.call(flaky(), acquire=governor.acquire)
+    assert breaker.state == "closed"
+
+    # The wait for a slot is outside the attempt timeout
+    threading.Timer(0.08, release).start()
+    assert policy.call(flaky(), acquire=governor.acquire) == "ok"
+    time.sleep(0.01)
+    governor.acquire()()  # the attempt gave its slot back
+
+
+def test_generate_takes_the_governor_slot_before_the_attempt():
+    from my_function.audiences_app.audiences_agent.rate_limiter import (
+        ConcurrencyGovernor,
+        RateLimiter,
+        RateLimitExceeded,
+    )
+
+    governor = ConcurrencyGovernor(1, max_wait_seconds=0.05)
+    breaker = CircuitBreaker(1, reset_seconds=30)
+    policy = LLMCallPolicy(max_attempts=1, breaker=breaker)
+    backend = MagicMock()
+    backend.generate.return_value = "answer"
+
+    with patch.object(base_functions, "_llm_backend", backend), patch.object(
+        base_functions, "get_llm_policy", return_value=policy
+    ), patch.object(
+        base_functions, "get_rate_limits", return_value=(RateLimiter(), governor)
+    ):
+        release = governor.acquire()
+        with pytest.raises(RateLimitExceeded):
+            base_functions.generate("prompt")
+        release()
+        assert base_functions.generate("prompt") == "answer"
+
+    assert backend.generate.call_count == 1
+    assert breaker.state == "closed"
@@ -0,0 +1,103 @@
+import json
+import logging
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from my_function.audiences_app.audiences_agent import agent, metrics
+from my_function.audiences_app.audiences_agent.metrics import (
+    Histogram,
+    bind_request_id,
+    get_request_id,
+    span,
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    with patch.object(metrics, "REGISTRY", metrics.MetricsRegistry()):
+        yield metrics.REGISTRY
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("stage_seconds", "Stage time.", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        histogram.observe(value, stage="gemini_call")
+
+    lines = histogram.render()
+
+    assert lines[:2] == [
+        "# HELP stage_seconds Stage time.",
+        "# TYPE stage_seconds histogram",
+    ]
+    assert 'stage_seconds_bucket{stage="gemini_call",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="gemini_call",le="1"} 3' in lines
+    assert 'stage_seconds_bucket{stage="gemini_call",le="+Inf"} 4' in lines
+    assert 'stage_seconds_sum{stage="gemini_call"} 4.25' in lines
+    assert 'stage_seconds_count{stage="gemini_call"} 4' in lines
+
+
+def test_span_records_sizes_errors_and_a_log_line(fresh_registry, caplog):
+    token = metrics.set_request_id("req-1")
+    try:
+        with caplog.at_level(logging.INFO, logger="audiences"):
+            with span("gemini_call", prompt_bytes=1200) as stage:
+                stage["response_bytes"] = 80
+            with pytest.raises(ValueError):
+                with span("json_parse"):
+                    raise ValueError("bad json")
+    finally:
+        metrics.reset_request_id(token)
+
+    assert fresh_registry.stage_seconds.count(stage="gemini_call") == 1
+    assert fresh_registry.stage_sizes["prompt_bytes"].count(stage="gemini_call") == 1
+    assert fresh_registry.stage_sizes["response_bytes"].count(stage="gemini_call") == 1
+    assert fresh_registry.stage_errors.value(stage="json_parse") == 1
+    logged = [json.loads(r.getMessage()) for r in caplog.records]
+    assert logged[0]["request_id"] == "req-1"
+    assert logged[0]["stage"] == "gemini_call"
+    assert logged[0]["prompt_bytes"] == 1200
+    assert "ValueError" in logged[1]["error"]
+
+
+def test_bind_request_id_applies_while_iterating():
+    def body():
+        yield get_request_id()
+        yield get_request_id()
+
+    assert list(bind_request_id(body(), "req-2")) == ["req-2", "req-2"]
+    assert get_request_id() is None
+
+
+@patch("my_function.audiences_app.audiences_agent.agent.generate")
+@patch("my_function.audiences_app.audiences_agent.agent.load_context_from_gcs")
+def test_agent_times_every_stage(mock_load_context, mock_generate, fresh_registry):
+    schema = {"columns": [{"name": "age", "data_type": "INTEGER"}]}
+    mock_load_context.side_effect = [schema, {}]
+    mock_generate.return_value = json.dumps(
+        {
+            "filter_clause": "age > 25",
+            "columns_used": ["age"],
+            "attribute_name": "Older",
+            "attribute_description": "Older users",
+        }
+    )
+    client = MagicMock()
+    client.query.return_value.result.return_value = [{"matching_users": 3}]
+    client.query.return_value.total_bytes_processed = 2048
+
+    agent.run_audience_agent("goal", config=MagicMock(), client=client, use_cache=False)
+
+    for stage in (
+        "schema_load",
+        "col_values_load",
+        "prompt_build",
+        "gemini_call",
+        "json_parse",
+        "clause_validation",
+        "bq_count",
+    ):
+        assert fresh_registry.stage_seconds.count(stage=stage) == 1, stage
+    assert fresh_registry.stage_sizes["bytes_processed"].count(stage="bq_count") == 1
+    rendered = metrics.render()
+    assert 'audience_stage_duration_seconds_count{stage="gemini_call"} 1' in rendered
@@ -0,0 +1,40 @@
+import threading
+from unittest.mock import patch
+
+from my_function.audiences_app.audiences_agent.model_registry import ModelRegistry
+
+SCHEMA = {"type": "object", "properties": {"filter_clause": {"type": "string"}}}
+
+
+@patch("my_function.audiences_app.audiences_agent.model_registry.GenerativeModel")
+def test_reuses_bundle_per_model_and_schema(mock_model_cls):
+    registry = ModelRegistry()
+
+    first = registry.get("gemini-2.5-pro", SCHEMA)
+    again = registry.get("gemini-2.5-pro", dict(SCHEMA))
+    free_text = registry.get("gemini-2.5-pro")
+
+    assert again is first
+    assert free_text is not first
+    # One model per name, shared across response schemas
+    assert free_text.model is first.model
+    assert free_text.safety_settings is first.safety_settings
+    assert mock_model_cls.call_count == 1
+
+
+@patch("my_function.audiences_app.audiences_agent.model_registry.GenerativeModel")
+def test_concurrent_lookups_build_once(mock_model_cls):
+    registry = ModelRegistry()
+    results = []
+
+    def lookup():
+        results.append(registry.get("gemini-2.5-pro", SCHEMA))
+
+    threads = [threading.Thread(target=lookup) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(bundle) for bundle in results}) == 1
+    assert mock_model_cls.call_count == 1
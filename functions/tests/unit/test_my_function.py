@@ -1,3 +1,5 @@
+import threading
+
 import pytest
 from unittest.mock import patch, MagicMock
 
@@ -137,3 +139,159 @@ def test_run_audience_agent_bigquery_error(
 
     assert result["filter_clause"] == "age > 25"
     assert result["matching_users"] is None
+
+
+# ----------------------------
+# Staged stream
+# ----------------------------
+@patch(
+    "my_function.audiences_app.audiences_agent.agent.load_context_from_gcs", create=True
+)
+@patch("my_function.audiences_app.audiences_agent.agent.generate", create=True)
+def test_stream_audience_agent_yields_clause_before_count(
+    mock_generate,
+    mock_load_context,
+    mock_config,
+    sample_schema,
+    sample_col_values,
+    sample_gemini_response,
+):
+    mock_load_context.side_effect = [sample_schema, sample_col_values]
+    mock_generate.return_value = sample_gemini_response
+    mock_client = MagicMock()
+    mock_client.query.return_value.result.return_value = [{"matching_users": 42}]
+
+    from my_function.audiences_app.audiences_agent.agent import stream_audience_agent
+
+    events = stream_audience_agent(
+        "Find users older than 25", config=mock_config, client=mock_client
+    )
+
+    assert next(events)["stage"] == "context"
+    generated = next(events)
+    assert generated["stage"] == "generated"
+    assert generated["filter_clause"] == "age > 25"
+    assert next(events)["stage"] == "validated"
+    mock_client.query.assert_not_called()
+    final = next(events)
+    assert final["stage"] == "result"
+    assert final["matching_users"] == 42
+    assert list(events) == []
+
+
+@patch(
+    "my_function.audiences_app.audiences_agent.agent.load_context_from_gcs", create=True
+)
+@patch("my_function.audiences_app.audiences_agent.agent.generate_stream", create=True)
+def test_streaming_starts_the_count_before_the_description_is_written(
+    mock_generate_stream,
+    mock_load_context,
+    mock_config,
+    sample_schema,
+    sample_col_values,
+):
+    from my_function.config import AgentConfig
+    from my_function.audiences_app.audiences_agent.agent import stream_audience_agent
+
+    mock_config.agent = AgentConfig(llm_streaming=True, clause_validation="repair")
+    mock_load_context.side_effect = [sample_schema, sample_col_values]
+    counted = threading.Event()
+    mock_client = MagicMock()
+
+    def query(sql, job_config=None):
+        if job_config is None or not getattr(job_config, "dry_run", False):
+            counted.set()
+        job = MagicMock()
+        job.result.return_value = [{"matching_users": 42}]
+        job.total_bytes_processed = 10
+        return job
+
+    mock_client.query.side_effect = query
+    seen = {}
+
+    def chunks(prompt, response_schema=None):
+        yield '{"filter_clause": "age > 25", "columns_'
+        yield 'used": ["age"], "attribute_name": "Older", '
+        seen["counted_before_description"] = counted.wait(5)
+        yield '"attribute_description": "Users older than 25"}'
+
+    mock_generate_stream.side_effect = chunks
+
+    events = list(
+        stream_audience_agent(
+            "Find users older than 25", config=mock_config, client=mock_client
+        )
+    )
+
+    stages = [event["stage"] for event in events]
+    assert stages == ["context", "clause", "generated", "validated", "result"]
+    assert events[1]["filter_clause"] == "age > 25"
+    assert "attribute_description" not in events[1]
+    assert seen["counted_before_description"]
+    assert events[-1]["attribute_description"] == "Users older than 25"
+    assert events[-1]["matching_users"] == 42
+
+
+def test_fetch_data_as_strings_returns_plain_rows():
+    from my_function.audiences_app.audiences_agent.agent import fetch_data_as_strings
+
+    mock_client = MagicMock()
+    mock_client.query.return_value.result.return_value = [
+        {"age": 30, "country": "US"},
+        {"age": None, "country": "IN"},
+    ]
+
+    rows = fetch_data_as_strings(mock_client, "p", "d", "t", ["age", "country"])
+
+    assert mock_client.query.call_args.args[0] == (
+        "SELECT `age`, `country` FROM `p.d.t` LIMIT 5"
+    )
+    assert rows == [
+        {"age": "30", "country": "US"},
+        {"age": "None", "country": "IN"},
+    ]
+
+
+def test_warm_up_runs_every_step_despite_failures(mock_config):
+    from my_function.audiences_app.audiences_agent import agent, feedback_sink
+
+    with patch.object(agent, "get_bq_client") as get_bq_client, patch.object(
+        agent, "init_vertex", side_effect=RuntimeError("no credentials")
+    ), patch.object(agent, "get_model_registry") as get_model_registry, patch.object(
+        agent, "load_context_from_gcs", side_effect=[{"columns": []}, {}]
+    ), patch.object(
+        feedback_sink, "get_feedback_sink"
+    ) as get_feedback_sink:
+        timings = agent.warm_up(mock_config)
+
+    assert list(timings) == ["bigquery", "vertexai", "model", "context", "feedback"]
+    get_bq_client.assert_called_once()
+    get_model_registry.return_value.get.assert_called_once()
+    get_feedback_sink.assert_called_once_with(mock_config)
+
+
+def test_warm_up_builds_the_column_index_when_retrieval_is_on(tmp_path):
+    from types import SimpleNamespace
+
+    from my_function.audiences_app.audiences_agent import agent, feedback_sink
+    from my_function.config import AgentConfig
+
+    config = SimpleNamespace(
+        gcp=SimpleNamespace(
+            bucket_name="b", schema_blob_name="s", col_values_blob_name="v"
+        ),
+        agent=AgentConfig(column_top_k=5, column_index_dir=str(tmp_path)),
+    )
+    with patch.object(agent, "get_bq_client"), patch.object(
+        agent, "init_vertex"
+    ), patch.object(agent, "get_model_registry"), patch.object(
+        agent, "load_context_from_gcs", side_effect=[{"columns": []}, {}] * 2
+    ), patch.object(
+        agent, "get_column_retriever"
+    ) as get_column_retriever, patch.object(
+        feedback_sink, "get_feedback_sink"
+    ):
+        timings = agent.warm_up(config)
+
+    assert "columns" in timings
+    get_column_retriever.assert_called_once()
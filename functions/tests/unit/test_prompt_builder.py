@@ -0,0 +1,93 @@
+from unittest.mock import MagicMock, patch
+
+from my_function.audiences_app.audiences_agent import agent
+from my_function.audiences_app.audiences_agent.prompt_builder import PromptBuilder
+
+
+SCHEMA = {
+    "columns": [
+        {"name": "age", "data_type": "INTEGER", "description": "User age"},
+        {"name": "country", "data_type": "STRING", "description": "User country"},
+    ]
+}
+COL_VALUES = {"age": [20, 25, 30, 35], "country": ["US", "IN"]}
+
+
+def test_matches_full_template_render():
+    builder = PromptBuilder(
+        agent.attribute_prompt_template, agent.render_static_prompt_fields
+    )
+
+    expected = agent.attribute_prompt_template.format(
+        attribute_goal="users from {India}",
+        schema_str=agent.format_schema_from_column_list(SCHEMA),
+        sample_json_str=agent.json.dumps(COL_VALUES, indent=2, ensure_ascii=False),
+    )
+
+    assert builder.build("users from {India}", SCHEMA, COL_VALUES) == expected
+
+
+def test_renders_static_part_once_per_version():
+    render_static = MagicMock(return_value={"schema": "S" * 100})
+    builder = PromptBuilder("Q: {attribute_goal}\n{schema}", render_static)
+
+    assert builder.build("a", SCHEMA, COL_VALUES, "v1") == "Q: a\n" + "S" * 100
+    assert builder.build("b", SCHEMA, COL_VALUES, "v1") == "Q: b\n" + "S" * 100
+    assert render_static.call_count == 1
+
+    builder.build("c", SCHEMA, COL_VALUES, "v2")
+    assert render_static.call_count == 2
+
+    prefix = builder.prefix(SCHEMA, COL_VALUES, "v1")
+    assert prefix.prefix_chars == len("Q: \n") + 100
+    assert prefix.estimated_tokens == 26
+    assert builder.stats()["hits"] == 2
+    assert builder.stats()["misses"] == 2
+
+
+def test_evicts_oldest_version():
+    builder = PromptBuilder(
+        "{attribute_goal}{x}", lambda c, v: {"x": "x"}, max_versions=1
+    )
+
+    builder.prefix(SCHEMA, COL_VALUES, "v1")
+    builder.prefix(SCHEMA, COL_VALUES, "v2")
+
+    assert builder.stats()["versions"] == 1
+
+
+def test_dynamic_field_defaults_to_static_render_and_can_be_overridden():
+    builder = PromptBuilder(
+        "{attribute_goal}|{schema}|{values}|{attribute_goal}",
+        lambda c, v: {"schema": "S", "values": "FULL"},
+        dynamic_fields=("values",),
+    )
+
+    assert builder.build("g", SCHEMA, COL_VALUES, "v1") == "g|S|FULL|g"
+    assert builder.build("g", SCHEMA, COL_VALUES, "v1", values="CUT") == "g|S|CUT|g"
+
+    prefix = builder.prefix(SCHEMA, COL_VALUES, "v1")
+    assert (prefix.static_chars, prefix.dynamic_chars) == (len("|S||"), len("FULL"))
+    assert prefix.prefix_chars == len("|S|FULL|")
+
+
+def test_agent_prompt_keeps_relevant_columns_within_budget():
+    from types import SimpleNamespace
+
+    from my_function.audiences_app.audiences_agent import metrics
+    from my_function.config import AgentConfig
+
+    col_values = {**COL_VALUES, "page": [f"/page/{i}" for i in range(500)]}
+    config = SimpleNamespace(
+        agent=AgentConfig(context_token_budget=60, context_full_columns=1)
+    )
+
+    with patch.object(metrics, "REGISTRY", metrics.MetricsRegistry()):
+        prompt, stage = agent.build_audience_prompt(
+            "users from country IN", SCHEMA, col_values, "budget-v1", config
+        )
+        saved = metrics.REGISTRY.prompt_tokens_saved.value()
+
+    assert '"country":["US","IN"]' in prompt
+    assert "/page/499" not in prompt
+    assert stage["tokens_saved"] == saved > 0
@@ -0,0 +1,138 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from my_function.audiences_app.audiences_agent import agent
+from my_function.audiences_app.audiences_agent.query_executor import (
+    QueryBudgetError,
+    QueryExecutor,
+    normalize_sql,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_client(estimated_bytes):
+    dry_run, job = MagicMock(), MagicMock()
+    dry_run.total_bytes_processed = estimated_bytes
+    client = MagicMock()
+    client.query.side_effect = lambda sql, job_config=None: (
+        dry_run if job_config.dry_run else job
+    )
+    return client, job
+
+
+def dry_runs(client):
+    return sum(1 for c in client.query.call_args_list if c.kwargs["job_config"].dry_run)
+
+
+def test_dry_run_is_cached_per_normalized_sql():
+    client, job = make_client(1000)
+    executor = QueryExecutor(max_bytes_per_query=5000)
+
+    assert executor.query(client, "SELECT 1  FROM t\nWHERE a = 1;") is job
+    assert executor.query(client, "SELECT 1 FROM t WHERE a = 1") is job
+
+    assert (
+        normalize_sql("SELECT 1  FROM t\nWHERE a = 1;") == "SELECT 1 FROM t WHERE a = 1"
+    )
+    assert dry_runs(client) == 1
+    assert executor.dry_run_hits == 1
+    job_config = client.query.call_args.kwargs["job_config"]
+    assert job_config.maximum_bytes_billed == 5000
+
+
+def test_whitespace_inside_literals_is_significant():
+    client, _ = make_client(1000)
+    executor = QueryExecutor()
+
+    assert normalize_sql("page  =  'a  b'") == "page = 'a  b'"
+    assert normalize_sql('x = "a  b" AND `my  col` = 1') == (
+        'x = "a  b" AND `my  col` = 1'
+    )
+    assert normalize_sql("page = 'a  b'") != normalize_sql("page = 'a b'")
+
+    executor.query(client, "SELECT 1 FROM t WHERE page = 'a  b'")
+    executor.query(client, "SELECT 1 FROM t WHERE page = 'a b'")
+    assert dry_runs(client) == 2
+
+
+def test_callers_job_config_is_copied_not_modified():
+    from google.cloud import bigquery
+
+    client, job = make_client(1000)
+    job_config = bigquery.QueryJobConfig(labels={"team": "audiences"})
+
+    assert (
+        QueryExecutor(max_bytes_per_query=5000).query(
+            client, "SELECT 1", job_config=job_config
+        )
+        is job
+    )
+
+    sent = [c.kwargs["job_config"] for c in client.query.call_args_list]
+    assert [bool(c.dry_run) for c in sent] == [True, False]
+    assert all(c.labels == {"team": "audiences"} for c in sent)
+    assert sent[1].maximum_bytes_billed == 5000
+    assert job_config.dry_run is None
+    assert job_config.maximum_bytes_billed is None
+
+
+def test_query_over_limit_never_runs():
+    client, _ = make_client(10_000)
+    executor = QueryExecutor(max_bytes_per_query=5000)
+
+    with pytest.raises(QueryBudgetError) as excinfo:
+        executor.query(client, "SELECT 1")
+
+    assert excinfo.value.estimated_bytes == 10_000
+    assert client.query.call_count == 1  # the dry run only
+
+
+def test_user_budget_is_a_sliding_window():
+    clock = FakeClock()
+    client, _ = make_client(600)
+    executor = QueryExecutor(user_bytes_per_window=1000, window_seconds=60, clock=clock)
+
+    executor.query(client, "SELECT 1", user="ana")
+    with pytest.raises(QueryBudgetError):
+        executor.query(client, "SELECT 2", user="ana")
+    executor.query(client, "SELECT 2", user="ben")
+    clock.now += 61
+    executor.query(client, "SELECT 3", user="ana")
+
+    assert executor.spent("ana") == 600
+
+
+@patch.object(agent, "generate")
+@patch.object(agent, "load_context_from_gcs")
+def test_agent_reports_estimate_and_refusal(mock_load_context, mock_generate):
+    schema = {"columns": [{"name": "a", "data_type": "INTEGER"}]}
+    mock_load_context.side_effect = [schema, {}, schema, {}]
+    mock_generate.return_value = (
+        '{"filter_clause": "a = 1", "columns_used": ["a"], '
+        '"attribute_name": "A", "attribute_description": "A"}'
+    )
+    client, job = make_client(2048)
+    job.result.return_value = [{"matching_users": 7}]
+
+    with patch.object(agent, "_query_executor", QueryExecutor()):
+        result = agent.run_audience_agent(
+            "goal", config=MagicMock(), client=client, use_cache=False
+        )
+    assert result["matching_users"] == 7
+    assert result["estimated_bytes"] == 2048
+
+    with patch.object(agent, "_query_executor", QueryExecutor(max_bytes_per_query=1)):
+        refused = agent.run_audience_agent(
+            "goal", config=MagicMock(), client=client, use_cache=False
+        )
+    assert refused["matching_users"] is None
+    assert refused["estimated_bytes"] == 2048
+    assert "over the 1 byte limit" in refused["count_error"]
@@ -0,0 +1,148 @@
+import multiprocessing
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from my_function.audiences_app.audiences_agent import metrics
+from my_function.audiences_app.audiences_agent.rate_limiter import (
+    ConcurrencyGovernor,
+    FileBucketStore,
+    RateLimiter,
+    RateLimitExceeded,
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    with patch.object(metrics, "REGISTRY", metrics.MetricsRegistry()):
+        yield metrics.REGISTRY
+
+
+def limiter(**kwargs):
+    now = [0.0]
+    return RateLimiter(clock=lambda: now[0], **kwargs), now
+
+
+def test_requests_queue_in_arrival_order_once_the_bucket_is_empty():
+    rate, _ = limiter(requests_per_minute=60, max_wait_seconds=10)
+
+    waits = [rate.reserve() for _ in range(62)]
+
+    assert waits[:60] == [0.0] * 60
+    assert waits[60:] == [pytest.approx(1.0), pytest.approx(2.0)]
+
+
+def test_tokens_per_minute_are_charged_for_prompt_and_response():
+    rate, now = limiter(tokens_per_minute=1000, max_wait_seconds=60)
+
+    assert rate.reserve(600) == 0.0
+    rate.charge(300)
+    # 100 tokens left; 600 more leave a 500-token debt at 1000/minute
+    assert rate.reserve(600) == pytest.approx(30.0)
+    now[0] = 90.0
+    assert rate.reserve(100) == 0.0
+
+
+def test_wait_is_bounded_and_a_refused_call_reserves_nothing(fresh_registry):
+    rate, now = limiter(requests_per_minute=60, max_wait_seconds=1.5)
+    for _ in range(61):
+        rate.reserve()
+
+    with pytest.raises(RateLimitExceeded):
+        rate.reserve()
+
+    assert fresh_registry.llm_rate_limited.value() == 1
+    now[0] = 1.0
+    assert rate.reserve() == pytest.approx(1.0)
+
+
+def test_disabled_limiter_never_waits():
+    rate, _ = limiter()
+
+    assert [rate.reserve(10**6) for _ in range(1000)] == [0.0] * 1000
+
+
+def _reserve_from_process(path, results):
+    rate = RateLimiter(
+        requests_per_minute=10, store=FileBucketStore(path), max_wait_seconds=120
+    )
+    results.put([rate.reserve() for _ in range(5)])
+
+
+def test_file_store_shares_the_budget_between_processes(tmp_path):
+    path = str(tmp_path / "bucket.state")
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    workers = [
+        context.Process(target=_reserve_from_process, args=(path, results))
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    waits = [w for _ in workers for w in results.get(timeout=10)]
+    for worker in workers:
+        worker.join()
+
+    assert sum(1 for w in waits if w == 0.0) == 10
+    assert max(waits) == pytest.approx(60.0, abs=0.5)
+
+
+def test_concurrency_governor_bounds_calls_in_flight(fresh_registry):
+    governor = ConcurrencyGovernor(1, max_wait_seconds=0.05)
+    errors = []
+
+    def second_call():
+        try:
+            with governor:
+                pass
+        except RateLimitExceeded as e:
+            errors.append(e)
+
+    with governor:
+        thread = threading.Thread(target=second_call)
+        thread.start()
+        thread.join()
+    with governor:
+        pass
+
+    assert len(errors) == 1
+    assert fresh_registry.llm_rate_limited.value() == 1
+
+
+def test_cancelled_async_acquire_gives_its_slot_back():
+    import asyncio
+
+    governor = ConcurrencyGovernor(1, max_wait_seconds=1)
+
+    async def scenario():
+        release = governor.acquire()  # another call holds the only slot
+        threads = threading.active_count()
+        waiter = asyncio.ensure_future(governor.acquire_async())
+        queued = asyncio.ensure_future(governor.acquire_async())
+        await asyncio.sleep(0.05)
+        assert threading.active_count() == threads  # waits on the loop
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        release()
+        # The slot skips the cancelled waiter and goes to the next one
+        (await queued)()
+        async with governor:
+            return True
+
+    assert asyncio.run(scenario())
+
+
+def test_async_acquire_times_out_without_a_slot(fresh_registry):
+    import asyncio
+
+    governor = ConcurrencyGovernor(1, max_wait_seconds=0.02)
+    release = governor.acquire()
+
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(governor.acquire_async())
+    release()
+
+    assert fresh_registry.llm_rate_limited.value() == 1
+    governor.acquire()()
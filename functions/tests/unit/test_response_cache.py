@@ -0,0 +1,139 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from my_function.audiences_app.audiences_agent import agent
+from my_function.audiences_app.audiences_agent.response_cache import (
+    MemoryBackend,
+    ResponseCache,
+    SQLiteBackend,
+)
+
+RESULT = {
+    "filter_clause": "cart_add = 1",
+    "columns_used": ["cart_add"],
+    "attribute_name": "users who added to cart",
+    "attribute_description": "Users with at least one cart add",
+    "matching_users": 42,
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_exact_and_semantic_hits():
+    cache = ResponseCache(MemoryBackend(), similarity_threshold=0.9)
+    cache.store("Users who added to cart", "v1", "gemini", RESULT)
+
+    assert cache.lookup("  users WHO added to cart. ", "v1", "gemini") == RESULT
+    assert cache.lookup("people who added to the cart", "v1", "gemini") == RESULT
+    assert cache.lookup("users who removed from cart", "v1", "gemini") is None
+    assert cache.lookup("Users who added to cart", "v2", "gemini") is None
+    assert cache.lookup("Users who added to cart", "v1", "other-model") is None
+
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["semantic_hits"], stats["misses"]) == (1, 1, 3)
+    assert stats["hit_rate"] == 0.4
+
+
+def test_similarity_never_ignores_operators_or_negations():
+    cache = ResponseCache(MemoryBackend(), similarity_threshold=0.5)
+    cache.store("users who added to cart and purchased", "v1", "gemini", RESULT)
+    cache.store(
+        "users from the united states on mobile in the last month", "v1", "g", RESULT
+    )
+
+    assert cache.lookup("users who added to cart or purchased", "v1", "gemini") is None
+    assert (
+        cache.lookup(
+            "users from the united states not on mobile in the last month", "v1", "g"
+        )
+        is None
+    )
+    assert (
+        cache.lookup("people who added to cart and purchased", "v1", "gemini") == RESULT
+    )
+
+
+def test_similarity_matching_is_off_by_default():
+    cache = ResponseCache(MemoryBackend())
+    cache.store("Users who added to cart", "v1", "gemini", RESULT)
+
+    assert cache.lookup("people who added to the cart", "v1", "gemini") is None
+
+
+def test_memory_backend_evicts_by_size_and_ttl():
+    clock = FakeClock()
+    backend = MemoryBackend(max_entries=2, ttl_seconds=10, clock=clock)
+    backend.set("a", "s", "a", {"n": 1})
+    backend.set("b", "s", "b", {"n": 2})
+    backend.get("a")
+    backend.set("c", "s", "c", {"n": 3})
+
+    assert backend.get("b") is None  # least recently used
+    assert backend.get("a") == {"n": 1}
+
+    clock.now = 11
+    assert backend.get("a") is None
+    assert backend.scan("s") == []
+
+
+def test_sqlite_backend_persists_across_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    ResponseCache(SQLiteBackend(path)).store(
+        "users who added to cart", "v1", "m", RESULT
+    )
+
+    reopened = ResponseCache(SQLiteBackend(path), similarity_threshold=0.9)
+    assert reopened.lookup("Users who added to cart", "v1", "m") == RESULT
+    assert reopened.lookup("who added to cart users", "v1", "m") == RESULT
+
+
+def test_sqlite_backend_evicts_least_recently_used(tmp_path):
+    clock = FakeClock()
+    backend = SQLiteBackend(str(tmp_path / "c.sqlite3"), max_entries=2, clock=clock)
+    for n, key in enumerate("abc"):
+        clock.now = n
+        backend.set(key, "s", key, {"n": n})
+
+    assert backend.get("a") is None
+    assert len(backend) == 2
+
+
+@patch("my_function.audiences_app.audiences_agent.agent.load_context_from_gcs")
+@patch("my_function.audiences_app.audiences_agent.agent.generate")
+def test_run_audience_agent_reuses_cached_answer(mock_generate, mock_load_context):
+    schema = {"columns": [{"name": "cart_add", "data_type": "INTEGER"}]}
+    col_values = {"cart_add": [0, 1]}
+    mock_load_context.side_effect = [schema, col_values] * 2
+    mock_generate.return_value = (
+        '{"filter_clause": "cart_add = 1", "columns_used": ["cart_add"], '
+        '"attribute_name": "n", "attribute_description": "d"}'
+    )
+    client = MagicMock()
+    client.query.return_value.result.return_value = [{"matching_users": 7}]
+    config = SimpleNamespace(
+        gcp=SimpleNamespace(
+            project_id="p",
+            dataset_id="d",
+            table_name="t",
+            bucket_name="b",
+            schema_blob_name="s.json",
+            col_values_blob_name="v.json",
+            ai_model="gemini-test",
+        )
+    )
+
+    with patch.object(agent, "_response_cache", ResponseCache()), patch.object(
+        agent, "_response_cache_ready", True
+    ):
+        first = agent.run_audience_agent("Cart adders", config=config, client=client)
+        second = agent.run_audience_agent("cart adders!", config=config, client=client)
+
+    assert first == second
+    assert second["matching_users"] == 7
+    assert mock_generate.call_count == 1
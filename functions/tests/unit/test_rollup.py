@@ -0,0 +1,170 @@
+import datetime
+import sqlite3
+from unittest.mock import MagicMock
+
+import pytest
+
+from my_function.audiences_app.audiences_agent.counting import count_many
+from my_function.audiences_app.audiences_agent.rollup import (
+    RollupRewriter,
+    binary_columns,
+    build_refresh_script,
+    build_rollup_select,
+)
+
+DAY = datetime.date(2024, 5, 1)
+EVENTS = [
+    ("2024-05-01 09:00:00", "v1", 1, 0),
+    ("2024-05-01 10:00:00", "v1", 0, 1),
+    ("2024-05-01 11:00:00", "v2", 0, 1),
+    ("2024-05-02 08:00:00", "v2", 1, 1),
+    ("2024-05-02 09:00:00", "v3", 1, 1),
+    ("2024-05-02 10:00:00", "v4", 0, 0),
+]
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE events (date_time TEXT, mcvisid TEXT, cart_add INT, product_view INT)"
+    )
+    conn.executemany("INSERT INTO events VALUES (?, ?, ?, ?)", EVENTS)
+    select = build_rollup_select(
+        "events", ["cart_add", "product_view"], DAY, DAY + datetime.timedelta(days=1)
+    )
+    conn.execute(f"CREATE TABLE rollup AS {select}")
+    return conn
+
+
+def distinct_visitors(conn, table, clause):
+    sql = f"SELECT COUNT(DISTINCT mcvisid) FROM {table} WHERE {clause}"
+    return conn.execute(sql).fetchone()[0]
+
+
+def test_binary_columns_from_context():
+    schema = {
+        "columns": [
+            {"name": "cart_add", "data_type": "INTEGER"},
+            {"name": "visit_num", "data_type": "INTEGER"},
+            {"name": "country", "data_type": "STRING"},
+        ]
+    }
+    values = {"cart_add": [0, 1], "visit_num": [1, 2, 3], "country": ["0", "1"]}
+
+    assert binary_columns(schema, values) == ["cart_add"]
+
+
+@pytest.mark.parametrize(
+    "clause",
+    [
+        "cart_add = 1",
+        "product_view = 0",
+        "cart_add = 1 OR product_view = 0",
+        "(cart_add = 1) or (product_view = 1)",
+    ],
+)
+def test_rewritten_clause_counts_same_visitors(conn, clause):
+    rewriter = RollupRewriter("rollup", ["cart_add", "product_view"])
+
+    rewritten = rewriter.rewrite(clause)
+
+    assert rewritten is not None
+    assert distinct_visitors(conn, "rollup", rewritten) == distinct_visitors(
+        conn, "events", clause
+    )
+
+
+@pytest.mark.parametrize(
+    "clause",
+    [
+        "cart_add = 1 AND product_view = 1",
+        "cart_add > 0",
+        "country = 'US'",
+        "unknown_flag = 1",
+        "(cart_add = 1",
+        "cart_add = 1 OR",
+        "",
+    ],
+)
+def test_ineligible_clauses_are_not_rewritten(clause):
+    rewriter = RollupRewriter("rollup", ["cart_add", "product_view"])
+
+    assert rewriter.rewrite(clause) is None
+
+
+def test_refresh_script_replaces_partitions():
+    script = build_refresh_script(
+        "`p.d.events`", "`p.d.rollup`", ["cart_add"], DAY, DAY
+    )
+
+    assert script.startswith(
+        "DECLARE rollup_exists BOOL DEFAULT EXISTS (\n"
+        "  SELECT 1 FROM `p.d`.INFORMATION_SCHEMA.TABLES\n"
+        "  WHERE table_name = 'rollup');\n"
+        "IF NOT rollup_exists THEN\nCREATE OR REPLACE TABLE `p.d.rollup`"
+    )
+    assert "PARTITION BY event_date" in script
+    assert "DELETE FROM `p.d.rollup`\nWHERE event_date BETWEEN '2024-05-01'" in script
+    assert "MAX(cart_add) AS cart_add__max" in script
+    assert script.endswith("COMMIT TRANSACTION;")
+
+
+def test_missing_rollup_is_backfilled_so_counts_match_raw_events():
+    # Seven days of events, more than the three-day refresh window
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE events (date_time TEXT, mcvisid TEXT, cart_add INT)")
+    conn.executemany(
+        "INSERT INTO events VALUES (?, ?, ?)",
+        [
+            (f"2024-05-0{day} 10:00:00", f"v{visitor}", (day + visitor) % 2)
+            for day in range(1, 8)
+            for visitor in range(day)
+        ],
+    )
+    end = datetime.date(2024, 5, 7)
+    backfill = build_rollup_select("events", ["cart_add"], None, end)
+    script = build_refresh_script(
+        "events", "`p.d.rollup`", ["cart_add"], end - datetime.timedelta(days=2), end
+    )
+
+    assert (
+        f"CREATE OR REPLACE TABLE `p.d.rollup`\nPARTITION BY event_date\nCLUSTER BY mcvisid\nAS {backfill};"
+        in script
+    )
+    conn.execute(f"CREATE TABLE rollup AS {backfill}")
+    rewriter = RollupRewriter("rollup", ["cart_add"])
+    for clause in ("cart_add = 1", "cart_add = 0", "cart_add = 1 OR cart_add = 0"):
+        assert distinct_visitors(
+            conn, "rollup", rewriter.rewrite(clause)
+        ) == distinct_visitors(conn, "events", clause)
+
+
+def test_rebuild_recreates_from_the_whole_history():
+    script = build_refresh_script(
+        "`p.d.events`", "`p.d.rollup`", ["cart_add"], DAY, DAY, rebuild=True
+    )
+
+    assert script.startswith("CREATE OR REPLACE TABLE `p.d.rollup`")
+    assert "WHERE DATE(date_time) <= '2024-05-01'" in script
+    assert "DELETE" not in script
+
+
+def test_count_many_routes_eligible_clauses_to_rollup():
+    config = MagicMock()
+    config.gcp.project_id, config.gcp.dataset_id, config.gcp.table_name = "p", "d", "t"
+    rollup_job, raw_job = MagicMock(), MagicMock()
+    rollup_job.result.return_value = [{"aud_0": 5}]
+    raw_job.result.return_value = [{"aud_0": 7}]
+    client = MagicMock()
+    client.query.side_effect = [rollup_job, raw_job]
+    rewriter = RollupRewriter("`p.d.rollup`", ["cart_add"])
+
+    sizes = count_many(
+        client, config, ["cart_add = 1", "country = 'US'"], rollup=rewriter
+    )
+
+    assert [s.matching_users for s in sizes] == [5, 7]
+    rollup_sql, raw_sql = (c.args[0] for c in client.query.call_args_list)
+    assert "FROM `p.d.rollup`" in rollup_sql and "cart_add__max = 1" in rollup_sql
+    assert "FROM `p.d.t`" in raw_sql and "country = 'US'" in raw_sql